@@ -1,9 +1,24 @@
 import os
 import json
 import traceback
+import math
 import threading
+import hashlib
+import numpy as np
+from io import BytesIO
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from PIL import Image
 from netCDF4 import Dataset
 from flask import Flask, jsonify, request, send_file
+from overlay_render import (OverlayGrid, OVERLAY_FORMAT_VERSION, OVERLAY_VARIANTS, get_overlay_filename, get_variable_name,
+                            get_variant_path, select_cmap_norm, render_slice, encode_png, write_overlay_variants,
+                            difference_cmap_norm)
+import array_cache
+import value_stats
+from array_cache import COORDINATE_NAMES, find_coordinate
 
 app = Flask(__name__)
 
@@ -17,6 +32,613 @@ def get_data_dir_for_date(date):
 def get_heatmap_image_dir_for_date(date):
     return os.path.join(DATE_ROOT_DIR, date, "heatmaps_overlay_cloud_effect")
 
+def get_animation_filename(file_base, alt_idx):
+    return f"{file_base}_alt{alt_idx:03d}_cloud_animation_v{OVERLAY_FORMAT_VERSION}.png"
+
+OVERLAY_MEMORY_CACHE_SIZE = 64
+OVERLAY_GRID_CACHE_SIZE = 16
+
+_overlay_grids = OrderedDict()
+_overlay_grids_lock = threading.Lock()
+_overlay_memory_cache = OrderedDict()
+_overlay_memory_cache_lock = threading.Lock()
+_overlay_render_locks = {}
+_overlay_render_locks_guard = threading.Lock()
+
+@contextmanager
+def single_flight(key):
+    """Serialises work on the same key so concurrent requests wait for one result."""
+    with _overlay_render_locks_guard:
+        key_lock = _overlay_render_locks.setdefault(key, threading.Lock())
+    try:
+        with key_lock:
+            yield
+    finally:
+        with _overlay_render_locks_guard:
+            if _overlay_render_locks.get(key) is key_lock:
+                del _overlay_render_locks[key]
+
+def is_overlay_fresh(image_path, nc_path):
+    """Whether a stored overlay exists and is at least as new as the NetCDF file it was drawn from."""
+    try:
+        image_mtime = os.path.getmtime(image_path)
+    except OSError:
+        return False
+    try:
+        return image_mtime >= os.path.getmtime(nc_path)
+    except OSError:
+        return True
+
+def _overlay_grid(nc_path, mtime, longitude, latitude):
+    """Returns the cached OverlayGrid for nc_path, rebuilt when the file changes."""
+    with _overlay_grids_lock:
+        cached = _overlay_grids.get(nc_path)
+        if cached is not None and cached[0] == mtime:
+            _overlay_grids.move_to_end(nc_path)
+            return cached[1]
+    grid = OverlayGrid(longitude, latitude)
+    with _overlay_grids_lock:
+        _overlay_grids[nc_path] = (mtime, grid)
+        _overlay_grids.move_to_end(nc_path)
+        while len(_overlay_grids) > OVERLAY_GRID_CACHE_SIZE:
+            _overlay_grids.popitem(last=False)
+    return grid
+
+def read_overlay_shape(nc_path):
+    """Returns (n_time, n_alt) of the file's main variable."""
+    mapped = array_cache.load(nc_path)
+    if mapped is not None:
+        return tuple(mapped.values.shape[:2])
+    with netcdf_lock:
+        with Dataset(nc_path, 'r') as ds:
+            return tuple(ds.variables[get_variable_name(nc_path)].shape[:2])
+
+def read_overlay_slice(nc_path, time_idx, alt_idx):
+    """
+    Reads one (lat, lon) slice of the file's main variable and the overlay grid for the file.
+    Grids are cached per file until its mtime changes. Raises IndexError for out-of-range indices.
+    """
+    mtime = os.path.getmtime(nc_path)
+    variable_name = get_variable_name(nc_path)
+    mapped = array_cache.load(nc_path)
+    if mapped is not None:
+        n_time, n_alt = mapped.values.shape[:2]
+        if not (0 <= time_idx < n_time and 0 <= alt_idx < n_alt):
+            raise IndexError(f"Slice t={time_idx}, alt={alt_idx} outside {n_time}x{n_alt}")
+        grid = _overlay_grid(nc_path, mtime, mapped.coordinates['longitude'], mapped.coordinates['latitude'])
+        return grid, mapped.values[time_idx, alt_idx], mapped.variable_name
+    with netcdf_lock:
+        with Dataset(nc_path, 'r') as ds:
+            values = ds.variables[variable_name]
+            n_time, n_alt = values.shape[:2]
+            if not (0 <= time_idx < n_time and 0 <= alt_idx < n_alt):
+                raise IndexError(f"Slice t={time_idx}, alt={alt_idx} outside {n_time}x{n_alt}")
+            data_slice = values[time_idx, alt_idx, :, :]
+            grid = _overlay_grid(nc_path, mtime, ds.variables['longitude'][:], ds.variables['latitude'][:])
+    return grid, data_slice, variable_name
+
+def _remember_overlay_png(image_path, nc_mtime, png_bytes):
+    with _overlay_memory_cache_lock:
+        _overlay_memory_cache[image_path] = (nc_mtime, png_bytes)
+        _overlay_memory_cache.move_to_end(image_path)
+        while len(_overlay_memory_cache) > OVERLAY_MEMORY_CACHE_SIZE:
+            _overlay_memory_cache.popitem(last=False)
+
+def _recall_overlay_png(image_path, nc_mtime):
+    with _overlay_memory_cache_lock:
+        cached = _overlay_memory_cache.get(image_path)
+        if cached is None or cached[0] != nc_mtime:
+            return None
+        _overlay_memory_cache.move_to_end(image_path)
+        return cached[1]
+
+def altitude_cmap_norm(nc_path, variable_name, alt_idx):
+    """
+    Colour scale shared by every time step of one altitude level, from the file's value statistics
+    sidecar. Returns (cmap_norm, provisional). cmap_norm is None (per-slice scaling) for levels
+    without data, and also while the sidecar is missing or stale: then provisional is True and the
+    statistics are computed in the background.
+    """
+    stats = value_stats.load(nc_path)
+    if stats is None:
+        value_stats.ensure_in_background(nc_path, netcdf_lock)
+        return None, True
+    alt_min, alt_max = value_stats.altitude_range(stats, alt_idx)
+    if alt_min is None:
+        return None, False
+    return select_cmap_norm(variable_name, alt_min, alt_max), False
+
+def render_overlay_on_miss(selected_date, file_base, time_idx, alt_idx):
+    """
+    Renders a missing overlay, or one older than its NetCDF file, from the NetCDF slice and stores
+    it next to the pre-generated ones. Concurrent requests for the same slice wait for a single render.
+    Returns (rendered, provisional). rendered is the image path, PNG bytes from the in-memory cache
+    if the overlay directory is not writable, or None when the slice has nothing to draw.
+    While the file's value statistics are pending the slice is drawn on its own scale and returned
+    as PNG bytes with provisional True, without being stored.
+    """
+    image_path = os.path.join(get_heatmap_image_dir_for_date(selected_date),
+                              get_overlay_filename(file_base, time_idx, alt_idx))
+    nc_path = os.path.join(get_data_dir_for_date(selected_date), file_base + '.nc')
+    with single_flight(image_path):
+        if is_overlay_fresh(image_path, nc_path):
+            return image_path, False
+        nc_mtime = os.path.getmtime(nc_path)
+        png_bytes = _recall_overlay_png(image_path, nc_mtime)
+        if png_bytes is not None:
+            return png_bytes, False
+
+        grid, data_slice, variable_name = read_overlay_slice(nc_path, time_idx, alt_idx)
+        cmap_norm, provisional = altitude_cmap_norm(nc_path, variable_name, alt_idx)
+        rgba = render_slice(grid, data_slice, variable_name, cmap_norm=cmap_norm)
+        if rgba is None:
+            return None, provisional
+        if provisional:
+            return encode_png(rgba), True
+
+        try:
+            os.makedirs(os.path.dirname(image_path), exist_ok=True)
+            write_overlay_variants(rgba, image_path)
+            return image_path, False
+        except OSError as e:
+            print(f"Warning: could not store rendered overlay {image_path}: {e}")
+            png_bytes = encode_png(rgba)
+            _remember_overlay_png(image_path, nc_mtime, png_bytes)
+            return png_bytes, False
+
+OVERLAY_FILE_CACHE_BYTES = 128 * 1024 * 1024
+OVERLAY_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+_overlay_file_cache = OrderedDict()
+_overlay_file_cache_bytes = 0
+_overlay_file_cache_lock = threading.Lock()
+
+def choose_overlay_variant(image_path, accept_mimetypes):
+    """
+    Picks the smallest stored encoding of an overlay the client accepts. Lossless WebP is only
+    considered when the Accept header names image/webp; the palette and full PNGs always are.
+    Returns (path, mimetype), or (None, None) if no variant exists.
+    """
+    accepts_webp = any(mimetype == 'image/webp' and quality > 0 for mimetype, quality in accept_mimetypes)
+    best = (None, None, None)
+    for variant in OVERLAY_VARIANTS:
+        if variant == 'webp' and not accepts_webp:
+            continue
+        path = get_variant_path(image_path, variant)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            continue
+        if best[0] is None or size < best[0]:
+            best = (size, path, OVERLAY_VARIANTS[variant][1])
+    return best[1], best[2]
+
+def read_overlay_file(path):
+    """
+    Returns (bytes, strong ETag) for an overlay file, kept in memory up to OVERLAY_FILE_CACHE_BYTES
+    and re-read only when the file's size or mtime changes.
+    """
+    global _overlay_file_cache_bytes
+    st = os.stat(path)
+    signature = (st.st_mtime, st.st_size)
+    with _overlay_file_cache_lock:
+        cached = _overlay_file_cache.get(path)
+        if cached is not None and cached[0] == signature:
+            _overlay_file_cache.move_to_end(path)
+            return cached[1], cached[2]
+    with open(path, 'rb') as f:
+        data = f.read()
+    etag = hashlib.sha256(data).hexdigest()[:32]
+    with _overlay_file_cache_lock:
+        previous = _overlay_file_cache.pop(path, None)
+        if previous is not None:
+            _overlay_file_cache_bytes -= len(previous[1])
+        _overlay_file_cache[path] = (signature, data, etag)
+        _overlay_file_cache_bytes += len(data)
+        while _overlay_file_cache_bytes > OVERLAY_FILE_CACHE_BYTES and len(_overlay_file_cache) > 1:
+            _, (_, evicted, _) = _overlay_file_cache.popitem(last=False)
+            _overlay_file_cache_bytes -= len(evicted)
+    return data, etag
+
+def overlay_version(nc_path):
+    """
+    Version of every overlay and atlas drawn from nc_path, for their v= parameter. It changes
+    whenever the file or OVERLAY_FORMAT_VERSION does, and stale overlays are re-rendered, so a matching v always names the
+    same bytes. Returns None if the file is missing.
+    """
+    try:
+        st = os.stat(nc_path)
+    except OSError:
+        return None
+    return hashlib.sha256(repr((os.path.basename(nc_path), st.st_mtime_ns, st.st_size, OVERLAY_FORMAT_VERSION)).encode('utf-8')).hexdigest()[:20]
+
+def difference_version(scenario_path, bau_path):
+    """Version of the difference overlays of a (scenario, BAU) pair, built from both files' overlay_version."""
+    return hashlib.sha256(f"{overlay_version(scenario_path)}:{overlay_version(bau_path)}".encode('utf-8')).hexdigest()[:20]
+
+def send_overlay_bytes(data, mimetype, etag=None, version=None):
+    """
+    Sends overlay bytes with a strong ETag, or 304 if the client has them. Cached as immutable
+    when the request's v= matches version, otherwise clients revalidate.
+    """
+    etag = etag or hashlib.sha256(data).hexdigest()[:32]
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = send_file(BytesIO(data), mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = OVERLAY_CACHE_CONTROL if version and request.args.get('v') == version else 'no-cache'
+    response.headers['Vary'] = 'Accept'
+    return response
+
+ANIMATION_ATLAS_MAX_SIDE_PX = 4096
+ANIMATION_RENDER_WORKERS = 4
+
+def animation_atlas_layout(n_time, frame_width, frame_height):
+    """
+    Lays n_time frames out row-major on a near-square grid, scaling full-size frames down so
+    neither side of the atlas exceeds ANIMATION_ATLAS_MAX_SIDE_PX (4096 x 4096 is the largest
+    canvas iOS Safari decodes). Returns a layout dict with the atlas frame size.
+    """
+    columns = max(1, math.ceil(math.sqrt(n_time)))
+    rows = max(1, math.ceil(n_time / columns))
+    scale = min(1.0, ANIMATION_ATLAS_MAX_SIDE_PX / (frame_width * columns), ANIMATION_ATLAS_MAX_SIDE_PX / (frame_height * rows))
+    return {'frames': n_time, 'columns': columns, 'rows': rows,
+            'frame_width': max(1, int(frame_width * scale)), 'frame_height': max(1, int(frame_height * scale))}
+
+def build_animation_atlas(selected_date, file_base, alt_idx):
+    """
+    Packs every time step of one altitude into a single sprite atlas (see animation_atlas_layout),
+    stored with the same PNG, palette PNG and WebP variants as the overlays. Time steps without
+    data stay transparent. Frames are rendered by ANIMATION_RENDER_WORKERS threads and pasted one
+    at a time. The atlas is rebuilt when the NetCDF file is newer.
+    Returns (image path or PNG bytes, layout dict, provisional), or (None, None, provisional) if no
+    frame has data. An atlas with provisional frames (see render_overlay_on_miss) is not stored.
+    """
+    nc_path = os.path.join(get_data_dir_for_date(selected_date), file_base + '.nc')
+    atlas_path = os.path.join(get_heatmap_image_dir_for_date(selected_date),
+                              get_animation_filename(file_base, alt_idx))
+    with single_flight(atlas_path):
+        n_time, n_alt = read_overlay_shape(nc_path)
+        if not (0 <= alt_idx < n_alt):
+            raise IndexError(f"Altitude index {alt_idx} outside {n_alt} levels")
+
+        if is_overlay_fresh(atlas_path, nc_path):
+            with Image.open(atlas_path) as atlas:
+                layout = animation_atlas_layout(n_time, 1, 1)
+                layout['frame_width'], layout['frame_height'] = atlas.width // layout['columns'], atlas.height // layout['rows']
+            return atlas_path, layout, False
+
+        atlas, layout, provisional = None, None, False
+        with ThreadPoolExecutor(max_workers=ANIMATION_RENDER_WORKERS) as executor:
+            rendered_frames = executor.map(lambda time_idx: render_overlay_on_miss(selected_date, file_base, time_idx, alt_idx), range(n_time))
+            for time_idx, (rendered, frame_provisional) in enumerate(rendered_frames):
+                provisional = provisional or frame_provisional
+                if rendered is None:
+                    continue
+                with Image.open(BytesIO(rendered) if isinstance(rendered, bytes) else rendered) as frame:
+                    frame = frame.convert('RGBA')
+                if atlas is None:
+                    layout = animation_atlas_layout(n_time, *frame.size)
+                    atlas = Image.new('RGBA', (layout['frame_width'] * layout['columns'], layout['frame_height'] * layout['rows']), (0, 0, 0, 0))
+                frame_size = (layout['frame_width'], layout['frame_height'])
+                if frame.size != frame_size:
+                    frame = frame.resize(frame_size, Image.LANCZOS)
+                atlas.paste(frame, ((time_idx % layout['columns']) * frame_size[0], (time_idx // layout['columns']) * frame_size[1]))
+        if atlas is None:
+            return None, None, provisional
+
+        rgba = np.asarray(atlas)
+        if provisional:
+            return encode_png(rgba), layout, True
+        try:
+            os.makedirs(os.path.dirname(atlas_path), exist_ok=True)
+            write_overlay_variants(rgba, atlas_path)
+            return atlas_path, layout, False
+        except OSError as e:
+            print(f"Warning: could not store animation atlas {atlas_path}: {e}")
+            return encode_png(rgba), layout, False
+
+PROBE_OPEN_FILES = 16
+PROBE_CACHE_SIZE = 4096
+PROBE_CHUNK_CACHE_BYTES = 64 * 1024 * 1024
+
+_probe_datasets = OrderedDict()
+_probe_coordinates = OrderedDict()
+_probe_cache = OrderedDict()
+_probe_cache_lock = threading.Lock()
+
+def _open_probe_dataset(nc_path, mtime):
+    """
+    Returns a persistent read handle for nc_path, reopened when the file changes.
+    The main variable gets a large HDF5 chunk cache so repeated column reads stay in memory.
+    Must be called with netcdf_lock held.
+    """
+    cached = _probe_datasets.get(nc_path)
+    if cached is not None and cached[0] == mtime:
+        _probe_datasets.move_to_end(nc_path)
+        return cached[1]
+    if cached is not None:
+        cached[1].close()
+    ds = Dataset(nc_path, 'r')
+    ds.variables[get_variable_name(nc_path)].set_var_chunk_cache(size=PROBE_CHUNK_CACHE_BYTES)
+    _probe_datasets[nc_path] = (mtime, ds)
+    while len(_probe_datasets) > PROBE_OPEN_FILES:
+        _, (_, evicted) = _probe_datasets.popitem(last=False)
+        evicted.close()
+    return ds
+
+def read_probe_coordinates(nc_path):
+    """
+    Returns {'time', 'altitude', 'latitude', 'longitude'} arrays for a file, cached for the
+    PROBE_OPEN_FILES most recent files until their mtime changes.
+    """
+    mapped = array_cache.load(nc_path)
+    if mapped is not None:
+        return mapped.coordinates
+    mtime = os.path.getmtime(nc_path)
+    with _probe_cache_lock:
+        cached = _probe_coordinates.get(nc_path)
+        if cached is not None and cached[0] == mtime:
+            _probe_coordinates.move_to_end(nc_path)
+            return cached[1]
+    with netcdf_lock:
+        ds = _open_probe_dataset(nc_path, mtime)
+        coordinates = {}
+        for kind in COORDINATE_NAMES:
+            name = find_coordinate(ds, kind)
+            coordinates[kind] = np.ma.filled(np.ma.asarray(ds.variables[name][:], dtype=float), np.nan) if name else np.array([])
+    with _probe_cache_lock:
+        _probe_coordinates[nc_path] = (mtime, coordinates)
+        _probe_coordinates.move_to_end(nc_path)
+        while len(_probe_coordinates) > PROBE_OPEN_FILES:
+            _probe_coordinates.popitem(last=False)
+    return coordinates
+
+def nearest_grid_index(axis_values, value):
+    """Index of the grid point closest to value, or None if value lies more than half a cell outside the axis."""
+    if axis_values.size == 0:
+        return None
+    half_step = float(np.nanmedian(np.abs(np.diff(axis_values)))) / 2 if axis_values.size > 1 else 0.0
+    if not (np.nanmin(axis_values) - half_step <= value <= np.nanmax(axis_values) + half_step):
+        return None
+    return int(np.nanargmin(np.abs(axis_values - value)))
+
+def read_probe_column(nc_path, lat_idx, lon_idx):
+    """
+    Returns the (time, altitude) column of the main variable at one grid cell.
+    Columns are cached per (file, mtime, i, j).
+    """
+    key = (nc_path, os.path.getmtime(nc_path), lat_idx, lon_idx)
+    with _probe_cache_lock:
+        column = _probe_cache.get(key)
+        if column is not None:
+            _probe_cache.move_to_end(key)
+            return column
+    mapped = array_cache.load(nc_path)
+    if mapped is not None:
+        column = np.array(mapped.values[:, :, lat_idx, lon_idx], dtype=float)
+    else:
+        with netcdf_lock:
+            ds = _open_probe_dataset(nc_path, key[1])
+            column = ds.variables[get_variable_name(nc_path)][:, :, lat_idx, lon_idx]
+        column = np.ma.filled(np.ma.asarray(column, dtype=float), np.nan)
+    with _probe_cache_lock:
+        _probe_cache[key] = column
+        while len(_probe_cache) > PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+    return column
+
+def _nan_to_none(values):
+    return [[None if np.isnan(v) else float(v) for v in row] for row in values]
+
+ATR_METRICS = ['Net_ATR', 'NOx', 'H2O', 'CO2', 'AIC']
+
+_atr_tables = {}
+_atr_tables_lock = threading.Lock()
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def _parse_atr_table(atr_data):
+    """
+    Turns ATR_Information.json into columns: lowercased scale type, scale label, cost increase,
+    metric values (n x len(ATR_METRICS)) and their percentage change vs BAU.
+    Entries without a numeric 'Increase in Cost' are dropped, as before.
+    """
+    bau_entry = None
+    for v in atr_data.values():
+        if isinstance(v, dict) and str(v.get('Type', '')).strip().lower() == 'bau':
+            bau_entry = v
+            break
+    if not bau_entry:
+        raise ValueError('BAU entry not found in ATR_Information.json')
+
+    types, labels, cost_increase, rows = [], [], [], []
+    for v in atr_data.values():
+        if not isinstance(v, dict):
+            continue
+        label = str(v.get('Type', '')).strip()
+        if label.lower() == 'bau':
+            continue
+        cost = _to_float(v.get('Increase in Cost'))
+        if np.isnan(cost):
+            continue
+        types.append(label.lower())
+        labels.append(label)
+        cost_increase.append(cost)
+        rows.append([_to_float(v.get(metric)) for metric in ATR_METRICS])
+
+    bau = np.array([_to_float(bau_entry.get(metric)) for metric in ATR_METRICS])
+    values = np.array(rows, dtype=float).reshape(-1, len(ATR_METRICS))
+    valid_bau = np.isfinite(bau) & (bau != 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = np.where(valid_bau, (values - bau) / np.where(valid_bau, bau, 1.0) * 100, np.nan)
+
+    order = np.argsort(np.array(cost_increase, dtype=float), kind='stable')
+    return {
+        'types': np.array(types, dtype=object)[order],
+        'labels': np.array(labels, dtype=object)[order],
+        'cost_increase': np.array(cost_increase, dtype=float)[order],
+        'values': values[order],
+        'bau': bau,
+        'pct': pct[order],
+    }
+
+def load_atr_table(selected_date):
+    """
+    Returns the parsed ATR table for a date, cached until ATR_Information.json changes.
+    Raises FileNotFoundError if the date has no ATR_Information.json.
+    """
+    file_path = os.path.join(get_data_dir_for_date(selected_date), 'ATR_Information.json')
+    mtime = os.path.getmtime(file_path)
+    cached = _atr_tables.get(file_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with _atr_tables_lock:
+        cached = _atr_tables.get(file_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(file_path, 'r') as f:
+            table = _parse_atr_table(json.load(f))
+        _atr_tables[file_path] = (mtime, table)
+        return table
+
+def atr_rows(table, mask):
+    """Serialises the selected rows as [{'cost_increase', <metric>: pct or None, ...}]."""
+    pct = table['pct'][mask]
+    return [
+        dict({'cost_increase': float(cost)}, **{metric: (None if np.isnan(p) else float(p)) for metric, p in zip(ATR_METRICS, row)})
+        for cost, row in zip(table['cost_increase'][mask], pct)
+    ]
+
+DIFFERENCE_CACHE_SIZE = 64
+DIFFERENCE_OVERLAY_CACHE_SIZE = 256
+
+_difference_stats = OrderedDict()
+_difference_overlays = OrderedDict()
+_difference_cache_lock = threading.Lock()
+
+def read_time_step(nc_path, time_idx):
+    """Returns the (alt, lat, lon) block of the main variable at one time step, NaN for missing values."""
+    mapped = array_cache.load(nc_path)
+    if mapped is not None:
+        return mapped.values[time_idx]
+    with netcdf_lock:
+        with Dataset(nc_path, 'r') as ds:
+            block = ds.variables[get_variable_name(nc_path)][time_idx]
+    return np.ma.filled(np.ma.asarray(block, dtype=float), np.nan)
+
+def resolve_difference_pair(selected_date, data_type, scale, cost):
+    """
+    Returns (scenario file_base, BAU file_base) for a date/type/scale/cost selection;
+    either is '' when no matching file exists.
+    """
+    _, _, _, files_map = build_filter_info(selected_date)
+    scales = files_map.get(data_type, {})
+    scenario = ''
+    if scales.get(scale, {}):
+        cost_key = cost if cost in scales[scale] else 'noCost'
+        scenario = scales[scale].get(cost_key, '')
+    bau = scales.get('BAU', {}).get('noCost', '')
+    return scenario, bau
+
+def _difference_key(scenario_path, bau_path):
+    return (scenario_path, os.path.getmtime(scenario_path), bau_path, os.path.getmtime(bau_path))
+
+def _cache_put(cache, key, value, max_size):
+    with _difference_cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+
+def _cache_get(cache, key):
+    with _difference_cache_lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+def compute_difference_stats(scenario_path, bau_path):
+    """
+    Summarises scenario minus BAU over every slice, one time step at a time.
+    Integrated values are plain sums over the lat/lon grid cells of each slice.
+    Memoised per (scenario, BAU) pair and their mtimes.
+    """
+    key = _difference_key(scenario_path, bau_path)
+    stats = _cache_get(_difference_stats, key)
+    if stats is not None:
+        return stats
+    with single_flight(('difference', key)):
+        stats = _cache_get(_difference_stats, key)
+        if stats is not None:
+            return stats
+        n_time, n_alt = read_overlay_shape(scenario_path)
+        if (n_time, n_alt) != read_overlay_shape(bau_path):
+            raise ValueError(f"{os.path.basename(scenario_path)} and {os.path.basename(bau_path)} have different shapes")
+
+        integrated_change = np.full((n_time, n_alt), np.nan)
+        integrated_bau = np.full((n_time, n_alt), np.nan)
+        slice_min = np.full((n_time, n_alt), np.nan)
+        slice_max = np.full((n_time, n_alt), np.nan)
+        for time_idx in range(n_time):
+            bau_block = np.asarray(read_time_step(bau_path, time_idx), dtype=float)
+            diff_block = np.asarray(read_time_step(scenario_path, time_idx), dtype=float) - bau_block
+            has_data = ~np.all(np.isnan(diff_block), axis=(1, 2))
+            if not has_data.any():
+                continue
+            integrated_change[time_idx, has_data] = np.nansum(diff_block[has_data], axis=(1, 2))
+            integrated_bau[time_idx, has_data] = np.nansum(bau_block[has_data], axis=(1, 2))
+            slice_min[time_idx, has_data] = np.nanmin(diff_block[has_data], axis=(1, 2))
+            slice_max[time_idx, has_data] = np.nanmax(diff_block[has_data], axis=(1, 2))
+
+        total_change = float(np.nansum(integrated_change))
+        total_bau = float(np.nansum(integrated_bau))
+        overall_min = float(np.nanmin(slice_min)) if np.isfinite(slice_min).any() else None
+        overall_max = float(np.nanmax(slice_max)) if np.isfinite(slice_max).any() else None
+        stats = {
+            'integrated_change': total_change,
+            'integrated_bau': total_bau,
+            'percentage_change': total_change / total_bau * 100 if total_bau else None,
+            'min_difference': overall_min,
+            'max_difference': overall_max,
+            'max_abs_difference': max(abs(overall_min), abs(overall_max)) if overall_min is not None else None,
+            'integrated_change_per_slice': integrated_change,
+            'min_difference_per_slice': slice_min,
+            'max_difference_per_slice': slice_max,
+        }
+        _cache_put(_difference_stats, key, stats, DIFFERENCE_CACHE_SIZE)
+        return stats
+
+def render_difference_overlay(scenario_path, bau_path, time_idx, alt_idx):
+    """
+    Renders scenario minus BAU for one slice as PNG bytes, on a symmetric scale shared by all
+    slices of the pair so consecutive steps stay comparable. Returns None if there is nothing to draw.
+    """
+    stats = compute_difference_stats(scenario_path, bau_path)
+    key = _difference_key(scenario_path, bau_path) + (time_idx, alt_idx)
+    png_bytes = _cache_get(_difference_overlays, key)
+    if png_bytes is not None:
+        return png_bytes
+    with single_flight(('difference-overlay', key)):
+        png_bytes = _cache_get(_difference_overlays, key)
+        if png_bytes is not None:
+            return png_bytes
+        grid, scenario_slice, variable_name = read_overlay_slice(scenario_path, time_idx, alt_idx)
+        _, bau_slice, _ = read_overlay_slice(bau_path, time_idx, alt_idx)
+        diff_slice = (np.ma.filled(np.ma.asarray(scenario_slice, dtype=float), np.nan)
+                      - np.ma.filled(np.ma.asarray(bau_slice, dtype=float), np.nan))
+        rgba = render_slice(grid, diff_slice, variable_name, cmap_norm=difference_cmap_norm(stats['max_abs_difference']))
+        if rgba is None:
+            return None
+        png_bytes = encode_png(rgba)
+        _cache_put(_difference_overlays, key, png_bytes, DIFFERENCE_OVERLAY_CACHE_SIZE)
+        return png_bytes
+
 def infer_file_details(base_name):
     dt = None
     scale = None
@@ -158,7 +780,10 @@ def get_costs():
 @app.route('/api/get-netcdf-metadata', methods=['GET'])
 def get_netcdf_metadata():
     """
-    Returns metadata (altitudes, times, lon/lat bounds, overall min/max) for a given NetCDF file.
+    Returns metadata (altitudes, times, lon/lat bounds, overall and per-altitude min/max/percentiles)
+    for a given NetCDF file, and versioned overlay/animation URL templates with {time} and
+    {altitude} placeholders. Value ranges come from the file's statistics sidecar and are null
+    while it is being computed.
     Query params: date, dataType, scale, cost
     """
     try:
@@ -180,27 +805,30 @@ def get_netcdf_metadata():
         if not os.path.exists(nc_path):
             return jsonify({'error': f"NetCDF file not found: {file_base}.nc"}), 404
         
-        with netcdf_lock:
-            with Dataset(nc_path, 'r') as ds:
-                alt_keys = [k for k in ds.variables.keys() if k.lower() in ['altitude', 'alt', 'level', 'lev', 'flightlevel', 'fl']]
-                time_keys = [k for k in ds.variables.keys() if k.lower() in ['time', 't']]
-                altitudes = ds.variables[alt_keys[0]][:].tolist() if alt_keys else []
-                times = ds.variables[time_keys[0]][:].tolist() if time_keys else []
-                lon_keys = [k for k in ds.variables.keys() if k.lower() in ['lon', 'longitude']]
-                lat_keys = [k for k in ds.variables.keys() if k.lower() in ['lat', 'latitude']]
-                lon_min = float(ds.variables[lon_keys[0]][:].min()) if lon_keys else None
-                lon_max = float(ds.variables[lon_keys[0]][:].max()) if lon_keys else None
-                lat_min = float(ds.variables[lat_keys[0]][:].min()) if lat_keys else None
-                lat_max = float(ds.variables[lat_keys[0]][:].max()) if lat_keys else None
-                main_var = None
-                for vname, var in ds.variables.items():
-                    if vname.lower() in ['time', 'altitude', 'alt', 'level', 'lev', 'flightlevel', 'fl', 'lon', 'longitude', 'lat', 'latitude']:
-                        continue
-                    if hasattr(var, 'ndim') and var.ndim >= 2:
-                        main_var = var
-                        break
-                overall_min_value = float(main_var[:].min()) if main_var is not None else None
-                overall_max_value = float(main_var[:].max()) if main_var is not None else None
+        mapped = array_cache.load(nc_path)
+        if mapped is not None:
+            coordinates = mapped.coordinates
+            altitudes = coordinates['altitude'].tolist()
+            times = coordinates['time'].tolist()
+            lon_min, lon_max = (float(np.nanmin(coordinates['longitude'])), float(np.nanmax(coordinates['longitude']))) if coordinates['longitude'].size else (None, None)
+            lat_min, lat_max = (float(np.nanmin(coordinates['latitude'])), float(np.nanmax(coordinates['latitude']))) if coordinates['latitude'].size else (None, None)
+        else:
+            with netcdf_lock:
+                with Dataset(nc_path, 'r') as ds:
+                    alt_keys = [k for k in ds.variables.keys() if k.lower() in ['altitude', 'alt', 'level', 'lev', 'flightlevel', 'fl']]
+                    time_keys = [k for k in ds.variables.keys() if k.lower() in ['time', 't']]
+                    altitudes = ds.variables[alt_keys[0]][:].tolist() if alt_keys else []
+                    times = ds.variables[time_keys[0]][:].tolist() if time_keys else []
+                    lon_keys = [k for k in ds.variables.keys() if k.lower() in ['lon', 'longitude']]
+                    lat_keys = [k for k in ds.variables.keys() if k.lower() in ['lat', 'latitude']]
+                    lon_min = float(ds.variables[lon_keys[0]][:].min()) if lon_keys else None
+                    lon_max = float(ds.variables[lon_keys[0]][:].max()) if lon_keys else None
+                    lat_min = float(ds.variables[lat_keys[0]][:].min()) if lat_keys else None
+                    lat_max = float(ds.variables[lat_keys[0]][:].max()) if lat_keys else None
+        stats = value_stats.load(nc_path)
+        if stats is None:
+            value_stats.ensure_in_background(nc_path, netcdf_lock)
+        overlay_params = f"file={quote(file_base)}&date={quote(selected_date)}&v={overlay_version(nc_path)}"
         return jsonify({
             'altitudes': altitudes,
             'times': times,
@@ -208,9 +836,14 @@ def get_netcdf_metadata():
             'lon_max': lon_max,
             'lat_min': lat_min,
             'lat_max': lat_max,
-            'overall_min_value': overall_min_value,
-            'overall_max_value': overall_max_value,
-            'file_base': file_base
+            'overall_min_value': stats['overall']['min'] if stats else None,
+            'overall_max_value': stats['overall']['max'] if stats else None,
+            'overall_percentiles': stats['overall']['percentiles'] if stats else None,
+            'altitude_value_ranges': [{'min': level['min'], 'max': level['max'], 'percentiles': level['percentiles']}
+                                      for level in stats['altitudes']] if stats else None,
+            'file_base': file_base,
+            'overlay_url': f"/api/get-heatmap-overlay?{overlay_params}&time={{time}}&altitude={{altitude}}",
+            'animation_url': f"/api/get-heatmap-animation?{overlay_params}&altitude={{altitude}}"
         })
     except Exception as e:
         print('Exception in get_netcdf_metadata:', e)
@@ -220,9 +853,14 @@ def get_netcdf_metadata():
 @app.route('/api/get-heatmap-overlay', methods=['GET'])
 def get_heatmap_overlay():
     """
-    Serves a pre-generated heatmap overlay image using send_file.
-    Requires ?file=<base_filename>&time=<time_idx>&altitude=<alt_idx>&date=<date>
+    Serves a heatmap overlay image, as lossless WebP or palette PNG when those variants exist and
+    the Accept header allows, with a strong ETag. Cached as immutable when v= matches the
+    overlay_url version returned by get-netcdf-metadata.
+    Overlays not pre-generated by heatmap_gen.py, or older than their NetCDF file, are rendered
+    from the NetCDF slice on first request.
+    Requires ?file=<base_filename>&time=<time_idx>&altitude=<alt_idx>&date=<date>, optional &v=<version>
     """
+    image_filename_for_error = ''
     try:
         requested_file_base = request.args.get('file', '')
         time_idx_str = request.args.get('time', '0')
@@ -230,34 +868,230 @@ def get_heatmap_overlay():
         selected_date = request.args.get('date', '')
         if not requested_file_base or not selected_date:
             return jsonify({'error': 'No file or date specified'}), 400
+        if os.path.basename(requested_file_base) != requested_file_base or os.path.basename(selected_date) != selected_date:
+            return jsonify({'error': 'Invalid file or date'}), 400
         try:
             time_idx = int(time_idx_str)
             alt_idx = int(alt_idx_str)
-            time_idx_padded = f"{time_idx:03d}"
-            alt_idx_padded = f"{alt_idx:03d}"
         except ValueError:
             return jsonify({'error': 'Invalid time or altitude index'}), 400
-        image_filename = f"{requested_file_base}_t{time_idx_padded}_alt{alt_idx_padded}_cloud_overlay.png"
-        heatmap_image_dir = get_heatmap_image_dir_for_date(selected_date)
-        full_image_path = os.path.join(heatmap_image_dir, image_filename)
-
-        print(f"DEBUG (send_file): Attempting to serve full path: {full_image_path}")
-        print(f"DEBUG (send_file): Does the file exist at this path? {os.path.exists(full_image_path)}")
-
+        image_filename = get_overlay_filename(requested_file_base, time_idx, alt_idx)
+        image_filename_for_error = image_filename
+        full_image_path = os.path.join(get_heatmap_image_dir_for_date(selected_date), image_filename)
+        nc_path = os.path.join(get_data_dir_for_date(selected_date), requested_file_base + '.nc')
 
-        if not os.path.exists(full_image_path):
-             print(f"Error (send_file): Image file not found at expected path: {full_image_path}")
-             image_filename_for_error = f"{requested_file_base}_t{time_idx_padded}_alt{alt_idx_padded}_cloud_overlay.png"
-             return jsonify({'error': f"Image file not found: {image_filename_for_error}"}), 404 
+        version = overlay_version(nc_path)
 
-        return send_file(full_image_path, mimetype='image/png') 
+        variant_path, mimetype = choose_overlay_variant(full_image_path, request.accept_mimetypes)
+        if variant_path and is_overlay_fresh(variant_path, nc_path):
+            data, etag = read_overlay_file(variant_path)
+            return send_overlay_bytes(data, mimetype, etag, version)
 
+        if not os.path.exists(nc_path):
+            return jsonify({'error': f"Image file not found: {image_filename}"}), 404
+        try:
+            rendered, provisional = render_overlay_on_miss(selected_date, requested_file_base, time_idx, alt_idx)
+        except IndexError as e:
+            return jsonify({'error': str(e)}), 404
+        if rendered is None:
+            return jsonify({'error': f"No data to render for {image_filename}"}), 404
+        if isinstance(rendered, bytes):
+            # Provisional renders are never cached as immutable, so the shared-scale overlay replaces them.
+            return send_overlay_bytes(rendered, 'image/png', version=None if provisional else version)
+        variant_path, mimetype = choose_overlay_variant(rendered, request.accept_mimetypes)
+        data, etag = read_overlay_file(variant_path)
+        return send_overlay_bytes(data, mimetype, etag, version)
 
     except Exception as e:
-        image_filename_for_error = f"{requested_file_base}_t{time_idx_padded}_alt{alt_idx_padded}_cloud_overlay.png"
         print(f"Unexpected error in get_heatmap_overlay for {image_filename_for_error}: {e}")
+        traceback.print_exc()
         return jsonify({'error': f"An unexpected server error occurred: {str(e)}"}) , 500
 
+@app.route('/api/get-heatmap-animation', methods=['GET'])
+def get_heatmap_animation():
+    """
+    Serves every time step of one altitude as a single sprite atlas, so the time slider needs one
+    request per file/altitude instead of one per time step. Variants and caching headers are the
+    same as for get-heatmap-overlay.
+    Frame i sits at column i % X-Atlas-Columns, row i // X-Atlas-Columns.
+    Requires ?file=<base_filename>&altitude=<alt_idx>&date=<date>, optional &v=<version>
+    """
+    try:
+        requested_file_base = request.args.get('file', '')
+        alt_idx_str = request.args.get('altitude', '0')
+        selected_date = request.args.get('date', '')
+        if not requested_file_base or not selected_date:
+            return jsonify({'error': 'No file or date specified'}), 400
+        if os.path.basename(requested_file_base) != requested_file_base or os.path.basename(selected_date) != selected_date:
+            return jsonify({'error': 'Invalid file or date'}), 400
+        try:
+            alt_idx = int(alt_idx_str)
+        except ValueError:
+            return jsonify({'error': 'Invalid altitude index'}), 400
+
+        nc_path = os.path.join(get_data_dir_for_date(selected_date), requested_file_base + '.nc')
+        if not os.path.exists(nc_path):
+            return jsonify({'error': f"NetCDF file not found: {requested_file_base}.nc"}), 404
+        try:
+            atlas, layout, provisional = build_animation_atlas(selected_date, requested_file_base, alt_idx)
+        except IndexError as e:
+            return jsonify({'error': str(e)}), 404
+        if atlas is None:
+            return jsonify({'error': f"No data to render for {requested_file_base} at altitude {alt_idx}"}), 404
+
+        version = overlay_version(nc_path)
+        if isinstance(atlas, bytes):
+            response = send_overlay_bytes(atlas, 'image/png', version=None if provisional else version)
+        else:
+            variant_path, mimetype = choose_overlay_variant(atlas, request.accept_mimetypes)
+            data, etag = read_overlay_file(variant_path)
+            response = send_overlay_bytes(data, mimetype, etag, version)
+        response.headers['X-Frame-Count'] = str(layout['frames'])
+        response.headers['X-Atlas-Columns'] = str(layout['columns'])
+        response.headers['X-Frame-Width'] = str(layout['frame_width'])
+        response.headers['X-Frame-Height'] = str(layout['frame_height'])
+        return response
+    except Exception as e:
+        print(f"Unexpected error in get_heatmap_animation: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f"An unexpected server error occurred: {str(e)}"}), 500
+
+@app.route('/api/get-probe', methods=['GET'])
+def get_probe():
+    """
+    Returns the main variable (Net ATR / contrails / complexity) at the grid cell nearest to a point,
+    for every time step and altitude: values[time_idx][alt_idx].
+    Requires ?file=<base_filename>&date=<date>&lat=<lat>&lon=<lon>
+    """
+    try:
+        requested_file_base = request.args.get('file', '')
+        selected_date = request.args.get('date', '')
+        if not requested_file_base or not selected_date:
+            return jsonify({'error': 'No file or date specified'}), 400
+        if os.path.basename(requested_file_base) != requested_file_base or os.path.basename(selected_date) != selected_date:
+            return jsonify({'error': 'Invalid file or date'}), 400
+        try:
+            lat = float(request.args.get('lat', ''))
+            lon = float(request.args.get('lon', ''))
+        except ValueError:
+            return jsonify({'error': 'Invalid lat or lon'}), 400
+
+        nc_path = os.path.join(get_data_dir_for_date(selected_date), requested_file_base + '.nc')
+        if not os.path.exists(nc_path):
+            return jsonify({'error': f"NetCDF file not found: {requested_file_base}.nc"}), 404
+
+        coordinates = read_probe_coordinates(nc_path)
+        lat_idx = nearest_grid_index(coordinates['latitude'], lat)
+        lon_idx = nearest_grid_index(coordinates['longitude'], lon)
+        if lat_idx is None or lon_idx is None:
+            return jsonify({'error': f"Point ({lat}, {lon}) is outside the grid of {requested_file_base}"}), 404
+
+        column = read_probe_column(nc_path, lat_idx, lon_idx)
+        return jsonify({
+            'file_base': requested_file_base,
+            'variable': get_variable_name(nc_path),
+            'lat': float(coordinates['latitude'][lat_idx]),
+            'lon': float(coordinates['longitude'][lon_idx]),
+            'lat_idx': lat_idx,
+            'lon_idx': lon_idx,
+            'times': coordinates['time'].tolist(),
+            'altitudes': coordinates['altitude'].tolist(),
+            'values': _nan_to_none(column)
+        })
+    except Exception as e:
+        print('Exception in get_probe:', e)
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+def _difference_request_paths():
+    """Validates date/dataType/scale/cost query params; returns (paths, None) or (None, error response)."""
+    selected_date = request.args.get('date', '')
+    data_type = request.args.get('dataType', '')
+    scale = request.args.get('scale', '')
+    cost = request.args.get('cost', '')
+    if not selected_date or not data_type or not scale:
+        return None, (jsonify({'error': 'Missing required filter(s)'}), 400)
+    if os.path.basename(selected_date) != selected_date:
+        return None, (jsonify({'error': 'Invalid date'}), 400)
+    scenario, bau = resolve_difference_pair(selected_date, data_type, scale, cost)
+    if not scenario:
+        return None, (jsonify({'error': 'No matching NetCDF file for the selected filters'}), 404)
+    if not bau:
+        return None, (jsonify({'error': f"No BAU file for {data_type} on {selected_date}"}), 404)
+    data_dir = get_data_dir_for_date(selected_date)
+    return (os.path.join(data_dir, scenario + '.nc'), os.path.join(data_dir, bau + '.nc')), None
+
+@app.route('/api/get-difference-map', methods=['GET'])
+def get_difference_map():
+    """
+    Returns scenario-minus-BAU summary statistics for a date/type/scale/cost selection, overall and
+    per [time_idx][alt_idx] slice, plus the overlay URL for each slice.
+    Query params: date, dataType, scale, cost
+    """
+    try:
+        paths, error = _difference_request_paths()
+        if error:
+            return error
+        scenario_path, bau_path = paths
+        stats = compute_difference_stats(scenario_path, bau_path)
+        overlay_params = '&'.join(f"{k}={quote(request.args.get(k, ''))}" for k in ['date', 'dataType', 'scale', 'cost'])
+        version = difference_version(scenario_path, bau_path)
+        return jsonify({
+            'scenario_file': os.path.splitext(os.path.basename(scenario_path))[0],
+            'bau_file': os.path.splitext(os.path.basename(bau_path))[0],
+            'integrated_change': stats['integrated_change'],
+            'integrated_bau': stats['integrated_bau'],
+            'percentage_change': stats['percentage_change'],
+            'min_difference': stats['min_difference'],
+            'max_difference': stats['max_difference'],
+            'integrated_change_per_slice': _nan_to_none(stats['integrated_change_per_slice']),
+            'min_difference_per_slice': _nan_to_none(stats['min_difference_per_slice']),
+            'max_difference_per_slice': _nan_to_none(stats['max_difference_per_slice']),
+            'overlay_url': f"/api/get-difference-overlay?{overlay_params}&time={{time}}&altitude={{altitude}}&v={version}"
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        print('Exception in get_difference_map:', e)
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/get-difference-overlay', methods=['GET'])
+def get_difference_overlay():
+    """
+    Serves the scenario-minus-BAU overlay for one slice (blue = lower than BAU, red = higher).
+    The version of the file pair is the ETag, so revalidation answers 304 without rendering.
+    Query params: date, dataType, scale, cost, time, altitude, v (from get-difference-map)
+    """
+    try:
+        paths, error = _difference_request_paths()
+        if error:
+            return error
+        try:
+            time_idx = int(request.args.get('time', '0'))
+            alt_idx = int(request.args.get('altitude', '0'))
+        except ValueError:
+            return jsonify({'error': 'Invalid time or altitude index'}), 400
+        version = difference_version(paths[0], paths[1])
+        if version in request.if_none_match:
+            response = app.response_class(status=304)
+            response.set_etag(version)
+            response.headers['Cache-Control'] = OVERLAY_CACHE_CONTROL if request.args.get('v') == version else 'no-cache'
+            return response
+        try:
+            png_bytes = render_difference_overlay(paths[0], paths[1], time_idx, alt_idx)
+        except IndexError as e:
+            return jsonify({'error': str(e)}), 404
+        if png_bytes is None:
+            return jsonify({'error': 'No data to render for the selected slice'}), 404
+        return send_overlay_bytes(png_bytes, 'image/png', etag=version, version=version)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        print('Exception in get_difference_overlay:', e)
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/get-atr-percentage-increase', methods=['GET'])
 def get_atr_percentage_increase():
     """
@@ -270,63 +1104,79 @@ def get_atr_percentage_increase():
         selected_scale = request.args.get('scale', '')
         if not selected_date or not selected_scale:
             return jsonify({'error': 'No date or scale specified'}), 400
-        data_dir = get_data_dir_for_date(selected_date)
-        file_path = os.path.join(data_dir, 'ATR_Information.json')
-        if not os.path.exists(file_path):
+        try:
+            table = load_atr_table(selected_date)
+        except FileNotFoundError:
             return jsonify({'error': f"ATR_Information.json not found for date {selected_date}"}), 404
-        with open(file_path, 'r') as f:
-            atr_data = json.load(f)
-        bau_entry = None
-        for k, v in atr_data.items():
-            if isinstance(v, dict) and str(v.get('Type', '')).strip().lower() == 'bau':
-                bau_entry = v
-                print(f"Found BAU entry at key: {k}")
-                break
-        if not bau_entry:
-            print("No BAU entry found! Available types:", [v.get('Type', '') for v in atr_data.values() if isinstance(v, dict)])
-            return jsonify({'error': 'BAU entry not found in ATR_Information.json'}), 500
-        results = []
-        print(f"ATR_Information.json keys: {list(atr_data.keys())}")
-        print(f"Selected scale: {selected_scale}")
-        for k, v in atr_data.items():
-            if not isinstance(v, dict):
-                print(f"Skipping key {k}: not a dict")
-                continue
-            v_type = str(v.get('Type', '')).strip().lower()
-            if v_type == 'bau':
-                continue
-            if v_type != selected_scale.strip().lower():
-                print(f"Skipping key {k}: type '{v_type}' != selected_scale '{selected_scale.strip().lower()}'")
-                continue
-            cost_increase = v.get('Increase in Cost')
-            if cost_increase is None:
-                print(f"Skipping key {k}: no 'Increase in Cost' field")
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 500
+        return jsonify({'data': atr_rows(table, table['types'] == selected_scale.strip().lower())})
+    except Exception as e:
+        print('Exception in get_atr_percentage_increase:', e)
+        traceback.print_exc()
+        
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/get-atr-comparison-matrix', methods=['GET'])
+def get_atr_comparison_matrix():
+    """
+    Returns the percentage change vs BAU of every metric for every scale and cost, across dates,
+    in one response: {'metrics': [...], 'dates': {date: {scale: [rows]}}, 'missing': [...]}.
+    Dates without a usable ATR_Information.json are listed in 'missing'.
+    Query params: dates=25022025,20122018 (optional, defaults to all dates)
+    """
+    try:
+        requested = request.args.get('dates', '')
+        if requested:
+            dates = [d for d in requested.split(',') if d]
+        elif os.path.exists(DATE_ROOT_DIR):
+            dates = sorted(f for f in os.listdir(DATE_ROOT_DIR) if os.path.isdir(os.path.join(DATE_ROOT_DIR, f)))
+        else:
+            dates = []
+
+        matrix = {}
+        missing = []
+        for selected_date in dates:
+            if os.path.basename(selected_date) != selected_date:
+                missing.append(selected_date)
                 continue
             try:
-                cost_increase = float(cost_increase)
-            except Exception as ex:
-                print(f"Skipping key {k}: invalid 'Increase in Cost' value: {cost_increase} ({ex})")
+                table = load_atr_table(selected_date)
+            except (FileNotFoundError, ValueError):
+                missing.append(selected_date)
                 continue
-            entry = {'cost_increase': cost_increase}
-            for metric in ['Net_ATR', 'NOx', 'H2O', 'CO2', 'AIC']:
-                bau_val = bau_entry.get(metric)
-                val = v.get(metric)
-                if bau_val is not None and val is not None and bau_val != 0:
-                    pct = ((val - bau_val) / bau_val) * 100
-                else:
-                    pct = None
-                entry[metric] = pct
-                print(f"    Metric: {metric} | BAU: {bau_val} | Value: {val} | %: {pct}")
-            results.append(entry)
-        print(f"Final results: {results}")
-        results.sort(key=lambda x: x['cost_increase'])
-        
-        return jsonify({'data': results})
+            scales = {}
+            for scale_type in dict.fromkeys(table['types']):
+                mask = table['types'] == scale_type
+                scales[table['labels'][mask][0]] = atr_rows(table, mask)
+            matrix[selected_date] = scales
+        return jsonify({'metrics': ATR_METRICS, 'dates': matrix, 'missing': missing})
     except Exception as e:
-        print('Exception in get_atr_percentage_increase:', e)
+        print('Exception in get_atr_comparison_matrix:', e)
         traceback.print_exc()
-        
         return jsonify({'error': str(e)}), 500
 
+_warm_up_started = False
+_warm_up_lock = threading.Lock()
+
+def warm_up():
+    """Writes missing or stale array cache copies, then the value statistics sidecars (read from those copies)."""
+    array_cache.ingest_all(DATE_ROOT_DIR, netcdf_lock)
+    value_stats.ensure_all(DATE_ROOT_DIR, netcdf_lock)
+
+def start_warm_up():
+    """Runs warm_up() in a background thread, once per process."""
+    global _warm_up_started
+    with _warm_up_lock:
+        if _warm_up_started:
+            return
+        _warm_up_started = True
+    threading.Thread(target=warm_up, name='climate-impact-warm-up', daemon=True).start()
+
+# Started at import so it also runs under gunicorn and `flask run`. Under app.run's reloader only
+# the serving child (WERKZEUG_RUN_MAIN=true) starts it, not the watching parent.
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    start_warm_up()
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=4001)
\ No newline at end of file
@@ -0,0 +1,189 @@
+"""
+Memory-mapped copies of the climate impact NetCDF files.
+
+Each <date>/<file_base>.nc gets an <date>/array_cache/<file_base>/ directory holding its main
+variable and coordinates as plain .npy files plus a meta.json recording the source file's size
+and mtime. The app maps them with np.load(mmap_mode='r'), so slice, probe and metadata reads are
+page-cache reads that any number of threads can share without netcdf_lock. Stale or missing
+copies are ignored and the app falls back to reading the NetCDF file.
+
+Copies are written by the app's start-up warm-up in the background, or ahead of time with:
+python array_cache.py [data_dir]
+"""
+import os
+import sys
+import json
+import shutil
+import threading
+from contextlib import nullcontext
+import numpy as np
+from netCDF4 import Dataset
+from overlay_render import get_variable_name
+
+CACHE_DIR_NAME = "array_cache"
+META_FILE_NAME = "meta.json"
+VALUES_FILE_NAME = "values.npy"
+FORMAT_VERSION = 1
+
+COORDINATE_NAMES = {
+    'time': ['time', 't'],
+    'altitude': ['altitude', 'alt', 'level', 'lev', 'flightlevel', 'fl'],
+    'latitude': ['lat', 'latitude'],
+    'longitude': ['lon', 'longitude'],
+}
+
+_mapped = {}
+_mapped_lock = threading.Lock()
+
+def find_coordinate(ds, kind):
+    for k in ds.variables.keys():
+        if k.lower() in COORDINATE_NAMES[kind]:
+            return k
+    return None
+
+def get_cache_dir(nc_path):
+    data_dir, file_name = os.path.split(os.path.abspath(nc_path))
+    return os.path.join(data_dir, CACHE_DIR_NAME, os.path.splitext(file_name)[0])
+
+def _source_signature(nc_path):
+    st = os.stat(nc_path)
+    return {'source_size': st.st_size, 'source_mtime': st.st_mtime}
+
+class MappedArrays:
+    """Read-only memory-mapped main variable and coordinate arrays of one NetCDF file."""
+
+    def __init__(self, cache_dir, meta):
+        self.cache_dir = cache_dir
+        self.meta = meta
+        self.variable_name = meta['variable']
+        self.values = np.load(os.path.join(cache_dir, VALUES_FILE_NAME), mmap_mode='r')
+        self.coordinates = {}
+        for kind in COORDINATE_NAMES:
+            path = os.path.join(cache_dir, f"{kind}.npy")
+            self.coordinates[kind] = np.load(path) if os.path.exists(path) else np.array([])
+
+def _read_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, META_FILE_NAME), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_fresh(nc_path, meta):
+    if not meta or meta.get('version') != FORMAT_VERSION:
+        return False
+    signature = _source_signature(nc_path)
+    return meta.get('source_size') == signature['source_size'] and meta.get('source_mtime') == signature['source_mtime']
+
+def load(nc_path):
+    """
+    Returns MappedArrays for nc_path if an up-to-date copy exists, otherwise None.
+    Mapped copies are kept per path and dropped once the source file changes.
+    """
+    nc_path = os.path.abspath(nc_path)
+    try:
+        signature = _source_signature(nc_path)
+    except OSError:
+        return None
+    cached = _mapped.get(nc_path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    with _mapped_lock:
+        cached = _mapped.get(nc_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        cache_dir = get_cache_dir(nc_path)
+        meta = _read_meta(cache_dir)
+        if not is_fresh(nc_path, meta):
+            _mapped.pop(nc_path, None)
+            return None
+        try:
+            arrays = MappedArrays(cache_dir, meta)
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not map array cache {cache_dir}: {e}")
+            return None
+        _mapped[nc_path] = (signature, arrays)
+        return arrays
+
+def _as_float_array(values, dtype):
+    return np.ma.filled(np.ma.asarray(values, dtype=dtype), np.nan)
+
+def ingest(nc_path, force=False, lock=None):
+    """
+    Writes the memory-mapped copy of nc_path, one time step at a time so the whole variable never
+    has to fit in memory. The copy is assembled in a temporary directory and swapped in at the end.
+    lock, if given, is held around every NetCDF read.
+    Returns the cache directory, or None if the main variable is missing or a coordinate has
+    missing or non-finite values (the app then keeps reading the NetCDF file).
+    """
+    nc_path = os.path.abspath(nc_path)
+    cache_dir = get_cache_dir(nc_path)
+    if not force and is_fresh(nc_path, _read_meta(cache_dir)):
+        return cache_dir
+
+    signature = _source_signature(nc_path)
+    variable_name = get_variable_name(nc_path)
+    tmp_dir = f"{cache_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        with lock or nullcontext():
+            with Dataset(nc_path, 'r') as ds:
+                if variable_name not in ds.variables:
+                    print(f"  Error: Variable '{variable_name}' not found in {nc_path}. Skipping file.")
+                    return None
+                var = ds.variables[variable_name]
+                shape = var.shape
+                dtype = np.float32 if var.dtype == np.float32 else np.float64
+                coordinates = {}
+                for kind in COORDINATE_NAMES:
+                    name = find_coordinate(ds, kind)
+                    if name:
+                        coordinates[kind] = (name, _as_float_array(ds.variables[name][:], np.float64))
+
+        for kind, (name, coordinate) in coordinates.items():
+            if not np.isfinite(coordinate).all():
+                print(f"  Error: Coordinate '{name}' of {nc_path} has missing or non-finite values. Skipping file.")
+                return None
+            np.save(os.path.join(tmp_dir, f"{kind}.npy"), coordinate)
+
+        # The file is reopened per time step so lock is only held for one step's read at a time.
+        out = np.lib.format.open_memmap(os.path.join(tmp_dir, VALUES_FILE_NAME), mode='w+',
+                                        dtype=dtype, shape=shape)
+        for t_idx in range(shape[0]):
+            with lock or nullcontext():
+                with Dataset(nc_path, 'r') as ds:
+                    block = ds.variables[variable_name][t_idx]
+            out[t_idx] = _as_float_array(block, dtype)
+        out.flush()
+        del out
+
+        meta = dict(signature, version=FORMAT_VERSION, variable=variable_name)
+        with open(os.path.join(tmp_dir, META_FILE_NAME), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+        os.replace(tmp_dir, cache_dir)
+        return cache_dir
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def ingest_all(data_root, lock=None):
+    """Ingests every .nc file in data_root and in its date subdirectories."""
+    for root, dirs, files in os.walk(data_root):
+        dirs[:] = [d for d in dirs if d != CACHE_DIR_NAME]
+        for file_name in sorted(files):
+            if not file_name.endswith('.nc'):
+                continue
+            nc_path = os.path.join(root, file_name)
+            try:
+                cache_dir = ingest(nc_path, lock=lock)
+                if cache_dir:
+                    print(f"Array cache for {nc_path} is up to date at {cache_dir}")
+            except Exception as e:
+                print(f"  An unexpected error occurred while ingesting {nc_path}: {e}. Skipping file.")
+
+if __name__ == '__main__':
+    ingest_all(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
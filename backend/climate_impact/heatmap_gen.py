@@ -1,53 +1,17 @@
 import os
 import numpy as np
 from netCDF4 import Dataset
-import matplotlib.pyplot as plt
-import matplotlib.colors as colors
-import cartopy.crs as ccrs
 from datetime import datetime, timedelta
-from scipy.interpolate import griddata
+import value_stats
+from overlay_render import OverlayGrid, get_overlay_filename, get_variable_name, select_cmap_norm, render_slice, write_overlay_variants
 
 DATA_DIR = "./data/"
 OUTPUT_DIR = "heatmaps_overlay_cloud_effect"
 
-FIXED_DIVERGING_ZERO_VMİN = -1.0 
-FIXED_DIVERGING_ZERO_VMAX = 1.0  
-FIXED_DIVERGING_ZERO_VCENTER = 0.0
-
-FIXED_COMPLEXITY_ZERO_VMIN = 0.0
-FIXED_COMPLEXITY_ZERO_VMAX = 1.0
-
-FIG_WIDTH_INCHES = 10
-OUTPUT_DPI = 150
-
-NEW_GRID_RESOLUTION_X = 500
-
 if not os.path.exists(OUTPUT_DIR):
     os.makedirs(OUTPUT_DIR)
     print(f"Created output directory: {OUTPUT_DIR}")
 
-def create_transparent_red_cmap(name="TransparentRed", N=256):
-    cmap_colors = [(1, 0, 0, 0), (1, 0, 0, 1)]
-    return colors.LinearSegmentedColormap.from_list(name, cmap_colors, N)
-
-def create_blue_transparent_red_cmap(name="BlueTransparentRed", N=256):
-    cmap_colors = [(0, 0, 1, 1),
-                   (0.5, 0.5, 0.5, 0),
-                   (1, 0, 0, 1)]
-    return colors.LinearSegmentedColormap.from_list(name, cmap_colors, N)
-
-cmap_transparent_red = create_transparent_red_cmap()
-cmap_blue_transparent_red = create_blue_transparent_red_cmap()
-
-def get_variable_name(file_name):
-    base_name = os.path.splitext(file_name)[0].lower()
-    if 'atr' in base_name:
-        return 'Climate_Impact'
-    elif 'contrails' in base_name:
-        return 'Contrails'
-    else:
-        return 'Complexity'
-
 print(f"Scanning directory: {DATA_DIR}")
 netcdf_files = [f for f in os.listdir(DATA_DIR) if f.endswith('.nc')]
 
@@ -83,16 +47,11 @@ else:
                 n_time, n_alt, n_lat, n_lon = values.shape
                 print(f"  Found {n_time} time steps, {n_alt} altitude levels, Lat={n_lat}, Lon={n_lon}.")
 
-                lon_min, lon_max = float(np.nanmin(longitude)), float(np.nanmax(longitude))
-                lat_min, lat_max = float(np.nanmin(latitude)), float(np.nanmax(latitude))
+                stats = value_stats.ensure(file_path, values=values)
+                print(f"  Value range: [{stats['overall']['min']:.4f}, {stats['overall']['max']:.4f}], colour scale per altitude level.")
 
-                data_aspect_ratio = (lat_max - lat_min) / (lon_max - lon_min) if (lon_max - lon_min) != 0 else 1.0
-                fig_height_inches = FIG_WIDTH_INCHES * data_aspect_ratio
-                NEW_GRID_RESOLUTION_Y = int(NEW_GRID_RESOLUTION_X * data_aspect_ratio)
-
-                new_lons = np.linspace(lon_min, lon_max, NEW_GRID_RESOLUTION_X)
-                new_lats = np.linspace(lat_min, lat_max, NEW_GRID_RESOLUTION_Y)
-                new_lon_grid, new_lat_grid = np.meshgrid(new_lons, new_lats)
+                grid = OverlayGrid(longitude, latitude)
+                lon_min, lon_max, lat_min, lat_max = grid.extent
 
                 for t_idx in range(n_time):
                      for alt_idx in range(n_alt):
@@ -114,118 +73,27 @@ else:
                             print(f"    Processing slice T={t_idx} ({selected_time_str}), Alt={alt_idx} ({altitudes[alt_idx]:.1f})...")
                             print(f"      Original Data Slice Range: [{slice_min:.4f}, {slice_max:.4f}]")
 
-                            if slice_min == slice_max:
-                                constant_value = slice_min
-                                print(f"      Info: Data slice is a constant value: {constant_value:.4f}.")
-
-                                if constant_value == 0.0:
-                                    if variable_name == 'Complexity':
-                                        selected_cmap = cmap_transparent_red
-                                        selected_norm = colors.Normalize(vmin=FIXED_COMPLEXITY_ZERO_VMIN, vmax=FIXED_COMPLEXITY_ZERO_VMAX)
-                                        print(f"      Info: Constant 0 Complexity. Using fixed scale [{FIXED_COMPLEXITY_ZERO_VMIN:.1f}, {FIXED_COMPLEXITY_ZERO_VMAX:.1f}].")
-                                    elif variable_name in ['Climate_Impact', 'Contrails']:
-                                         selected_cmap = cmap_blue_transparent_red
-                                         selected_norm = colors.TwoSlopeNorm(vcenter=FIXED_DIVERGING_ZERO_VCENTER,
-                                                                             vmin=FIXED_DIVERGING_ZERO_VMİN,
-                                                                             vmax=FIXED_DIVERGING_ZERO_VMAX)
-                                         print(f"      Info: Constant 0 Diverging data. Using fixed scale [{FIXED_DIVERGING_ZERO_VMİN:.1f}, {FIXED_DIVERGING_ZERO_VMAX:.1f}] centered at {FIXED_DIVERGING_ZERO_VCENTER:.1f}.")
-                                    else:
-                                         selected_cmap = plt.get_cmap('viridis')
-                                         selected_norm = colors.Normalize(vmin=0.0, vmax=1.0)
-                                         print(f"      Warning: Unknown variable '{variable_name}', constant 0. Using default viridis 0-1 scale.")
-                                else:
-                                     constant_value = slice_min 
-                                     selected_cmap = cmap_transparent_red if variable_name == 'Complexity' else cmap_blue_transparent_red
-
-                                     display_range = abs(constant_value) * 0.1 + 0.1
-                                     vmin_display = constant_value - display_range
-                                     vmax_display = constant_value + display_range
-                                     selected_norm = colors.Normalize(vmin=vmin_display, vmax=vmax_display)
-                                     print(f"      Info: Constant non-zero value ({constant_value:.4f}). Using expanded display range [{vmin_display:.4f}, {vmax_display:.4f}].")
-                            else: 
-                                if variable_name in ['Climate_Impact', 'Contrails']:
-                                    selected_cmap = cmap_blue_transparent_red
-                                    selected_norm = colors.TwoSlopeNorm(vcenter=0.0, 
-                                                                        vmin=slice_min, 
-                                                                        vmax=slice_max)
-                                    print(f"      Info: Diverging data (min != max). Using dynamic scale [{slice_min:.4f}, {slice_max:.4f}] centered at 0.0.")
-
-                                elif variable_name == 'Complexity':
-                                    selected_cmap = cmap_transparent_red
-                                    selected_norm = colors.Normalize(vmin=slice_min, vmax=slice_max)
-                                    print(f"      Info: Complexity data (min != max). Using dynamic scale [{slice_min:.4f}, {slice_max:.4f}].")
-
-                                else:
-                                    print(f"      Warning: Unknown variable '{variable_name}' (min != max). Using default viridis colormap and dynamic bounds [{slice_min:.4f}, {slice_max:.4f}].")
-                                    selected_cmap = plt.get_cmap('viridis')
-                                    selected_norm = colors.Normalize(vmin=slice_min, vmax=slice_max)
-
-                            if slice_min == slice_max and constant_value != 0.0:
-                                interpolated_data = np.full((NEW_GRID_RESOLUTION_Y, NEW_GRID_RESOLUTION_X), constant_value)
-                                print("      Created uniform grid for constant non-zero data.")
-                            else:
-                                print("      Performing interpolation...")
-                                lon_grid_orig, lat_grid_orig = np.meshgrid(longitude, latitude)
-
-                                original_values_flat = data_slice.ravel()
-                                original_lon_flat = lon_grid_orig.ravel()
-                                original_lat_flat = lat_grid_orig.ravel()
-
-                                valid_indices = ~np.isnan(original_values_flat)
-                                valid_values = original_values_flat[valid_indices]
-
-                                valid_points = np.vstack((original_lon_flat[valid_indices], original_lat_flat[valid_indices])).T # Shape (Num_Valid_Points, 2)
-
-                                if valid_points.shape[0] < 2:
-                                    print(f"      Warning: Not enough valid data points ({valid_points.shape[0]}) for interpolation. Skipping slice.")
-                                    continue
-
-                                interpolated_data = griddata(
-                                    valid_points,
-                                    valid_values,
-                                    (new_lon_grid, new_lat_grid),
-                                    method='linear'
-                                )
-                                print("      Interpolation finished.")
-
-                            fig = plt.figure(figsize=(FIG_WIDTH_INCHES, fig_height_inches))
-                            ax = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
-                            fig.subplots_adjust(left=0, right=1, top=1, bottom=0)
-                            ax.set_extent([lon_min, lon_max, lat_min, lat_max], crs=ccrs.PlateCarree())
-
-                            mesh = ax.pcolormesh(new_lon_grid, new_lat_grid, interpolated_data,
-                                                 transform=ccrs.PlateCarree(),
-                                                 cmap=selected_cmap,
-                                                 norm=selected_norm,
-                                                 shading='gouraud')
-
-                            ax.set_axis_off()
-
-                            output_file_name = f"{base_name}_t{t_idx:03d}_alt{alt_idx:03d}_cloud_overlay.png"
-                            output_path = os.path.join(OUTPUT_DIR, output_file_name)
+                            alt_min, alt_max = value_stats.altitude_range(stats, alt_idx)
+                            selected_cmap, selected_norm = select_cmap_norm(variable_name, alt_min, alt_max)
+                            print(f"      Info: {variable_name} using {selected_cmap.name} scale [{selected_norm.vmin:.4f}, {selected_norm.vmax:.4f}].")
 
-                            plt.savefig(output_path,
-                                        dpi=OUTPUT_DPI,
-                                        pad_inches=0,
-                                        transparent=True)
+                            rgba = render_slice(grid, data_slice, variable_name, cmap_norm=(selected_cmap, selected_norm))
+                            if rgba is None:
+                                print(f"      Warning: Not enough valid data points for interpolation. Skipping slice.")
+                                continue
 
-                            print(f"      Saved cloud overlay image to {output_path}")
-                            print(f"      Geographical Extent (for overlay): Lon [{lon_min:.4f}, {lon_max:.4f}], Lat [{lat_min:.4f}, {lat_max:.4f}]")
-                            print(f"      Output Image Size (pixels): {int(FIG_WIDTH_INCHES*OUTPUT_DPI)} x {int(fig_height_inches*OUTPUT_DPI)}")
+                            output_file_name = get_overlay_filename(base_name, t_idx, alt_idx)
+                            output_path = os.path.join(OUTPUT_DIR, output_file_name)
 
+                            sizes = write_overlay_variants(rgba, output_path)
 
-                            plt.close(fig)
+                            print(f"      Saved cloud overlay image to {output_path} "
+                                  f"(png {sizes['png'] / 1024:.0f} KiB, palette {sizes['palette'] / 1024:.0f} KiB, webp {sizes['webp'] / 1024:.0f} KiB)")
+                            print(f"      Geographical Extent (for overlay): Lon [{lon_min:.4f}, {lon_max:.4f}], Lat [{lat_min:.4f}, {lat_max:.4f}]")
+                            print(f"      Output Image Size (pixels): {grid.width_px} x {grid.height_px}")
 
                         except Exception as slice_e:
                             print(f"    An error occurred processing slice T={t_idx}, Alt={alt_idx}: {slice_e}. Skipping slice.")
-                            try:
-                                if 'fig' in locals() and fig is not None:
-                                    plt.close(fig)
-                                if 'mesh' in locals() and mesh is not None:
-                                     del mesh
-                                     mesh = None
-                            except:
-                                pass
 
 
         except FileNotFoundError:
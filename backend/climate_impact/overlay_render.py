@@ -0,0 +1,366 @@
+import io
+import os
+import threading
+import functools
+import numpy as np
+import matplotlib.colors as colors
+from matplotlib import colormaps
+from PIL import Image
+from scipy.interpolate import griddata
+
+FIXED_DIVERGING_ZERO_VMIN = -1.0
+FIXED_DIVERGING_ZERO_VMAX = 1.0
+FIXED_DIVERGING_ZERO_VCENTER = 0.0
+
+FIXED_COMPLEXITY_ZERO_VMIN = 0.0
+FIXED_COMPLEXITY_ZERO_VMAX = 1.0
+
+FIG_WIDTH_INCHES = 10
+OUTPUT_DPI = 150
+
+NEW_GRID_RESOLUTION_X = 500
+
+# Part of every stored overlay's file name. Bump it whenever the rendering or the colour scales
+# change so overlays drawn by an older version are re-rendered instead of served.
+# 2: colour scale per altitude level (value_stats) instead of per slice.
+OVERLAY_FORMAT_VERSION = 2
+
+# pcolormesh(shading='gouraud') splits every grid cell into four triangles around the cell centre
+# (coloured with the mean of the corners) and Agg draws each triangle dilated by half a pixel
+# (span_gouraud::triangle(..., d=0.5)) so neighbours leave no gaps. Where dilated triangles overlap,
+# the colour is blended over itself and its alpha compounds, which is what gives the published
+# overlays their seam pattern; with ~3 px cells that is most pixels. rasterize() reproduces it from
+# each pixel's coverage by the dilated triangles around it, measured on a COVERAGE_SUBPIXELS grid.
+GOURAUD_DILATION_PX = 0.5
+COVERAGE_SUBPIXELS = 64
+
+def create_transparent_red_cmap(name="TransparentRed", N=256):
+    cmap_colors = [(1, 0, 0, 0), (1, 0, 0, 1)]
+    return colors.LinearSegmentedColormap.from_list(name, cmap_colors, N)
+
+def create_blue_transparent_red_cmap(name="BlueTransparentRed", N=256):
+    cmap_colors = [(0, 0, 1, 1),
+                   (0.5, 0.5, 0.5, 0),
+                   (1, 0, 0, 1)]
+    return colors.LinearSegmentedColormap.from_list(name, cmap_colors, N)
+
+cmap_transparent_red = create_transparent_red_cmap()
+cmap_blue_transparent_red = create_blue_transparent_red_cmap()
+
+def get_variable_name(file_name):
+    base_name = os.path.splitext(file_name)[0].lower()
+    if 'atr' in base_name:
+        return 'Climate_Impact'
+    elif 'contrails' in base_name:
+        return 'Contrails'
+    else:
+        return 'Complexity'
+
+def get_overlay_filename(file_base, time_idx, alt_idx):
+    return f"{file_base}_t{time_idx:03d}_alt{alt_idx:03d}_cloud_overlay_v{OVERLAY_FORMAT_VERSION}.png"
+
+def select_cmap_norm(variable_name, slice_min, slice_max):
+    """
+    Returns (cmap, norm) for a value range, mirroring the rules the overlays have always used:
+    diverging TwoSlopeNorm around 0 for Climate_Impact/Contrails, transparent-red for Complexity.
+    TwoSlopeNorm needs vmin < 0 < vmax, so diverging ranges on one side of 0 get the symmetric
+    scale of difference_cmap_norm instead.
+    """
+    if slice_min == slice_max:
+        constant_value = slice_min
+        if constant_value == 0.0:
+            if variable_name == 'Complexity':
+                return cmap_transparent_red, colors.Normalize(vmin=FIXED_COMPLEXITY_ZERO_VMIN, vmax=FIXED_COMPLEXITY_ZERO_VMAX)
+            if variable_name in ['Climate_Impact', 'Contrails']:
+                return cmap_blue_transparent_red, colors.TwoSlopeNorm(vcenter=FIXED_DIVERGING_ZERO_VCENTER,
+                                                                      vmin=FIXED_DIVERGING_ZERO_VMIN,
+                                                                      vmax=FIXED_DIVERGING_ZERO_VMAX)
+            return colormaps['viridis'], colors.Normalize(vmin=0.0, vmax=1.0)
+        selected_cmap = cmap_transparent_red if variable_name == 'Complexity' else cmap_blue_transparent_red
+        display_range = abs(constant_value) * 0.1 + 0.1
+        return selected_cmap, colors.Normalize(vmin=constant_value - display_range, vmax=constant_value + display_range)
+
+    if variable_name in ['Climate_Impact', 'Contrails']:
+        if not slice_min < 0.0 < slice_max:
+            return difference_cmap_norm(max(abs(slice_min), abs(slice_max)))
+        return cmap_blue_transparent_red, colors.TwoSlopeNorm(vcenter=0.0, vmin=slice_min, vmax=slice_max)
+    if variable_name == 'Complexity':
+        return cmap_transparent_red, colors.Normalize(vmin=slice_min, vmax=slice_max)
+    return colormaps['viridis'], colors.Normalize(vmin=slice_min, vmax=slice_max)
+
+def difference_cmap_norm(max_abs):
+    """Diverging blue-transparent-red scale symmetric around 0, for scenario minus BAU maps."""
+    max_abs = max_abs if max_abs and np.isfinite(max_abs) and max_abs > 0 else FIXED_DIVERGING_ZERO_VMAX
+    return cmap_blue_transparent_red, colors.TwoSlopeNorm(vcenter=0.0, vmin=-max_abs, vmax=max_abs)
+
+class OverlayGrid:
+    """
+    Target grid of an overlay: the regular lon/lat grid the slice is interpolated onto
+    and the pixel size of the PNG, matching the old cartopy figure (FIG_WIDTH_INCHES at OUTPUT_DPI).
+    """
+
+    def __init__(self, longitude, latitude):
+        self.longitude = np.asarray(longitude)
+        self.latitude = np.asarray(latitude)
+        self.lon_min, self.lon_max = float(np.nanmin(self.longitude)), float(np.nanmax(self.longitude))
+        self.lat_min, self.lat_max = float(np.nanmin(self.latitude)), float(np.nanmax(self.latitude))
+
+        lon_span = self.lon_max - self.lon_min
+        self.aspect_ratio = (self.lat_max - self.lat_min) / lon_span if lon_span != 0 else 1.0
+        self.fig_height_inches = FIG_WIDTH_INCHES * self.aspect_ratio
+        self.res_x = NEW_GRID_RESOLUTION_X
+        self.res_y = int(NEW_GRID_RESOLUTION_X * self.aspect_ratio)
+
+        # Agg truncates the figure size in pixels, so do the same here.
+        self.width_px = int(FIG_WIDTH_INCHES * OUTPUT_DPI)
+        self.height_px = int(self.fig_height_inches * OUTPUT_DPI)
+
+        self.new_lons = np.linspace(self.lon_min, self.lon_max, self.res_x)
+        self.new_lats = np.linspace(self.lat_min, self.lat_max, self.res_y)
+        self._new_grid = None
+        self._orig_points = None
+
+    @property
+    def extent(self):
+        return [self.lon_min, self.lon_max, self.lat_min, self.lat_max]
+
+    def new_grid(self):
+        if self._new_grid is None:
+            self._new_grid = np.meshgrid(self.new_lons, self.new_lats)
+        return self._new_grid
+
+    def orig_points(self):
+        if self._orig_points is None:
+            lon_grid_orig, lat_grid_orig = np.meshgrid(self.longitude, self.latitude)
+            self._orig_points = np.vstack((lon_grid_orig.ravel(), lat_grid_orig.ravel())).T
+        return self._orig_points
+
+def interpolate_slice(grid, data_slice):
+    """
+    Linearly interpolates a (lat, lon) slice onto the overlay grid.
+    Returns None when there are fewer than two valid points.
+    """
+    values_flat = np.ma.filled(np.ma.asarray(data_slice, dtype=float), np.nan).ravel()
+    valid_indices = ~np.isnan(values_flat)
+    if np.count_nonzero(valid_indices) < 2:
+        return None
+    new_lon_grid, new_lat_grid = grid.new_grid()
+    return griddata(grid.orig_points()[valid_indices], values_flat[valid_indices],
+                    (new_lon_grid, new_lat_grid), method='linear')
+
+def _pixel_sample_positions(n_pixels, n_vertices, span_px, offset_px=0.0):
+    # Pixel centres expressed as fractional vertex indices along one axis, for vertices spread
+    # evenly over span_px pixels starting offset_px pixels before the first pixel edge.
+    positions = (np.arange(n_pixels) + 0.5 + offset_px) * (n_vertices - 1) / span_px
+    lower = np.clip(np.floor(positions).astype(np.intp), 0, max(n_vertices - 2, 0))
+    upper = np.minimum(lower + 1, n_vertices - 1)
+    weight = np.clip(positions - lower, 0.0, 1.0)[:, None]
+    return lower, upper, weight
+
+def _inside_dilated_triangle(x, y, corners, dilation):
+    """Whether points lie inside a triangle whose edges are pushed out by dilation with bevelled corners, as Agg dilates them."""
+    centroid = corners.mean(axis=0)
+    inside = np.ones(np.broadcast(x, y).shape, dtype=bool)
+    normals = []
+    for k in range(3):
+        start, end = corners[k], corners[(k + 1) % 3]
+        normal = np.array([end[1] - start[1], start[0] - end[0]]) / np.hypot(*(end - start))
+        if np.dot(centroid - start, normal) > 0:
+            normal = -normal
+        normals.append(normal)
+        inside &= (x - start[0]) * normal[0] + (y - start[1]) * normal[1] <= dilation
+    for k in range(3):
+        bisector = normals[k - 1] + normals[k]
+        length = np.hypot(*bisector)
+        inside &= ((x - corners[k][0]) * bisector[0] + (y - corners[k][1]) * bisector[1]) / length <= dilation * length / 2
+    return inside
+
+def _multiply_u8(a, b):
+    # Agg's rgba8 multiply: a * b / 255, rounded.
+    t = a * b + 128
+    return ((t >> 8) + t) >> 8
+
+def _blend_alpha_u8(source, destination):
+    # Alpha of matplotlib's plain RGBA blender (fixed_blender_rgba_plain) after one blend.
+    return (((source + destination) << 8) - source * destination) >> 8
+
+class SeamCoverage:
+    """
+    Coverage of a pixel by the dilated gouraud triangles around it, for every position of the pixel
+    within its grid cell in steps of 1 / COVERAGE_SUBPIXELS px. For the pixel whose top-left corner
+    sits (bx, by) steps right of and below its cell's top-left vertex, coverage[by, bx, k] is the
+    0-255 coverage by its k-th largest overlapping triangle and cell_offsets[by, bx, k] the
+    (row, column) of that triangle's cell relative to the pixel's. blended_alpha[by * n_x + bx, a]
+    is the pixel's alpha once every one of those triangles has been drawn with alpha a.
+    """
+
+    def __init__(self, cell_width, cell_height, dilation):
+        steps = COVERAGE_SUBPIXELS
+        n_x, n_y = int(np.ceil(cell_width * steps)), int(np.ceil(cell_height * steps))
+        # Coverages are box sums over one point-sampled mask per triangle.
+        sample_x = (np.arange(n_x + steps) + 0.5) / steps
+        sample_y = (np.arange(n_y + steps) + 0.5)[:, None] / steps
+        reach_x = int(np.ceil((1 + dilation) / cell_width))
+        reach_y = int(np.ceil((1 + dilation) / cell_height))
+
+        coverages, offsets = [], []
+        for row in range(-1, reach_y + 1):
+            for column in range(-1, reach_x + 1):
+                left, top = column * cell_width, row * cell_height
+                a, b = (left, top), (left + cell_width, top)
+                c, d = (left + cell_width, top + cell_height), (left, top + cell_height)
+                centre = (left + cell_width / 2, top + cell_height / 2)
+                for p, q in ((a, b), (b, c), (c, d), (d, a)):
+                    mask = _inside_dilated_triangle(sample_x, sample_y, np.array([p, q, centre]), dilation)
+                    summed = np.pad(mask.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+                    box = (summed[steps:steps + n_y, steps:steps + n_x] - summed[:n_y, steps:steps + n_x]
+                           - summed[steps:steps + n_y, :n_x] + summed[:n_y, :n_x])
+                    coverages.append(box / steps ** 2)
+                    offsets.append((row, column))
+
+        coverages = np.stack(coverages, axis=-1)
+        n_overlapping = int((coverages > 0).sum(axis=-1).max())
+        order = np.argsort(-coverages, axis=-1)[..., :n_overlapping]
+        self.coverage = (np.take_along_axis(coverages, order, axis=-1) * 255 + 0.5).astype(np.int32)
+        self.cell_offsets = np.asarray(offsets, dtype=np.intp)[order]
+        self.reach = (reach_y, reach_x)
+
+        alpha = np.arange(256, dtype=np.int32)[None]
+        blended = np.zeros((n_y * n_x, 256), dtype=np.int32)
+        for k in range(n_overlapping):
+            blended = _blend_alpha_u8(_multiply_u8(alpha, self.coverage[..., k].reshape(-1, 1)), blended)
+        self.blended_alpha = blended.astype(np.uint8)
+
+@functools.lru_cache(maxsize=4)
+def seam_coverage(cell_width, cell_height, dilation=GOURAUD_DILATION_PX):
+    """SeamCoverage for a cell size in pixels, shared by every overlay drawn on that grid."""
+    return SeamCoverage(cell_width, cell_height, dilation)
+
+def rasterize(grid, interpolated_data, cmap, norm):
+    """
+    Colours the interpolated grid and resamples it to the overlay's pixel size the way Agg draws
+    pcolormesh(shading='gouraud'): colours are looked up at the grid vertices and blended linearly
+    between them, cells with a NaN corner are left out, and every overlapping dilated triangle is
+    blended over the pixel with Agg's 8-bit arithmetic (see GOURAUD_DILATION_PX).
+    Vertices are placed on the same pixel grid as the figure: the width is exact, while the height
+    of fig_height_inches * OUTPUT_DPI px is truncated at the top.
+    Returns an (height_px, width_px, 4) uint8 RGBA array with north at the top.
+    """
+    vertex_rgba = cmap(norm(np.ma.masked_invalid(interpolated_data))).astype(np.float32)[::-1]
+    valid = np.isfinite(np.asarray(interpolated_data, dtype=float))[::-1]
+    n_rows, n_columns = vertex_rgba.shape[:2]
+
+    # Image rows, and so vertex rows here, run north to south.
+    span_x = grid.width_px
+    span_y = grid.fig_height_inches * OUTPUT_DPI
+    top = span_y - grid.height_px
+    x_lower, x_upper, x_weight = _pixel_sample_positions(grid.width_px, n_columns, span_x)
+    y_lower, y_upper, y_weight = _pixel_sample_positions(grid.height_px, n_rows, span_y, top)
+    rows = vertex_rgba[y_lower] * (1 - y_weight)[:, None] + vertex_rgba[y_upper] * y_weight[:, None]
+    pixels = rows[:, x_lower] * (1 - x_weight)[None] + rows[:, x_upper] * x_weight[None]
+
+    # Quads padded with invalid ones, so triangles of cells outside the grid count for nothing.
+    quad_valid = np.pad(valid[:-1, :-1] & valid[1:, :-1] & valid[:-1, 1:] & valid[1:, 1:], 1)
+    alpha = (np.clip(pixels[..., 3], 0.0, 1.0) * 255 + 0.5).astype(np.int32)
+    alpha[~quad_valid[y_lower[:, None] + 1, x_lower[None] + 1]] = 0
+
+    cell_width, cell_height = span_x / (n_columns - 1), span_y / (n_rows - 1)
+    seams = seam_coverage(round(cell_width, 6), round(cell_height, 6))
+    n_steps_y, n_steps_x = seams.coverage.shape[:2]
+    pixel_x = np.arange(grid.width_px, dtype=float)
+    pixel_y = np.arange(grid.height_px, dtype=float) + top
+    cell_column = np.floor(pixel_x / cell_width).astype(np.intp)
+    cell_row = np.floor(pixel_y / cell_height).astype(np.intp)
+    step_x = np.minimum(((pixel_x - cell_column * cell_width) * COVERAGE_SUBPIXELS).astype(np.intp), n_steps_x - 1)
+    step_y = np.minimum(((pixel_y - cell_row * cell_height) * COVERAGE_SUBPIXELS).astype(np.intp), n_steps_y - 1)
+    position = step_y[:, None] * n_steps_x + step_x[None]
+    blended = seams.blended_alpha.ravel()[position * 256 + alpha]
+
+    # Next to missing cells and the image edges only some of the triangles are drawn.
+    reach_y, reach_x = seams.reach
+    missing = np.pad(~quad_valid, ((1, reach_y), (1, reach_x)), constant_values=True)
+    near_missing = np.zeros_like(quad_valid)
+    for row in range(reach_y + 2):
+        for column in range(reach_x + 2):
+            near_missing |= missing[row:row + quad_valid.shape[0], column:column + quad_valid.shape[1]]
+    partial = near_missing[np.clip(cell_row + 1, 0, quad_valid.shape[0] - 1)[:, None],
+                           np.clip(cell_column + 1, 0, quad_valid.shape[1] - 1)[None]]
+    partial_rows, partial_columns = np.nonzero(partial)
+    partial_alpha = alpha[partial_rows, partial_columns]
+    partial_steps = (step_y[partial_rows], step_x[partial_columns])
+    partial_blended = np.zeros_like(partial_alpha)
+    for k in range(seams.coverage.shape[-1]):
+        offsets = seams.cell_offsets[partial_steps + (k,)]
+        drawn = quad_valid[np.clip(cell_row[partial_rows] + offsets[:, 0] + 1, 0, quad_valid.shape[0] - 1),
+                           np.clip(cell_column[partial_columns] + offsets[:, 1] + 1, 0, quad_valid.shape[1] - 1)]
+        source = _multiply_u8(partial_alpha, seams.coverage[partial_steps + (k,)]) * drawn
+        partial_blended = _blend_alpha_u8(source, partial_blended)
+    blended[partial_rows, partial_columns] = partial_blended
+
+    rgba = (np.clip(pixels, 0.0, 1.0) * 255 + 0.5).astype(np.uint8)
+    rgba[..., 3] = blended
+    return rgba
+
+def render_slice(grid, data_slice, variable_name, cmap_norm=None):
+    """
+    Renders one (lat, lon) slice to an RGBA array, using cmap_norm=(cmap, norm) instead of the
+    per-variable rules when given.
+    Returns None for all-NaN slices or slices without enough points to interpolate.
+    """
+    data_slice = np.ma.filled(np.ma.asarray(data_slice, dtype=float), np.nan)
+    if np.all(np.isnan(data_slice)):
+        return None
+    slice_min = float(np.nanmin(data_slice))
+    slice_max = float(np.nanmax(data_slice))
+    selected_cmap, selected_norm = cmap_norm or select_cmap_norm(variable_name, slice_min, slice_max)
+
+    if slice_min == slice_max and slice_min != 0.0:
+        interpolated_data = np.full((grid.res_y, grid.res_x), slice_min)
+    else:
+        interpolated_data = interpolate_slice(grid, data_slice)
+        if interpolated_data is None:
+            return None
+    return rasterize(grid, interpolated_data, selected_cmap, selected_norm)
+
+def encode_png(rgba):
+    buffer = io.BytesIO()
+    Image.fromarray(rgba).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def encode_palette_png(rgba):
+    """8-bit palette PNG with per-entry alpha. The overlay colormaps are single ramps, so 256 entries lose next to nothing."""
+    buffer = io.BytesIO()
+    Image.fromarray(rgba).quantize(colors=256, method=Image.Quantize.FASTOCTREE).save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+def encode_webp(rgba):
+    buffer = io.BytesIO()
+    Image.fromarray(rgba).save(buffer, format='WEBP', lossless=True, quality=80, method=4)
+    return buffer.getvalue()
+
+# Smaller encodings written next to every <name>.png overlay, as (file suffix, mimetype, encoder).
+OVERLAY_VARIANTS = {
+    'png': ('.png', 'image/png', encode_png),
+    'palette': ('.pal.png', 'image/png', encode_palette_png),
+    'webp': ('.webp', 'image/webp', encode_webp),
+}
+
+def get_variant_path(png_path, variant):
+    return os.path.splitext(png_path)[0] + OVERLAY_VARIANTS[variant][0]
+
+def write_overlay_variants(rgba, png_path):
+    """
+    Writes the full PNG and its palette PNG and lossless WebP variants. Each file is written to a
+    temporary name and renamed into place, so readers never see a partial image.
+    Returns {variant: size in bytes}.
+    """
+    sizes = {}
+    for variant, (_, _, encoder) in OVERLAY_VARIANTS.items():
+        output_path = get_variant_path(png_path, variant)
+        data = encoder(rgba)
+        tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, output_path)
+        sizes[variant] = len(data)
+    return sizes
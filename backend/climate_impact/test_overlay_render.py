@@ -0,0 +1,86 @@
+"""
+Pins render_slice() to the matplotlib rendering it replaced.
+
+The overlays used to be drawn with pcolormesh(shading='gouraud') on a borderless figure of
+FIG_WIDTH_INCHES x fig_height_inches at OUTPUT_DPI, saved with transparent=True. render_slice()
+reproduces that figure without matplotlib's drawing path, so its constants are not tuned by eye:
+GOURAUD_DILATION_PX is Agg's own gouraud dilation (span_gouraud::triangle(..., 0.5)), triangles are
+split around the cell centre as QuadMesh does, and alphas are blended with Agg's 8-bit arithmetic.
+The remaining difference comes from measuring coverage on a COVERAGE_SUBPIXELS grid instead of
+Agg's exact scanline cells.
+
+Tolerances, in 0-255 steps over the whole image:
+- alpha: mean absolute difference <= 2, 99th percentile <= 6, maximum <= 24
+- colour: maximum difference <= 6 where both images have alpha > 32 (fainter pixels carry
+  too little colour to compare)
+"""
+import io
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+from PIL import Image
+
+from overlay_render import (FIG_WIDTH_INCHES, OUTPUT_DPI, OverlayGrid, interpolate_slice,
+                            render_slice, select_cmap_norm)
+
+ALPHA_MEAN_TOLERANCE = 2
+ALPHA_P99_TOLERANCE = 6
+ALPHA_MAX_TOLERANCE = 24
+COLOUR_MAX_TOLERANCE = 6
+COLOUR_MIN_ALPHA = 32
+
+def synthetic_slice(seed, offset=0.0, nan_fraction=0.05, n_lon=60, n_lat=40):
+    rng = np.random.default_rng(seed)
+    longitude = np.linspace(-10.0, 30.0, n_lon)
+    latitude = np.linspace(35.0, 70.0, n_lat)
+    lon_grid, lat_grid = np.meshgrid(longitude, latitude)
+    data_slice = (np.sin(lon_grid / 7 + rng.uniform(0, 6)) * np.cos(lat_grid / 5 + rng.uniform(0, 6))
+                  + offset + 0.2 * rng.standard_normal(lon_grid.shape))
+    data_slice[rng.random(lon_grid.shape) < nan_fraction] = np.nan
+    return longitude, latitude, data_slice
+
+def render_reference(grid, data_slice, variable_name):
+    """The original matplotlib rendering of one slice."""
+    selected_cmap, selected_norm = select_cmap_norm(variable_name, float(np.nanmin(data_slice)), float(np.nanmax(data_slice)))
+    lon_grid, lat_grid = grid.new_grid()
+    fig = plt.figure(figsize=(FIG_WIDTH_INCHES, grid.fig_height_inches))
+    ax = fig.add_subplot(1, 1, 1)
+    fig.subplots_adjust(left=0, right=1, top=1, bottom=0)
+    ax.set_xlim(grid.lon_min, grid.lon_max)
+    ax.set_ylim(grid.lat_min, grid.lat_max)
+    ax.pcolormesh(lon_grid, lat_grid, interpolate_slice(grid, data_slice),
+                  cmap=selected_cmap, norm=selected_norm, shading='gouraud')
+    ax.set_axis_off()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, dpi=OUTPUT_DPI, pad_inches=0, transparent=True)
+    plt.close(fig)
+    return np.asarray(Image.open(buffer).convert('RGBA'))
+
+@pytest.mark.parametrize("variable_name, offset, seed, nan_fraction", [
+    ("Climate_Impact", 0.0, 0, 0.05),
+    ("Contrails", 0.3, 1, 0.05),
+    ("Complexity", 2.0, 2, 0.05),
+    ("Climate_Impact", 0.0, 3, 0.0),
+])
+def test_render_slice_matches_matplotlib(variable_name, offset, seed, nan_fraction):
+    longitude, latitude, data_slice = synthetic_slice(seed, offset, nan_fraction)
+    grid = OverlayGrid(longitude, latitude)
+
+    expected = render_reference(grid, data_slice, variable_name).astype(int)
+    rendered = render_slice(grid, data_slice, variable_name).astype(int)
+    assert rendered.shape == expected.shape == (grid.height_px, grid.width_px, 4)
+
+    alpha_error = np.abs(rendered[..., 3] - expected[..., 3])
+    assert alpha_error.mean() <= ALPHA_MEAN_TOLERANCE
+    assert np.percentile(alpha_error, 99) <= ALPHA_P99_TOLERANCE
+    assert alpha_error.max() <= ALPHA_MAX_TOLERANCE
+
+    opaque = (rendered[..., 3] > COLOUR_MIN_ALPHA) & (expected[..., 3] > COLOUR_MIN_ALPHA)
+    assert np.abs(rendered[..., :3] - expected[..., :3])[opaque].max() <= COLOUR_MAX_TOLERANCE
+
+def test_render_slice_skips_all_nan_slices():
+    longitude, latitude, data_slice = synthetic_slice(0, nan_fraction=1.0)
+    assert render_slice(OverlayGrid(longitude, latitude), data_slice, "Climate_Impact") is None
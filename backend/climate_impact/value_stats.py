@@ -0,0 +1,217 @@
+"""
+Value statistics sidecars for the climate impact NetCDF files.
+
+Each <date>/<file_base>.nc gets a <date>/<file_base>.stats.json holding min/max/mean and
+percentiles of its main variable, overall and per altitude level, plus the source file's size and
+mtime. They are collected in one pass over the time steps, so colour scales that stay the same
+across time steps cost no extra read at render or request time. Percentiles come from an evenly
+strided sample of each level (SAMPLE_SIZE values at most), which is plenty for colour limits.
+
+Sidecars are written by heatmap_gen.py, by the app's start-up warm-up (in the background, so
+requests only ever read them), or ahead of time with:
+python value_stats.py [data_dir]
+"""
+import os
+import sys
+import json
+import math
+import threading
+from contextlib import nullcontext
+import numpy as np
+from netCDF4 import Dataset
+import array_cache
+from overlay_render import get_variable_name
+
+STATS_SUFFIX = ".stats.json"
+FORMAT_VERSION = 1
+PERCENTILES = [1, 5, 25, 50, 75, 95, 99]
+SAMPLE_SIZE = 200000
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+_compute_locks = {}
+_background = set()
+
+def get_stats_path(nc_path):
+    return os.path.splitext(os.path.abspath(nc_path))[0] + STATS_SUFFIX
+
+def _source_signature(nc_path):
+    st = os.stat(nc_path)
+    return {'source_size': st.st_size, 'source_mtime': st.st_mtime}
+
+def _is_fresh(stats, signature):
+    return (stats is not None and stats.get('version') == FORMAT_VERSION
+            and stats.get('source_size') == signature['source_size']
+            and stats.get('source_mtime') == signature['source_mtime'])
+
+def _iter_time_steps(nc_path, lock):
+    """Yields the (alt, lat, lon) block of each time step as floats with NaN for missing values."""
+    mapped = array_cache.load(nc_path)
+    if mapped is not None:
+        for t_idx in range(mapped.values.shape[0]):
+            yield np.asarray(mapped.values[t_idx], dtype=float)
+        return
+    variable_name = get_variable_name(nc_path)
+    n_time = _variable_shape(nc_path, lock)[0]
+    for t_idx in range(n_time):
+        with lock or nullcontext():
+            with Dataset(nc_path, 'r') as ds:
+                block = ds.variables[variable_name][t_idx]
+        yield np.ma.filled(np.ma.asarray(block, dtype=float), np.nan)
+
+def _summarise(count, total, vmin, vmax, sample):
+    if count == 0:
+        return {'count': 0, 'min': None, 'max': None, 'mean': None, 'percentiles': {str(p): None for p in PERCENTILES}}
+    values = np.percentile(sample, PERCENTILES) if sample.size else [None] * len(PERCENTILES)
+    return {
+        'count': int(count),
+        'min': float(vmin),
+        'max': float(vmax),
+        'mean': float(total / count),
+        'percentiles': {str(p): (float(v) if v is not None else None) for p, v in zip(PERCENTILES, values)},
+    }
+
+def _variable_shape(nc_path, lock):
+    mapped = array_cache.load(nc_path)
+    if mapped is not None:
+        return mapped.values.shape
+    with lock or nullcontext():
+        with Dataset(nc_path, 'r') as ds:
+            return ds.variables[get_variable_name(nc_path)].shape
+
+def compute(nc_path, lock=None):
+    """
+    Collects the statistics of nc_path's main variable in one pass over its time steps.
+    lock, if given, is held around every NetCDF read.
+    """
+    return _collect(nc_path, _variable_shape(nc_path, lock), _iter_time_steps(nc_path, lock))
+
+def compute_from_array(nc_path, values):
+    """
+    Like compute(), but summarises values, nc_path's main variable already read into memory
+    (masked or with NaN for missing values), instead of reading the file again.
+    """
+    blocks = (np.ma.filled(np.ma.asarray(values[t_idx], dtype=float), np.nan) for t_idx in range(values.shape[0]))
+    return _collect(nc_path, values.shape, blocks)
+
+def _collect(nc_path, shape, blocks):
+    """Summarises the (alt, lat, lon) blocks of every time step of nc_path's main variable."""
+    signature = _source_signature(nc_path)
+    n_time, n_alt, n_lat, n_lon = shape
+    stride = max(1, math.ceil(n_time * n_lat * n_lon / SAMPLE_SIZE))
+    counts = np.zeros(n_alt, dtype=np.int64)
+    totals = np.zeros(n_alt)
+    mins = np.full(n_alt, np.inf)
+    maxs = np.full(n_alt, -np.inf)
+    samples = [[] for _ in range(n_alt)]
+    for block in blocks:
+        flat = block.reshape(n_alt, -1)
+        finite = np.isfinite(flat)
+        counts += finite.sum(axis=1)
+        totals += np.where(finite, flat, 0.0).sum(axis=1)
+        has_data = finite.any(axis=1)
+        if has_data.any():
+            mins[has_data] = np.minimum(mins[has_data], np.nanmin(flat[has_data], axis=1))
+            maxs[has_data] = np.maximum(maxs[has_data], np.nanmax(flat[has_data], axis=1))
+        for alt_idx in range(n_alt):
+            picked = flat[alt_idx, ::stride]
+            samples[alt_idx].append(picked[np.isfinite(picked)])
+
+    level_samples = [np.concatenate(s) if s else np.array([]) for s in samples]
+    altitudes = [_summarise(counts[i], totals[i], mins[i], maxs[i], level_samples[i]) for i in range(n_alt)]
+    overall = _summarise(counts.sum(), totals.sum(), mins.min() if n_alt else None, maxs.max() if n_alt else None,
+                         np.concatenate(level_samples) if level_samples else np.array([]))
+    return dict(signature, version=FORMAT_VERSION, variable=get_variable_name(nc_path),
+                percentiles=PERCENTILES, overall=overall, altitudes=altitudes)
+
+def write(nc_path, stats):
+    stats_path = get_stats_path(nc_path)
+    tmp_path = f"{stats_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(stats, f, indent=2)
+    os.replace(tmp_path, stats_path)
+
+def load(nc_path):
+    """Returns the statistics of nc_path from its sidecar if it is up to date, otherwise None."""
+    nc_path = os.path.abspath(nc_path)
+    try:
+        signature = _source_signature(nc_path)
+    except OSError:
+        return None
+    cached = _loaded.get(nc_path)
+    if _is_fresh(cached, signature):
+        return cached
+    try:
+        with open(get_stats_path(nc_path), 'r') as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not _is_fresh(stats, signature):
+        return None
+    _loaded[nc_path] = stats
+    return stats
+
+def ensure(nc_path, lock=None, values=None):
+    """
+    Returns the statistics of nc_path, computing them and writing the sidecar if it is missing or
+    stale. Concurrent callers for the same file wait for a single pass. values, if given, is the
+    main variable already in memory and is summarised instead of reading the file.
+    """
+    stats = load(nc_path)
+    if stats is not None:
+        return stats
+    nc_path = os.path.abspath(nc_path)
+    with _loaded_lock:
+        path_lock = _compute_locks.setdefault(nc_path, threading.Lock())
+    with path_lock:
+        stats = load(nc_path)
+        if stats is not None:
+            return stats
+        stats = compute(nc_path, lock) if values is None else compute_from_array(nc_path, values)
+        try:
+            write(nc_path, stats)
+        except OSError as e:
+            print(f"Warning: could not store value statistics for {nc_path}: {e}")
+        _loaded[nc_path] = stats
+        return stats
+
+def ensure_in_background(nc_path, lock=None):
+    """Starts ensure(nc_path, lock) in a daemon thread unless one is already running for the file."""
+    nc_path = os.path.abspath(nc_path)
+    with _loaded_lock:
+        if nc_path in _background:
+            return
+        _background.add(nc_path)
+
+    def run():
+        try:
+            ensure(nc_path, lock)
+        except Exception as e:
+            print(f"Warning: could not compute value statistics for {nc_path}: {e}")
+        finally:
+            with _loaded_lock:
+                _background.discard(nc_path)
+    threading.Thread(target=run, name='value-stats', daemon=True).start()
+
+def altitude_range(stats, alt_idx):
+    """Returns (min, max) over all time steps of one altitude level, or (None, None) if it has no data."""
+    level = stats['altitudes'][alt_idx]
+    return level['min'], level['max']
+
+def ensure_all(data_root, lock=None):
+    """Writes statistics sidecars for every .nc file in data_root and in its date subdirectories."""
+    for root, dirs, files in os.walk(data_root):
+        dirs[:] = [d for d in dirs if d != array_cache.CACHE_DIR_NAME]
+        for file_name in sorted(files):
+            if not file_name.endswith('.nc'):
+                continue
+            nc_path = os.path.join(root, file_name)
+            try:
+                stats = ensure(nc_path, lock)
+                overall = stats['overall']
+                print(f"Value statistics for {nc_path}: [{overall['min']}, {overall['max']}] over {overall['count']} values")
+            except Exception as e:
+                print(f"  An unexpected error occurred while summarising {nc_path}: {e}. Skipping file.")
+
+if __name__ == '__main__':
+    ensure_all(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
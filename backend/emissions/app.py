@@ -2,15 +2,23 @@ import os
 import json
 import base64
 import time
+import threading
+import hashlib
 import xarray as xr
 import numpy as np
+from collections import OrderedDict
+from matplotlib.path import Path
 from flask_cors import CORS
 from urllib.parse import quote_plus
 from flask import Flask, jsonify, request, send_file, abort
+import array_cache
+import sens_runs
+import tile_render
 
 
 APP_ROOT = os.path.dirname(os.path.abspath(__file__))
 DATA_BASE_DIR = os.path.join(APP_ROOT, 'data', 'contour_maps')
+NC_DATA_DIR = os.path.join(APP_ROOT, 'data')
 
 app = Flask(__name__)
 CORS(app)
@@ -34,6 +42,23 @@ UNITS_BY_METRIC = {
 	'o3': 'ppbv',
 }
 
+# Query endpoints accept the contour map metric names; they map to these NetCDF variables.
+METRIC_VARIABLES = {
+	'pm25': 'PM25',
+	'no2': 'SpeciesConcVV_NO2',
+	'no': 'SpeciesConcVV_NO',
+	'o3': 'SpeciesConcVV_O3',
+}
+
+QUERY_MASK_CACHE_SIZE = 128
+TOP_CHANGES_MAX = 1000
+TOP_CHANGES_CACHE_SIZE = 32
+
+TILE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+FIELD_RANGE_CACHE_SIZE = 64
+# Tile URLs do not change with the data, so clients revalidate every request against the ETag.
+TILE_CACHE_CONTROL = 'no-cache'
+
 COLORBAR_CASE_KEY = {
 	'base': 'base',
 	'increase': 'sens',
@@ -52,13 +77,23 @@ def _canonical_case(case: str):
 	return None
 
 _BOUNDS_CACHE = None
+_BOUNDS_LOCK = threading.Lock()
 
 def _compute_bounds_from_nc():
-	"""Read lat/lon from NetCDF and derive Leaflet-friendly bounds."""
+	"""Read lat/lon from NetCDF and derive Leaflet-friendly bounds, once per process.
+
+	A missing or unreadable file is not retried: DEFAULT_BOUNDS are kept instead.
+	"""
 	global _BOUNDS_CACHE
 	if _BOUNDS_CACHE:
 		return _BOUNDS_CACHE
+	with _BOUNDS_LOCK:
+		if not _BOUNDS_CACHE:
+			_BOUNDS_CACHE = _read_bounds_from_nc()
+		return _BOUNDS_CACHE
+
 
+def _read_bounds_from_nc():
 	base_nc = os.path.join(APP_ROOT, 'data', 'latlon_regrid_base.nc4')
 	sens_nc = os.path.join(APP_ROOT, 'data', 'latlon_regrid_sens.nc4')
 	nc_path = base_nc if os.path.isfile(base_nc) else sens_nc
@@ -91,14 +126,14 @@ def _compute_bounds_from_nc():
 			lon_min -= dlon / 2
 			lon_max += dlon / 2
 
-		_BOUNDS_CACHE = {
+		bounds = {
 			'lat-min': lat_min,
 			'lat-max': lat_max,
 			'lon-min': lon_min,
 			'lon-max': lon_max,
 		}
 		ds.close()
-		return _BOUNDS_CACHE
+		return bounds
 	except Exception as e:
 		print(f"[WARNING] Failed to compute bounds from {nc_path}: {e}")
 		return DEFAULT_BOUNDS
@@ -129,72 +164,186 @@ def _scan_case_files(metric_path: str):
 	return result
 
 
-def _find_case_insensitive_dir(parent: str, name: str):
-	"""Return a directory path under parent that matches name (case-insensitive)."""
-	if not os.path.isdir(parent):
-		return None
-	lower_name = name.lower()
-	for entry in os.listdir(parent):
-		if os.path.isdir(os.path.join(parent, entry)) and entry.lower() == lower_name:
-			return os.path.join(parent, entry)
-	return None
+CATALOG_RECHECK_SECONDS = 5.0
+CATALOG_MISS_CACHE_SIZE = 1024
 
+_CATALOG = None
+_CATALOG_SIGNATURE = None
+_CATALOG_CHECKED_AT = 0.0
+_CATALOG_FORCED_AT = float('-inf')
+_CATALOG_MISSES = OrderedDict()
+_CATALOG_LOCK = threading.Lock()
 
-def _resolve_case_png_path(reduction: str, metric: str, case: str):
-	"""Resolve the on-disk PNG path for a reduction/metric/case selection (case-insensitive)."""
-	reduction_dir = _find_case_insensitive_dir(DATA_BASE_DIR, reduction)
-	if not reduction_dir:
-		return None
-	metric_dir = _find_case_insensitive_dir(reduction_dir, metric)
-	if not metric_dir:
+
+def _mtime_or_none(path: str):
+	try:
+		return os.stat(path).st_mtime
+	except OSError:
 		return None
 
-	selected_file = None
-	case_files = _scan_case_files(metric_dir)
-	selected_file = case_files.get(case)
 
-	if not selected_file:
-		for fname in os.listdir(metric_dir):
-			base, ext = os.path.splitext(fname)
-			if ext.lower() != '.png':
-				continue
-			if base.lower() == case.lower():
-				selected_file = fname
-				break
+def _read_colorbar_file(meta_path: str):
+	"""Parse colorbar.json into {case_key: {vmin, vmax}}; empty if missing or unreadable."""
+	if not os.path.isfile(meta_path):
+		return {}
+	try:
+		with open(meta_path, 'r', encoding='utf-8') as f:
+			data = json.load(f)
+		return data if isinstance(data, dict) else {}
+	except Exception as e:
+		print(f"[WARNING] Failed to read colorbar metadata at {meta_path}: {e}")
+		return {}
+
 
-	if not selected_file:
+def _build_catalog():
+	"""Walk contour_maps once into reduction -> metric -> {cases, pngs, colorbar}, keyed case-insensitively.
+
+	Also returns the mtimes of every directory and colorbar.json read, used to detect changes.
+	"""
+	catalog = {}
+	signature = {DATA_BASE_DIR: _mtime_or_none(DATA_BASE_DIR)}
+	for reduction in _list_reduction_dirs():
+		reduction_dir = os.path.join(DATA_BASE_DIR, reduction)
+		signature[reduction_dir] = _mtime_or_none(reduction_dir)
+		metrics = {}
+		try:
+			metric_names = sorted(d for d in os.listdir(reduction_dir) if os.path.isdir(os.path.join(reduction_dir, d)))
+		except OSError as e:
+			print(f"[WARNING] Failed to list metrics for reduction {reduction}: {e}")
+			metric_names = []
+		for metric in metric_names:
+			metric_dir = os.path.join(reduction_dir, metric)
+			meta_path = os.path.join(metric_dir, 'colorbar.json')
+			signature[metric_dir] = _mtime_or_none(metric_dir)
+			signature[meta_path] = _mtime_or_none(meta_path)
+			pngs = {}
+			try:
+				for fname in os.listdir(metric_dir):
+					base, ext = os.path.splitext(fname)
+					if ext.lower() == '.png':
+						pngs.setdefault(base.lower(), os.path.join(metric_dir, fname))
+			except OSError as e:
+				print(f"[WARNING] Failed to list cases in {metric_dir}: {e}")
+			cases = {canonical: os.path.join(metric_dir, fname) for canonical, fname in _scan_case_files(metric_dir).items()}
+			metrics.setdefault(metric.lower(), {
+				'name': metric,
+				'cases': cases,
+				'pngs': pngs,
+				'colorbar': _read_colorbar_file(meta_path),
+			})
+		catalog.setdefault(reduction.lower(), {'name': reduction, 'metrics': metrics})
+	return catalog, signature
+
+
+def _catalog_is_current(signature) -> bool:
+	return all(_mtime_or_none(path) == mtime for path, mtime in signature.items())
+
+
+def _get_catalog(force_check: bool = False):
+	"""Return the contour_maps catalog, rebuilding it when a directory or colorbar.json has changed.
+
+	Changes are looked for at most every CATALOG_RECHECK_SECONDS, so most requests are plain dict
+	lookups. force_check looks right away, but itself at most once per CATALOG_RECHECK_SECONDS.
+	"""
+	global _CATALOG, _CATALOG_SIGNATURE, _CATALOG_CHECKED_AT, _CATALOG_FORCED_AT
+	now = time.monotonic()
+	force_check = force_check and now - _CATALOG_FORCED_AT >= CATALOG_RECHECK_SECONDS
+	if _CATALOG is not None and not force_check and now - _CATALOG_CHECKED_AT < CATALOG_RECHECK_SECONDS:
+		return _CATALOG
+	with _CATALOG_LOCK:
+		if force_check:
+			_CATALOG_FORCED_AT = now
+		if _CATALOG is None or not _catalog_is_current(_CATALOG_SIGNATURE):
+			_CATALOG, _CATALOG_SIGNATURE = _build_catalog()
+			_CATALOG_MISSES.clear()
+		_CATALOG_CHECKED_AT = time.monotonic()
+		return _CATALOG
+
+
+def _catalog_metric(reduction: str, metric: str, catalog=None):
+	"""Return the catalog entry for a reduction/metric (case-insensitive), or None."""
+	catalog = catalog if catalog is not None else _get_catalog()
+	reduction_entry = catalog.get((reduction or '').lower())
+	if not reduction_entry:
 		return None
+	return reduction_entry['metrics'].get((metric or '').lower())
 
-	return os.path.join(metric_dir, selected_file)
+
+def _lookup_case_png(catalog, reduction: str, metric: str, case: str):
+	metric_entry = _catalog_metric(reduction, metric, catalog)
+	if not metric_entry:
+		return None
+	return metric_entry['cases'].get(case) or metric_entry['pngs'].get(case.lower())
+
+
+def _resolve_case_png_path(reduction: str, metric: str, case: str):
+	"""Resolve the on-disk PNG path for a reduction/metric/case selection (case-insensitive).
+
+	Unknown selections trigger one (rate-limited) forced change check and are then remembered as
+	misses until the catalog is rebuilt, the CATALOG_MISS_CACHE_SIZE most recent ones at most.
+	"""
+	key = ((reduction or '').lower(), (metric or '').lower(), (case or '').lower())
+	png_path = _lookup_case_png(_get_catalog(), reduction, metric, case)
+	if png_path:
+		return png_path
+	with _CATALOG_LOCK:
+		if key in _CATALOG_MISSES:
+			_CATALOG_MISSES.move_to_end(key)
+			return None
+	png_path = _lookup_case_png(_get_catalog(force_check=True), reduction, metric, case)
+	if not png_path:
+		with _CATALOG_LOCK:
+			_CATALOG_MISSES[key] = True
+			while len(_CATALOG_MISSES) > CATALOG_MISS_CACHE_SIZE:
+				_CATALOG_MISSES.popitem(last=False)
+	return png_path
 
 
 def _read_colorbar_metadata(reduction: str, metric: str, canonical_case: str):
-	"""Load vmin/vmax from colorbar.json for the selected case, if present."""
+	"""Look up vmin/vmax from colorbar.json for the selected case, if present."""
 	case_key = COLORBAR_CASE_KEY.get(canonical_case)
 	if not case_key:
 		return None, None
 
-	metric_dir = _find_case_insensitive_dir(DATA_BASE_DIR, reduction)
-	if not metric_dir:
+	metric_entry = _catalog_metric(reduction, metric)
+	if not metric_entry:
 		return None, None
-	metric_dir = _find_case_insensitive_dir(metric_dir, metric)
-	if not metric_dir:
+	case_entry = metric_entry['colorbar'].get(case_key)
+	if not isinstance(case_entry, dict):
 		return None, None
+	return case_entry.get('vmin'), case_entry.get('vmax')
 
-	meta_path = os.path.join(metric_dir, 'colorbar.json')
-	if not os.path.isfile(meta_path):
-		return None, None
 
-	try:
-		with open(meta_path, 'r', encoding='utf-8') as f:
-			data = json.load(f)
-		case_entry = data.get(case_key)
-		if not case_entry:
-			return None, None
-		return case_entry.get('vmin'), case_entry.get('vmax')
-	except Exception as e:
-		print(f"[WARNING] Failed to read colorbar metadata at {meta_path}: {e}")
-		return None, None
+IMAGE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+PNG_DIGEST_CACHE_SIZE = 4096
+
+_PNG_DIGESTS = OrderedDict()
+_PNG_DIGESTS_LOCK = threading.Lock()
+
+
+def _png_digest(png_path: str):
+	"""Return a content hash of the PNG, recomputed only when its size or mtime changes.
+
+	The PNG_DIGEST_CACHE_SIZE most recently used hashes are kept.
+	"""
+	st = os.stat(png_path)
+	signature = (st.st_mtime_ns, st.st_size)
+	with _PNG_DIGESTS_LOCK:
+		cached = _PNG_DIGESTS.get(png_path)
+		if cached and cached[0] == signature:
+			_PNG_DIGESTS.move_to_end(png_path)
+			return cached[1]
+	digest = hashlib.sha256()
+	with open(png_path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			digest.update(chunk)
+	value = digest.hexdigest()[:20]
+	with _PNG_DIGESTS_LOCK:
+		_PNG_DIGESTS[png_path] = (signature, value)
+		_PNG_DIGESTS.move_to_end(png_path)
+		while len(_PNG_DIGESTS) > PNG_DIGEST_CACHE_SIZE:
+			_PNG_DIGESTS.popitem(last=False)
+	return value
 
 
 def _round_color_value(val):
@@ -206,8 +355,8 @@ def _round_color_value(val):
 		return float(f"{val:.2e}")
 	return round(val, 2)
 
-def _list_reductions():
-	"""Return available NOx reduction folders (top-level directories)."""
+def _list_reduction_dirs():
+	"""Return NOx reduction folders (top-level directories) as found on disk."""
 	if not os.path.isdir(DATA_BASE_DIR):
 		return []
 	try:
@@ -217,6 +366,318 @@ def _list_reductions():
 		return []
 
 
+def _list_reductions():
+	"""Return available NOx reduction folders from the catalog."""
+	return sorted(entry['name'] for entry in _get_catalog().values())
+
+
+def _sens_nc_path(reduction: str):
+	"""Return the sensitivity run file for a reduction level, or None."""
+	return sens_runs.path_for(NC_DATA_DIR, reduction)
+
+
+def _metric_variable(grid, metric: str):
+	"""Map a metric (pm25, no2, ...) or a raw variable name to a variable of the mapped grid."""
+	name = METRIC_VARIABLES.get(metric.lower(), metric)
+	if name in grid.variables:
+		return name
+	for candidate in grid.variables:
+		if candidate.lower() == metric.lower():
+			return candidate
+	return None
+
+
+def _query_arrays(reduction: str, metric: str):
+	"""Return (base grid, sens grid, base values, sens values) for a query, or raise LookupError."""
+	if os.path.basename(reduction) != reduction:
+		raise LookupError('Invalid reduction')
+	sens_path = _sens_nc_path(reduction)
+	try:
+		base = array_cache.load(os.path.join(NC_DATA_DIR, 'latlon_regrid_base.nc4'))
+		sens = array_cache.load(sens_path) if sens_path else None
+	except (OSError, ValueError) as e:
+		print(f"[WARNING] Could not map emissions data: {e}")
+		raise LookupError('Emissions data could not be read')
+	if base is None:
+		raise LookupError('Base run latlon_regrid_base.nc4 not found')
+	if sens is None:
+		raise LookupError(f"No sensitivity run for reduction {reduction}")
+	base_var = _metric_variable(base, metric)
+	sens_var = _metric_variable(sens, metric)
+	if not base_var or not sens_var:
+		raise LookupError(f"Unknown metric {metric}")
+	if base.variables[base_var].shape != sens.variables[sens_var].shape:
+		raise LookupError('Base and sensitivity grids differ')
+	return base, sens, base.variables[base_var], sens.variables[sens_var]
+
+
+def _nearest_index(axis: np.ndarray, value: float):
+	"""Index of the grid cell containing value along a regular axis, or None if outside the grid."""
+	if axis.size == 0:
+		return None
+	half_step = abs(float(axis[1] - axis[0])) / 2 if axis.size > 1 else 0.0
+	if value < float(np.min(axis)) - half_step or value > float(np.max(axis)) + half_step:
+		return None
+	return int(np.abs(axis - value).argmin())
+
+
+def _parse_floats(text: str):
+	return [float(v) for v in text.replace(';', ',').split(',') if v.strip()]
+
+
+def _region_from_args(args):
+	"""Parse bbox=lon_min,lat_min,lon_max,lat_max or polygon=lon,lat;lon,lat;... into a hashable key."""
+	bbox = args.get('bbox')
+	polygon = args.get('polygon')
+	if bbox:
+		values = _parse_floats(bbox)
+		if len(values) != 4:
+			raise ValueError('bbox needs lon_min,lat_min,lon_max,lat_max')
+		return ('bbox', tuple(values))
+	if polygon:
+		values = _parse_floats(polygon)
+		if len(values) < 6 or len(values) % 2:
+			raise ValueError('polygon needs at least three lon,lat pairs')
+		return ('polygon', tuple(values))
+	raise ValueError('Pass bbox or polygon')
+
+
+_QUERY_MASKS = OrderedDict()
+_QUERY_MASKS_LOCK = threading.Lock()
+
+
+def _region_mask(grid, region):
+	"""Return (window, mask): the (lat, lon) slices bounding the region and the boolean mask of cell
+	centres inside it within that window, cached per grid and region. window is None for an empty region.
+	"""
+	key = (grid.lat.size, grid.lon.size, float(grid.lat[0]), float(grid.lat[-1]),
+		float(grid.lon[0]), float(grid.lon[-1]), region)
+	with _QUERY_MASKS_LOCK:
+		entry = _QUERY_MASKS.get(key)
+		if entry is not None:
+			_QUERY_MASKS.move_to_end(key)
+			return entry
+
+	kind, values = region
+	if kind == 'bbox':
+		lon_min, lat_min, lon_max, lat_max = values
+		mask = ((grid.lat >= min(lat_min, lat_max)) & (grid.lat <= max(lat_min, lat_max)))[:, None] \
+			& ((grid.lon >= min(lon_min, lon_max)) & (grid.lon <= max(lon_min, lon_max)))[None, :]
+	else:
+		vertices = np.asarray(values, dtype=float).reshape(-1, 2)
+		mask = np.zeros((grid.lat.size, grid.lon.size), dtype=bool)
+		lat_idx = np.nonzero((grid.lat >= vertices[:, 1].min()) & (grid.lat <= vertices[:, 1].max()))[0]
+		lon_idx = np.nonzero((grid.lon >= vertices[:, 0].min()) & (grid.lon <= vertices[:, 0].max()))[0]
+		if lat_idx.size and lon_idx.size:
+			lon2d, lat2d = np.meshgrid(grid.lon[lon_idx], grid.lat[lat_idx])
+			inside = Path(vertices).contains_points(np.column_stack([lon2d.ravel(), lat2d.ravel()]))
+			mask[np.ix_(lat_idx, lon_idx)] = inside.reshape(lat2d.shape)
+
+	rows = np.flatnonzero(mask.any(axis=1))
+	cols = np.flatnonzero(mask.any(axis=0))
+	if rows.size:
+		window = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+		entry = (window, mask[window])
+	else:
+		entry = (None, mask[:0, :0])
+	with _QUERY_MASKS_LOCK:
+		_QUERY_MASKS[key] = entry
+		while len(_QUERY_MASKS) > QUERY_MASK_CACHE_SIZE:
+			_QUERY_MASKS.popitem(last=False)
+	return entry
+
+
+def _area_weighted_mean(values: np.ndarray, mask: np.ndarray, weights: np.ndarray):
+	selected = mask & np.isfinite(values)
+	total_weight = float(weights[selected].sum())
+	if total_weight == 0:
+		return None
+	return float((values[selected] * weights[selected]).sum() / total_weight)
+
+
+def _finite_or_none(value):
+	value = float(value)
+	return value if np.isfinite(value) else None
+
+
+_TILE_CACHE = OrderedDict()
+_TILE_CACHE_BYTES = 0
+_TILE_CACHE_LOCK = threading.Lock()
+_FIELD_RANGES = OrderedDict()
+_FIELD_RANGES_LOCK = threading.Lock()
+
+
+def _field_range(base, sens, metric: str, base_values, sens_values, canonical_case: str):
+	"""Symmetric (vmin, vmax) of a whole field, used when neither the request nor colorbar.json sets one."""
+	key = (base.cache_dir, base.signature, sens.cache_dir, sens.signature, metric.lower(), canonical_case)
+	with _FIELD_RANGES_LOCK:
+		cached = _FIELD_RANGES.get(key)
+		if cached is not None:
+			_FIELD_RANGES.move_to_end(key)
+			return cached
+	if canonical_case == 'difference':
+		values = np.asarray(sens_values) - np.asarray(base_values)
+	else:
+		values = base_values if canonical_case == 'base' else sens_values
+	max_abs = float(np.nanmax(np.abs(values))) if np.isfinite(values).any() else 0.0
+	max_abs = max_abs if max_abs > 0 else 1e-6
+	with _FIELD_RANGES_LOCK:
+		_FIELD_RANGES[key] = (-max_abs, max_abs)
+		while len(_FIELD_RANGES) > FIELD_RANGE_CACHE_SIZE:
+			_FIELD_RANGES.popitem(last=False)
+	return -max_abs, max_abs
+
+
+def _render_tile(grid, base_values, sens_values, canonical_case: str, z: int, x: int, y: int,
+		vmin: float, vmax: float, levels: int):
+	"""Render one tile of base, increase or difference as PNG bytes."""
+	if canonical_case == 'difference':
+		base = tile_render.sample_tile(base_values, grid.lat, grid.lon, z, x, y)
+		data = None if base is None else tile_render.sample_tile(sens_values, grid.lat, grid.lon, z, x, y) - base
+	else:
+		values = base_values if canonical_case == 'base' else sens_values
+		data = tile_render.sample_tile(values, grid.lat, grid.lon, z, x, y)
+	if data is None or not np.isfinite(data).any():
+		return tile_render.EMPTY_TILE_PNG
+	return tile_render.encode_png(tile_render.colour_tile(data, vmin, vmax, levels))
+
+
+_TOP_CHANGES = OrderedDict()
+_TOP_CHANGES_LOCK = threading.Lock()
+
+
+def _top_change_cells(base, sens, metric: str, base_values, sens_values, order: str):
+	"""Flat indices of the TOP_CHANGES_MAX cells with the largest change in order, best first.
+
+	Cached per pair of runs, metric and order, so the whole-grid difference is computed once per data version.
+	"""
+	key = (base.cache_dir, base.signature, sens.cache_dir, sens.signature, metric.lower(), order)
+	with _TOP_CHANGES_LOCK:
+		cached = _TOP_CHANGES.get(key)
+		if cached is not None:
+			_TOP_CHANGES.move_to_end(key)
+			return cached
+
+	diff = np.asarray(sens_values).ravel() - np.asarray(base_values).ravel()
+	score = {'decrease': -diff, 'increase': diff, 'abs': np.abs(diff)}[order]
+	score = np.where(np.isfinite(score), score, -np.inf)
+	n = min(TOP_CHANGES_MAX, score.size)
+	top = np.argpartition(score, -n)[-n:]
+	top = top[np.argsort(score[top])[::-1]]
+	top = top[np.isfinite(score[top])]
+	with _TOP_CHANGES_LOCK:
+		_TOP_CHANGES[key] = top
+		while len(_TOP_CHANGES) > TOP_CHANGES_CACHE_SIZE:
+			_TOP_CHANGES.popitem(last=False)
+	return top
+
+
+def _cached_tile(key, render):
+	"""Return (png bytes, etag) for key from the LRU tile cache, rendering on a miss."""
+	global _TILE_CACHE_BYTES
+	with _TILE_CACHE_LOCK:
+		entry = _TILE_CACHE.get(key)
+		if entry is not None:
+			_TILE_CACHE.move_to_end(key)
+			return entry
+
+	png = render()
+	entry = (png, hashlib.sha256(png).hexdigest()[:32])
+	with _TILE_CACHE_LOCK:
+		if key not in _TILE_CACHE:
+			_TILE_CACHE[key] = entry
+			_TILE_CACHE_BYTES += len(png)
+		while _TILE_CACHE_BYTES > TILE_CACHE_MAX_BYTES and _TILE_CACHE:
+			_, (old_png, _) = _TILE_CACHE.popitem(last=False)
+			_TILE_CACHE_BYTES -= len(old_png)
+	return entry
+
+
+_READY = threading.Event()
+_WARMUP_LOCK = threading.Lock()
+_WARMUP_STATUS = {'started_at': None, 'seconds': None, 'errors': []}
+
+
+def _warm_up():
+	"""Build the bounds, catalog (with colorbar table), image digests and array mappings, then mark the service ready.
+
+	Failures are recorded and logged but do not block readiness: every step is retried lazily on first use.
+	"""
+	with _WARMUP_LOCK:
+		if _READY.is_set():
+			return
+		started = time.time()
+		_WARMUP_STATUS['started_at'] = started
+		errors = []
+
+		def step(name, fn):
+			try:
+				fn()
+			except Exception as e:
+				print(f"[WARNING] Warm-up step {name} failed: {e}")
+				errors.append(f"{name}: {e}")
+
+		step('bounds', _compute_bounds_from_nc)
+		catalog = {}
+
+		def build_catalog():
+			catalog.update(_get_catalog(force_check=True))
+		step('catalog', build_catalog)
+
+		def digest_images():
+			for reduction_entry in catalog.values():
+				for entry in reduction_entry['metrics'].values():
+					for png_path in entry['pngs'].values():
+						_png_digest(png_path)
+		step('image digests', digest_images)
+
+		def map_arrays():
+			# Write stale or missing copies here, so requests only map them.
+			array_cache.ingest_all(NC_DATA_DIR)
+			for nc_path in array_cache.list_sources(NC_DATA_DIR):
+				array_cache.load(nc_path)
+		if os.path.isdir(NC_DATA_DIR):
+			step('array cache', map_arrays)
+
+		_WARMUP_STATUS['seconds'] = round(time.time() - started, 3)
+		_WARMUP_STATUS['errors'] = errors
+		_READY.set()
+		print(f"Emissions service warmed up in {_WARMUP_STATUS['seconds']} s")
+
+
+_WARMUP_STARTED = False
+_WARMUP_START_LOCK = threading.Lock()
+
+
+def start_warm_up():
+	"""Run _warm_up in a background thread so /health answers while it runs, once per process."""
+	global _WARMUP_STARTED
+	with _WARMUP_START_LOCK:
+		if _WARMUP_STARTED:
+			return
+		_WARMUP_STARTED = True
+	threading.Thread(target=_warm_up, name='emissions-warm-up', daemon=True).start()
+
+
+@app.route('/health', methods=['GET'])
+def health():
+	"""Liveness check endpoint."""
+	return jsonify({'status': 'ok', 'service': 'emissions'})
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+	"""Readiness check endpoint: 503 until the startup warm-up has finished."""
+	if not _READY.is_set():
+		return jsonify({'status': 'warming', 'service': 'emissions'}), 503
+	return jsonify({
+		'status': 'ready',
+		'service': 'emissions',
+		'warmup_seconds': _WARMUP_STATUS['seconds'],
+		'warmup_errors': _WARMUP_STATUS['errors'],
+	})
+
+
 @app.route('/api/emissions_reductions', methods=['GET'])
 def emissions_reductions():
 	"""List available NOx reduction percentages (top-level folders)."""
@@ -229,15 +690,10 @@ def emissions_metrics():
 	reduction = request.args.get('reduction')
 	if not reduction:
 		return jsonify([])
-	reduction_path = os.path.join(DATA_BASE_DIR, reduction)
-	if not os.path.isdir(reduction_path):
-		return jsonify([])
-	try:
-		metrics = [d for d in sorted(os.listdir(reduction_path)) if os.path.isdir(os.path.join(reduction_path, d))]
-		return jsonify(metrics)
-	except Exception as e:
-		print(f"[WARNING] Failed to list metrics for reduction {reduction}: {e}")
+	reduction_entry = _get_catalog().get(reduction.lower())
+	if not reduction_entry:
 		return jsonify([])
+	return jsonify(sorted(entry['name'] for entry in reduction_entry['metrics'].values()))
 
 
 @app.route('/api/emissions_cases', methods=['GET'])
@@ -247,23 +703,23 @@ def emissions_cases():
 	metric = request.args.get('metric')
 	if not reduction or not metric:
 		return jsonify([])
-	metric_path = os.path.join(DATA_BASE_DIR, reduction, metric)
-	if not os.path.isdir(metric_path):
-		return jsonify([])
-	try:
-		case_files = _scan_case_files(metric_path)
-		return jsonify(sorted(case_files.keys()))
-	except Exception as e:
-		print(f"[WARNING] Failed to list cases in {metric_path}: {e}")
+	metric_entry = _catalog_metric(reduction, metric)
+	if not metric_entry:
 		return jsonify([])
+	return jsonify(sorted(metric_entry['cases'].keys()))
 
 
 @app.route('/api/emissions_image', methods=['GET'])
 def emissions_image():
-	"""Return base64 overlay image and bounds for a selected reduction, metric, and case.
+	"""Return overlay image URL, bounds and colorbar for a selected reduction, metric, and case.
+
+	The image URL carries a content hash, so the file behind it can be cached forever.
+	Pass b64=1 to also get the PNG inline as base64.
 
 	Response: {
-	  image_data: <base64 or null>,
+	  image_data: <base64 if b64=1, else null>,
+	  image_url: <content-addressed URL or null>,
+	  tile_url: <XYZ tile URL template or null>,
 	  bounds: {lat-min, lat-max, lon-min, lon-max},
 	  colorbar: { type: 'sequential'|'diverging', units: str }
 	}
@@ -272,7 +728,7 @@ def emissions_image():
 	metric = request.args.get('metric')
 	case = request.args.get('case')
 	canonical = _canonical_case(case)
-	include_b64 = True
+	include_b64 = request.args.get('b64', '').lower() in ('1', 'true', 'yes')
 
 	if not reduction or not metric or not case:
 		return jsonify({'image_data': None, 'image_url': None, 'bounds': DEFAULT_BOUNDS, 'colorbar': None})
@@ -281,13 +737,13 @@ def emissions_image():
 	image_b64 = None
 	image_url = None
 
-	if png_path and os.path.isfile(png_path):
-		ts = int(time.time())
-		image_url = f"/api/emissions/api/emissions_image_file?reduction={quote_plus(reduction)}&metric={quote_plus(metric)}&case={quote_plus(case)}&ts={ts}"
-
+	if png_path:
 		try:
-			with open(png_path, 'rb') as f:
-				image_b64 = base64.b64encode(f.read()).decode('utf-8')
+			version = _png_digest(png_path)
+			image_url = f"/api/emissions/api/emissions_image_file?reduction={quote_plus(reduction)}&metric={quote_plus(metric)}&case={quote_plus(canonical or case)}&v={version}"
+			if include_b64:
+				with open(png_path, 'rb') as f:
+					image_b64 = base64.b64encode(f.read()).decode('utf-8')
 		except Exception as e:
 			print(f"[WARNING] Failed to read image for {metric}/{case}: {e}")
 
@@ -301,9 +757,14 @@ def emissions_image():
 	cbar_min = _round_color_value(cbar_min)
 	cbar_max = _round_color_value(cbar_max)
 
+	tile_url = None
+	if _sens_nc_path(reduction):
+		tile_url = f"/api/emissions/api/emissions_tile/{quote_plus(reduction)}/{quote_plus(metric)}/{quote_plus(canonical_label)}/{{z}}/{{x}}/{{y}}.png"
+
 	return jsonify({
 		'image_data': image_b64,
 		'image_url': image_url,
+		'tile_url': tile_url,
 		'bounds': bounds,
 		'colorbar': {
 			'type': cbar_type,
@@ -316,18 +777,209 @@ def emissions_image():
 
 @app.route('/api/emissions_image_file', methods=['GET'])
 def emissions_image_file():
-	"""Stream the PNG overlay directly (prefer this over base64 JSON)."""
+	"""Stream the PNG overlay directly (prefer this over base64 JSON).
+
+	Responses carry the content hash as a strong ETag and answer If-None-Match with 304.
+	When the v= parameter matches the current hash the response is cached as immutable;
+	otherwise clients must revalidate.
+	"""
 	reduction = request.args.get('reduction')
 	metric = request.args.get('metric')
 	case = request.args.get('case')
 	if not reduction or not metric or not case:
 		abort(400)
 
-	png_path = _resolve_case_png_path(reduction, metric, case)
-	if not png_path or not os.path.isfile(png_path):
+	png_path = _resolve_case_png_path(reduction, metric, _canonical_case(case) or case)
+	if not png_path:
+		abort(404)
+	try:
+		digest = _png_digest(png_path)
+	except OSError:
 		abort(404)
 
-	return send_file(png_path, mimetype='image/png')
+	if digest in request.if_none_match:
+		response = app.response_class(status=304)
+	else:
+		response = send_file(png_path, mimetype='image/png', etag=False, conditional=False)
+	response.set_etag(digest)
+	response.headers['Cache-Control'] = IMAGE_CACHE_CONTROL if request.args.get('v') == digest else 'no-cache'
+	return response
+
+
+@app.route('/api/emissions_tile/<reduction>/<metric>/<case>/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+def emissions_tile(reduction, metric, case, z, x, y):
+	"""Render an XYZ (Web Mercator) contour tile of base, increase or difference on demand.
+
+	Query: levels (default 40), vmin, vmax (default colorbar.json of the case, else symmetric field range)
+	"""
+	canonical = _canonical_case(case)
+	if not canonical:
+		return jsonify({'error': f"Unknown case {case}"}), 404
+	if not tile_render.tile_is_valid(z, x, y):
+		return jsonify({'error': 'Tile out of range'}), 404
+	try:
+		levels = int(request.args.get('levels', tile_render.CONTOUR_LEVELS))
+		vmin = request.args.get('vmin')
+		vmax = request.args.get('vmax')
+		vmin = float(vmin) if vmin not in (None, '') else None
+		vmax = float(vmax) if vmax not in (None, '') else None
+	except ValueError:
+		return jsonify({'error': 'levels, vmin and vmax must be numbers'}), 400
+	if not tile_render.MIN_LEVELS <= levels <= tile_render.MAX_LEVELS:
+		return jsonify({'error': f"levels must be between {tile_render.MIN_LEVELS} and {tile_render.MAX_LEVELS}"}), 400
+	try:
+		grid, sens, base_values, sens_values = _query_arrays(reduction, metric)
+	except LookupError as e:
+		return jsonify({'error': str(e)}), 404
+
+	if vmin is None or vmax is None:
+		meta_min, meta_max = _read_colorbar_metadata(reduction, metric, canonical)
+		if meta_min is None or meta_max is None:
+			meta_min, meta_max = _field_range(grid, sens, metric, base_values, sens_values, canonical)
+		vmin = float(meta_min) if vmin is None else vmin
+		vmax = float(meta_max) if vmax is None else vmax
+	if not (np.isfinite(vmin) and np.isfinite(vmax)) or vmax <= vmin:
+		return jsonify({'error': 'vmax must be greater than vmin'}), 400
+
+	key = (grid.cache_dir, grid.signature, sens.cache_dir, sens.signature, metric.lower(), canonical,
+		z, x, y, levels, vmin, vmax)
+	png, etag = _cached_tile(key, lambda: _render_tile(grid, base_values, sens_values, canonical, z, x, y, vmin, vmax, levels))
+	if etag in request.if_none_match:
+		response = app.response_class(status=304)
+	else:
+		response = app.response_class(png, mimetype='image/png')
+	response.set_etag(etag)
+	response.headers['Cache-Control'] = TILE_CACHE_CONTROL
+	return response
+
+
+@app.route('/api/emissions_point', methods=['GET'])
+def emissions_point():
+	"""Return base, increase and difference values of the grid cell containing a point.
+
+	Query: reduction, metric, lat, lon
+	"""
+	reduction = request.args.get('reduction', '')
+	metric = request.args.get('metric', '')
+	try:
+		lat = float(request.args.get('lat', ''))
+		lon = float(request.args.get('lon', ''))
+	except ValueError:
+		return jsonify({'error': 'lat and lon must be numbers'}), 400
+	if not reduction or not metric:
+		return jsonify({'error': 'reduction and metric are required'}), 400
+	try:
+		grid, _, base_values, sens_values = _query_arrays(reduction, metric)
+	except LookupError as e:
+		return jsonify({'error': str(e)}), 404
+
+	i = _nearest_index(grid.lat, lat)
+	j = _nearest_index(grid.lon, lon)
+	if i is None or j is None:
+		return jsonify({'error': 'Point outside the data grid'}), 404
+	base = float(base_values[i, j])
+	sens = float(sens_values[i, j])
+	return jsonify({
+		'reduction': reduction,
+		'metric': metric,
+		'units': UNITS_BY_METRIC.get(metric.lower(), ''),
+		'lat': float(grid.lat[i]),
+		'lon': float(grid.lon[j]),
+		'base': _finite_or_none(base),
+		'increase': _finite_or_none(sens),
+		'difference': _finite_or_none(sens - base),
+	})
+
+
+@app.route('/api/emissions_region_mean', methods=['GET'])
+def emissions_region_mean():
+	"""Return cos(lat) area-weighted means of base, increase and difference over a region.
+
+	Query: reduction, metric, and bbox=lon_min,lat_min,lon_max,lat_max or polygon=lon,lat;lon,lat;...
+	"""
+	reduction = request.args.get('reduction', '')
+	metric = request.args.get('metric', '')
+	if not reduction or not metric:
+		return jsonify({'error': 'reduction and metric are required'}), 400
+	try:
+		region = _region_from_args(request.args)
+	except ValueError as e:
+		return jsonify({'error': str(e)}), 400
+	try:
+		grid, _, base_values, sens_values = _query_arrays(reduction, metric)
+	except LookupError as e:
+		return jsonify({'error': str(e)}), 404
+
+	window, mask = _region_mask(grid, region)
+	if window is None:
+		base_values = sens_values = np.empty(mask.shape, dtype=np.float32)
+		lat = grid.lat[:0]
+	else:
+		# Only the rows and columns around the region are read from the mapped arrays.
+		base_values = np.asarray(base_values[window])
+		sens_values = np.asarray(sens_values[window])
+		lat = grid.lat[window[0]]
+	weights = np.broadcast_to(np.cos(np.radians(lat))[:, None], mask.shape)
+	base_mean = _area_weighted_mean(base_values, mask, weights)
+	sens_mean = _area_weighted_mean(sens_values, mask, weights)
+	diff_mean = _area_weighted_mean(sens_values - base_values, mask, weights)
+	return jsonify({
+		'reduction': reduction,
+		'metric': metric,
+		'units': UNITS_BY_METRIC.get(metric.lower(), ''),
+		'cells': int(mask.sum()),
+		'base': base_mean,
+		'increase': sens_mean,
+		'difference': diff_mean,
+		'percent_change': diff_mean / base_mean * 100 if diff_mean is not None and base_mean else None,
+	})
+
+
+@app.route('/api/emissions_top_changes', methods=['GET'])
+def emissions_top_changes():
+	"""Return the N grid cells with the largest change (increase - base).
+
+	Query: reduction, metric, n (default 10), order=decrease|increase|abs (default decrease)
+	"""
+	reduction = request.args.get('reduction', '')
+	metric = request.args.get('metric', '')
+	order = request.args.get('order', 'decrease').lower()
+	if not reduction or not metric:
+		return jsonify({'error': 'reduction and metric are required'}), 400
+	if order not in ('decrease', 'increase', 'abs'):
+		return jsonify({'error': 'order must be decrease, increase or abs'}), 400
+	try:
+		n = max(1, min(int(request.args.get('n', '10')), TOP_CHANGES_MAX))
+	except ValueError:
+		return jsonify({'error': 'n must be an integer'}), 400
+	try:
+		grid, sens, base_values, sens_values = _query_arrays(reduction, metric)
+	except LookupError as e:
+		return jsonify({'error': str(e)}), 404
+
+	top = _top_change_cells(grid, sens, metric, base_values, sens_values, order)[:n]
+	rows, cols = np.unravel_index(top, base_values.shape)
+	base_cells = np.asarray(base_values[rows, cols])
+	sens_cells = np.asarray(sens_values[rows, cols])
+	return jsonify({
+		'reduction': reduction,
+		'metric': metric,
+		'units': UNITS_BY_METRIC.get(metric.lower(), ''),
+		'order': order,
+		'cells': [{
+			'lat': float(grid.lat[r]),
+			'lon': float(grid.lon[c]),
+			'base': _finite_or_none(b),
+			'increase': _finite_or_none(v),
+			'difference': _finite_or_none(v - b),
+		} for r, c, b, v in zip(rows, cols, base_cells, sens_cells)],
+	})
+
+
+# Started at import so it also runs under gunicorn and `flask run`. Under app.run's reloader only
+# the serving child (WERKZEUG_RUN_MAIN=true) starts it, not the watching parent.
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+	start_warm_up()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,181 @@
+"""Memory-mapped copies of the lat/lon regridded emissions NetCDF files.
+
+Each data/latlon_regrid_<run>.nc4 gets a data/array_cache/latlon_regrid_<run>/ directory holding
+one float32 .npy per spatial variable (lat, lon order, first index of any other dimension as in
+the contour maps), the lat/lon axes, and a meta.json recording the source file's size and mtime.
+The app maps them with np.load(mmap_mode="r"), so value queries are page-cache reads shared by
+all threads. Copies are written on first use and rewritten when the source changes.
+
+Run from this folder with: python array_cache.py [data_dir]
+"""
+
+from typing import Dict, List, Optional
+import json
+import os
+import shutil
+import sys
+import threading
+
+import numpy as np
+import xarray as xr
+
+CACHE_DIR_NAME = "array_cache"
+META_FILE_NAME = "meta.json"
+FORMAT_VERSION = 1
+
+LON_NAMES = ["lon", "longitude", "x"]
+LAT_NAMES = ["lat", "latitude", "y"]
+
+_mapped: Dict[str, "MappedGrid"] = {}
+_path_locks: Dict[str, threading.Lock] = {}
+_lock = threading.Lock()
+
+
+class MappedGrid:
+    """Read-only memory-mapped variables of one regridded file on a regular 1-D lat/lon grid."""
+
+    def __init__(self, cache_dir: str, meta: Dict):
+        self.cache_dir = cache_dir
+        self.meta = meta
+        self.lat = np.load(os.path.join(cache_dir, "lat.npy"))
+        self.lon = np.load(os.path.join(cache_dir, "lon.npy"))
+        self.variables = {
+            name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode="r") for name in meta["variables"]
+        }
+
+    @property
+    def signature(self):
+        return (self.meta["source_size"], self.meta["source_mtime"])
+
+
+def get_cache_dir(nc_path: str) -> str:
+    data_dir, file_name = os.path.split(os.path.abspath(nc_path))
+    return os.path.join(data_dir, CACHE_DIR_NAME, os.path.splitext(file_name)[0])
+
+
+def _source_signature(nc_path: str) -> Dict:
+    st = os.stat(nc_path)
+    return {"source_size": st.st_size, "source_mtime": st.st_mtime}
+
+
+def _read_meta(cache_dir: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(cache_dir, META_FILE_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_fresh(nc_path: str, meta: Optional[Dict]) -> bool:
+    if not meta or meta.get("version") != FORMAT_VERSION:
+        return False
+    signature = _source_signature(nc_path)
+    return meta.get("source_size") == signature["source_size"] and meta.get("source_mtime") == signature["source_mtime"]
+
+
+def _find_name(ds: xr.Dataset, names) -> Optional[str]:
+    for name in names:
+        if name in ds.coords or name in ds:
+            return name
+    return None
+
+
+def ingest(nc_path: str, force: bool = False) -> str:
+    """Write the memory-mapped copy of nc_path, one variable at a time; returns the cache directory.
+
+    Raises ValueError when the file has no 1-D lat/lon axes.
+    """
+
+    nc_path = os.path.abspath(nc_path)
+    cache_dir = get_cache_dir(nc_path)
+    if not force and _is_fresh(nc_path, _read_meta(cache_dir)):
+        return cache_dir
+
+    signature = _source_signature(nc_path)
+    tmp_dir = f"{cache_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        with xr.open_dataset(nc_path) as ds:
+            lon_name = _find_name(ds, LON_NAMES)
+            lat_name = _find_name(ds, LAT_NAMES)
+            if lon_name is None or lat_name is None or ds[lon_name].ndim != 1 or ds[lat_name].ndim != 1:
+                raise ValueError(f"{nc_path} has no 1-D lat/lon axes")
+            lat_dim, lon_dim = ds[lat_name].dims[0], ds[lon_name].dims[0]
+            np.save(os.path.join(tmp_dir, "lat.npy"), np.asarray(ds[lat_name].values, dtype=np.float64))
+            np.save(os.path.join(tmp_dir, "lon.npy"), np.asarray(ds[lon_name].values, dtype=np.float64))
+
+            variables = []
+            for name, da in ds.data_vars.items():
+                if lat_dim not in da.dims or lon_dim not in da.dims or not np.issubdtype(da.dtype, np.number):
+                    continue
+                for dim in list(da.dims):
+                    if dim not in (lat_dim, lon_dim):
+                        da = da.isel({dim: 0})
+                values = np.asarray(da.transpose(lat_dim, lon_dim).values, dtype=np.float32)
+                np.save(os.path.join(tmp_dir, f"{name}.npy"), values)
+                variables.append(name)
+
+        meta = dict(signature, version=FORMAT_VERSION, variables=variables)
+        with open(os.path.join(tmp_dir, META_FILE_NAME), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+        os.replace(tmp_dir, cache_dir)
+        return cache_dir
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def load(nc_path: str) -> Optional[MappedGrid]:
+    """Return the mapped copy of nc_path, writing it first if it is missing or stale.
+
+    Returns None if nc_path does not exist. Mappings are kept per path until the source changes.
+    Writing a copy only blocks other callers of the same path.
+    """
+
+    nc_path = os.path.abspath(nc_path)
+    try:
+        signature = _source_signature(nc_path)
+    except OSError:
+        return None
+    current = (signature["source_size"], signature["source_mtime"])
+    cached = _mapped.get(nc_path)
+    if cached is not None and cached.signature == current:
+        return cached
+
+    with _lock:
+        path_lock = _path_locks.setdefault(nc_path, threading.Lock())
+    with path_lock:
+        cached = _mapped.get(nc_path)
+        if cached is not None and cached.signature == current:
+            return cached
+        cache_dir = ingest(nc_path)
+        grid = MappedGrid(cache_dir, _read_meta(cache_dir))
+        _mapped[nc_path] = grid
+        return grid
+
+
+def list_sources(data_dir: str) -> List[str]:
+    """Paths of the latlon_regrid_*.nc4 files directly in data_dir, except Europe subsets."""
+
+    return [
+        os.path.join(data_dir, file_name)
+        for file_name in sorted(os.listdir(data_dir))
+        if file_name.startswith("latlon_regrid_") and file_name.endswith(".nc4") and not file_name.endswith("_europe.nc4")
+    ]
+
+
+def ingest_all(data_dir: str) -> None:
+    """Ingest every file of list_sources(data_dir)."""
+
+    for nc_path in list_sources(data_dir):
+        try:
+            print(f"Array cache for {nc_path} is up to date at {ingest(nc_path)}")
+        except Exception as exc:
+            print(f"Could not ingest {nc_path}: {exc}")
+
+
+if __name__ == "__main__":
+    ingest_all(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
@@ -8,16 +8,22 @@ It loads the lat/lon regridded NetCDF files and reports:
 Run from this folder with: python plot_leaflet.py
 """
 
-from typing import Dict, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import fcntl
+import hashlib
 import json
 import os
 import shutil
+import time
 
 import numpy as np
 import xarray as xr
 from pyproj import CRS, Transformer
 import matplotlib.pyplot as plt
-from matplotlib.colors import LinearSegmentedColormap, TwoSlopeNorm
+
+import sens_runs
+from tile_render import CONTOUR_CMAP, CONTOUR_LEVELS, contour_norm
 
 try: 
     import cartopy.crs as ccrs
@@ -27,6 +33,13 @@ try:
 except Exception:
     CARTOPY_AVAILABLE = False
 
+try:
+    import zarr  # noqa: F401
+
+    ZARR_AVAILABLE = True
+except Exception:
+    ZARR_AVAILABLE = False
+
 
 LON_NAMES = ["lon", "longitude", "x"]
 LAT_NAMES = ["lat", "latitude", "y"]
@@ -40,9 +53,13 @@ SHORT_NAME = {
 }
 
 CONTOUR_MAPS_ROOT = os.path.join(os.path.dirname(__file__), "contour_maps")
-DEFAULT_LEVEL_DIR = "10"
-CONTOUR_LEVELS = 40
+DEFAULT_LEVEL_DIR = sens_runs.DEFAULT_LEVEL
 CONTOUR_DPI = 300
+BUILD_MANIFEST_NAME = "build_manifest.json"
+SUBSET_CHUNK_SIZE = 128
+SUBSET_FORMAT = "zarr" if ZARR_AVAILABLE else "nc4"
+
+BASE_FILE = "latlon_regrid_base.nc4"
 
 
 def _get_coord(ds: xr.Dataset, names) -> Optional[xr.DataArray]:
@@ -255,7 +272,7 @@ def plot_quicklook(
     else:
         out_path = path.replace(".nc4", f"_{target_var}_preview.png")
     fig.tight_layout()
-    fig.savefig(out_path, dpi=150)
+    _atomic_savefig(fig, out_path, dpi=150)
     plt.close(fig)
     return out_path
 
@@ -315,18 +332,8 @@ def contour_overlay(
         vmax = vmin + 1e-6
 
     data = np.clip(data, vmin, vmax)
-    cmap = LinearSegmentedColormap.from_list(
-        "blue_transparent_red",
-        [
-            (0.0, (0.0, 0.0, 1.0, 0.9)),   
-            (0.45, (0.0, 0.0, 1.0, 0.4)),  
-            (0.5, (0.0, 0.0, 1.0, 0.0)),   
-            (0.5, (1.0, 0.0, 0.0, 0.0)),   
-            (0.55, (1.0, 0.0, 0.0, 0.4)),  
-            (1.0, (1.0, 0.0, 0.0, 0.9)), 
-        ],
-    )
-    norm = TwoSlopeNorm(vmin=vmin, vcenter=0.0, vmax=vmax)
+    cmap = CONTOUR_CMAP
+    norm = contour_norm(vmin, vmax)
     level_values = np.linspace(vmin, vmax, levels)
 
     fig, ax = plt.subplots(figsize=(8, 5), constrained_layout=True)
@@ -341,7 +348,7 @@ def contour_overlay(
         out_path = os.path.join(base_dir, out_filename)
     else:
         out_path = path.replace(".nc4", f"_{target_var}_contour.png")
-    fig.savefig(out_path, dpi=CONTOUR_DPI, transparent=True, bbox_inches="tight", pad_inches=0)
+    _atomic_savefig(fig, out_path, dpi=CONTOUR_DPI, transparent=True, bbox_inches="tight", pad_inches=0)
     plt.close(fig)
     bounds = (float(lon.min()), float(lon.max()), float(lat.min()), float(lat.max()))
     return out_path, bounds, (vmin, vmax)
@@ -372,6 +379,36 @@ def _make_map_axes(lon: xr.DataArray, lat: xr.DataArray, figsize=(8, 5)):
     return fig, ax
 
 
+def _tmp_path(path: str) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.tmp-{os.getpid()}{ext}"
+
+
+def _atomic_savefig(fig, out_path: str, **kwargs) -> None:
+    """Save a figure under a temporary name and rename it into place."""
+
+    tmp_path = _tmp_path(out_path)
+    try:
+        fig.savefig(tmp_path, **kwargs)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _atomic_move(src: str, dest: str) -> None:
+    """Move src to dest so that dest is never seen half-written, even across filesystems."""
+
+    tmp_path = _tmp_path(dest)
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dest)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    os.remove(src)
+
+
 def stash_contour(png_path: str, short_name: str, dataset_label: str, level_dir: str = DEFAULT_LEVEL_DIR) -> Optional[str]:
     """Move contour PNG into contour_maps/<level>/<SHORT>/ directory."""
 
@@ -382,7 +419,7 @@ def stash_contour(png_path: str, short_name: str, dataset_label: str, level_dir:
     try:
         os.makedirs(dest_dir, exist_ok=True)
         dest_path = os.path.join(dest_dir, f"{short_name}_ll_{dataset_label}_contour.png")
-        shutil.move(png_path, dest_path)
+        _atomic_move(png_path, dest_path)
         return dest_path
     except Exception:
         return None
@@ -399,257 +436,465 @@ def write_colorbar_metadata(
 
     if vmin is None or vmax is None:
         return None
+    return merge_colorbar_metadata(short_name, {dataset_label: (vmin, vmax)}, level_dir=level_dir)
+
+
+def merge_colorbar_metadata(
+    short_name: str,
+    ranges: Dict[str, Tuple[float, float]],
+    level_dir: str = DEFAULT_LEVEL_DIR,
+) -> Optional[str]:
+    """Merge {dataset_label: (vmin, vmax)} into the metric's colorbar.json.
+
+    The read-modify-write happens under an exclusive lock on colorbar.json.lock and the file is
+    replaced atomically, so concurrent writers never lose each other's entries.
+    """
 
     dest_dir = os.path.join(CONTOUR_MAPS_ROOT, level_dir, short_name.upper())
     os.makedirs(dest_dir, exist_ok=True)
     meta_path = os.path.join(dest_dir, "colorbar.json")
 
-    data: Dict[str, Dict[str, float]] = {}
-    try:
-        if os.path.exists(meta_path):
-            with open(meta_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-    except Exception:
-        data = {}
+    with open(meta_path + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        data: Dict[str, Dict[str, float]] = {}
+        try:
+            if os.path.exists(meta_path):
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+        except Exception:
+            data = {}
+
+        merged = dict(data)
+        for dataset_label, (vmin, vmax) in ranges.items():
+            merged[str(dataset_label)] = {"vmin": float(vmin), "vmax": float(vmax)}
+        if merged == data and os.path.exists(meta_path):
+            return meta_path
+        data = merged
+
+        tmp_path = _tmp_path(meta_path)
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, meta_path)
+            return meta_path
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+
 
-    data[str(dataset_label)] = {"vmin": float(vmin), "vmax": float(vmax)}
+def _build_manifest_path() -> str:
+    return os.path.join(CONTOUR_MAPS_ROOT, BUILD_MANIFEST_NAME)
 
+
+def load_build_manifest() -> Dict:
+    """Load the record of what earlier runs built, from which inputs and with which parameters."""
+
+    manifest: Dict = {"inputs": {}, "subsets": {}, "artifacts": {}}
     try:
-        with open(meta_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
-        return meta_path
-    except Exception:
+        with open(_build_manifest_path(), "r", encoding="utf-8") as f:
+            manifest.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    return manifest
+
+
+def save_build_manifest(manifest: Dict) -> None:
+    path = _build_manifest_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def file_sha256(path: str, build_manifest: Dict) -> str:
+    """Content hash of an input file, reused from the build manifest while its size and mtime match."""
+
+    abs_path = os.path.abspath(path)
+    st = os.stat(abs_path)
+    known = build_manifest["inputs"].get(abs_path)
+    if known and known.get("size") == st.st_size and known.get("mtime") == st.st_mtime:
+        return known["sha256"]
+    digest = hashlib.sha256()
+    with open(abs_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    build_manifest["inputs"][abs_path] = {"size": st.st_size, "mtime": st.st_mtime, "sha256": digest.hexdigest()}
+    return digest.hexdigest()
+
+
+def _params_key(params: Dict) -> str:
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def render_job_key(job: Dict) -> str:
+    """Key of everything that determines a job's outputs: inputs, variable and render parameters."""
+
+    return _params_key({
+        "inputs": job.get("inputs"),
+        "variable": job["variable"],
+        "dataset": job["dataset"],
+        "level_dir": job["level_dir"],
+        "levels": CONTOUR_LEVELS,
+        "dpi": CONTOUR_DPI,
+        "vmin": job["vmin"],
+        "vmax": job["vmax"],
+    })
+
+
+def _artifact_id(job: Dict) -> str:
+    return f"{job['level_dir']}/{job['short'].upper()}/{job['dataset']}"
+
+
+def _is_up_to_date(record: Optional[Dict], key: str) -> bool:
+    if not record or record.get("key") != key:
+        return False
+    entry = record.get("entry") or {}
+    return all(path and os.path.exists(path) for path in (entry.get("stored"), entry.get("preview")))
+
+
+def render_dataset_variable(job: Dict) -> Optional[Dict]:
+    """Render the preview and contour overlay of one variable of one dataset (base, sens or diff).
+
+    Runs in a worker process; job["ds"] holds only that variable, already loaded in memory.
+    Returns the manifest entry, or None if nothing could be drawn.
+    """
+
+    started = time.perf_counter()
+    ds, var, short, label = job["ds"], job["variable"], job["short"], job["dataset"]
+    # Jobs of several levels share one working directory, so non-default levels get their own names.
+    suffix = "" if job["level_dir"] == DEFAULT_LEVEL_DIR else f"_{job['level_dir']}"
+    preview = plot_quicklook(ds, job["path"], job["lon"], job["lat"], var_name=var,
+                             out_filename=f"{short}_ll_{label}{suffix}_preview.png")
+    if preview:
+        print(f"Saved preview plot to {preview}")
+    contour = contour_overlay(
+        ds,
+        job["path"],
+        job["lon"],
+        job["lat"],
+        var_name=var,
+        out_filename=f"{short}_ll_{label}{suffix}_contour.png",
+        vmin_override=job["vmin"],
+        vmax_override=job["vmax"],
+    )
+    if not contour:
         return None
+    png_path, bounds, vrange = contour
+    print(
+        f"Saved contour overlay to {png_path} with bounds {bounds} (lon_min, lon_max, lat_min, lat_max)"
+        f" and v-range {vrange}"
+    )
+    stored = stash_contour(png_path, short, label, level_dir=job["level_dir"])
+    if stored:
+        print(f"Moved contour to {stored}")
+    entry = {
+        "level": job["level_dir"],
+        "dataset": label,
+        "variable": var,
+        "preview": preview,
+        "contour": png_path,
+        "stored": stored,
+        "bounds": bounds,
+        "vmin": vrange[0],
+        "vmax": vrange[1],
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    if label == "diff":
+        entry["note"] = "sens - base"
+    return entry
 
 
-def main():
-    files = {
-        "base": "latlon_regrid_base.nc4",
-        "sens": "latlon_regrid_sens.nc4",
-    }
+def _symmetric_range(ranges: List[Optional[Tuple[float, float]]]) -> Tuple[Optional[float], Optional[float]]:
+    candidates = [abs(v) for r in ranges if r for v in r]
+    maxabs = max(candidates) if candidates else None
+    if maxabs is None or not np.isfinite(maxabs) or maxabs == 0:
+        return None, None
+    return -maxabs, maxabs
 
-    subsets = {}
-    manifest = []
-
-    for label, path in files.items():
-        info = dataset_summary(path)
-        print(f"\n=== {path} ===")
-        print(f"Dims: {info['dims']}")
-        print(f"CRS: {info['crs']}")
-        lon_info = info.get("lon")
-        lat_info = info.get("lat")
-        if lon_info:
-            print(f"Lon coord: {lon_info}")
-        else:
-            print("Lon coord: not found")
-        if lat_info:
-            print(f"Lat coord: {lat_info}")
-        else:
-            print("Lat coord: not found")
-        bbox = info.get("bbox")
-        if bbox:
-            print(f"Bounding box (lon_min, lon_max, lat_min, lat_max): {bbox}")
-        bbox_wm = info.get("bbox_web_mercator")
-        if bbox_wm:
-            print(f"Web Mercator bounds (x_min, x_max, y_min, y_max) meters: {bbox_wm}")
 
-        try:
-            ds_full = xr.open_dataset(path)
-            ds_eu = subset_to_extent(ds_full, EUROPE_EXTENT)
-            out_path = path.replace(".nc4", "_europe.nc4")
-            ds_eu.to_netcdf(out_path)
-            print(f"Saved Europe subset to {out_path} with dims {dict(ds_eu.sizes)}")
-            lon = _get_coord(ds_eu, LON_NAMES)
-            lat = _get_coord(ds_eu, LAT_NAMES)
-            if lon is None or lat is None:
-                continue
-
-            subsets[label] = (ds_eu, lon.name, lat.name, out_path)
-        except Exception as exc:
-            print(f"Could not subset/save Europe extent for {path}: {exc}")
+def plan_render_jobs(
+    subsets: Dict,
+    level_dir: str = DEFAULT_LEVEL_DIR,
+    input_hashes: Optional[Dict[str, str]] = None,
+    base_ranges: Optional[Dict[str, Optional[Tuple[float, float]]]] = None,
+) -> List[Dict]:
+    """Build the base/sens/diff render jobs for every variable.
+
+    Each variable's values are pulled out of the loaded subsets once; value ranges and the
+    sens - base difference are computed from those arrays and shared by the jobs.
+    input_hashes ({"base": sha256, "sens": sha256}) end up in each job's build key.
+    base_ranges, when given, is filled with and reused for the base dataset's value ranges,
+    so planning several reduction levels against one base reads its values only once.
+    """
+
+    input_hashes = input_hashes or {}
+    base_ranges = base_ranges if base_ranges is not None else {}
 
     preferred = ("PM25", "SpeciesConcVV_NO2", "SpeciesConcVV_O3")
-    if "base" in subsets:
-        ds_base, lon_b, lat_b, base_path = subsets["base"]
-        all_base_vars = spatial_vars(ds_base, lon_b, lat_b)
-        ordered_base = list(preferred) + [v for v in all_base_vars if v not in preferred]
-        ds_sens = None
-        lon_s = lat_s = sens_path = None
-        if "sens" in subsets:
-            ds_sens, lon_s, lat_s, sens_path = subsets["sens"]
-        for var in ordered_base:
-            if var not in ds_base:
-                continue
-            short = short_var_name(var)
-            preview_name_base = f"{short}_ll_base_preview.png"
-            contour_name_base = f"{short}_ll_base_contour.png"
+    jobs: List[Dict] = []
+    if "base" not in subsets:
+        return jobs
+    ds_base, lon_b, lat_b, base_path = subsets["base"]
+    ds_sens = None
+    lon_s = lat_s = sens_path = None
+    if "sens" in subsets:
+        ds_sens, lon_s, lat_s, sens_path = subsets["sens"]
+
+    all_base_vars = spatial_vars(ds_base, lon_b, lat_b)
+    ordered_base = [v for v in preferred if v in ds_base] + [v for v in all_base_vars if v not in preferred]
+    has_sens = {var: ds_sens is not None and var in ds_sens for var in ordered_base}
+
+    for var in ordered_base:
+        if var not in base_ranges:
+            base_ranges[var] = _finite_minmax(np.asarray(ds_base[var].values))
+    sens_ranges = {var: _finite_minmax(np.asarray(ds_sens[var].values)) for var in ordered_base if has_sens[var]}
+
+    for var in ordered_base:
+        short = short_var_name(var)
+        if has_sens[var]:
+            vmin_override, vmax_override = _symmetric_range([base_ranges[var], sens_ranges[var]])
+        else:
             vmin_override = vmax_override = None
-            if ds_sens is not None and var in ds_sens:
-                base_range = _finite_minmax(np.asarray(ds_base[var].values))
-                sens_range = _finite_minmax(np.asarray(ds_sens[var].values))
-                candidates = []
-                if base_range:
-                    candidates.extend([abs(base_range[0]), abs(base_range[1])])
-                if sens_range:
-                    candidates.extend([abs(sens_range[0]), abs(sens_range[1])])
-                maxabs = max(candidates) if candidates else None
-                if maxabs is not None and np.isfinite(maxabs) and maxabs != 0:
-                    vmin_override, vmax_override = -maxabs, maxabs
-            if vmin_override is None or vmax_override is None:
-                data_range = padded_range(np.asarray(ds_base[var].values), pad_fraction=0.1)
-                if data_range:
-                    vmin_override, vmax_override = data_range
-
-            preview = plot_quicklook(ds_base, base_path, lon_b, lat_b, var_name=var, out_filename=preview_name_base)
-            if preview:
-                print(f"Saved preview plot to {preview}")
-            contour = contour_overlay(
-                ds_base,
-                base_path,
-                lon_b,
-                lat_b,
-                var_name=var,
-                out_filename=contour_name_base,
-                vmin_override=vmin_override,
-                vmax_override=vmax_override,
-            )
-            if contour:
-                png_path, bounds, vrange = contour
-                print(
-                    f"Saved contour overlay to {png_path} with bounds {bounds} (lon_min, lon_max, lat_min, lat_max)"
-                    f" and v-range {vrange}"
-                )
-                meta_path = write_colorbar_metadata(short, "base", vrange[0], vrange[1], level_dir=DEFAULT_LEVEL_DIR)
-                if meta_path:
-                    print(f"Saved colorbar metadata to {meta_path}")
-                stored = stash_contour(png_path, short, "base", level_dir=DEFAULT_LEVEL_DIR)
-                if stored:
-                    print(f"Moved contour to {stored}")
-                manifest.append(
-                    {
-                        "dataset": "base",
-                        "variable": var,
-                        "preview": preview,
-                        "contour": png_path,
-                        "bounds": bounds,
-                        "vmin": vrange[0],
-                        "vmax": vrange[1],
-                    }
-                )
-
-            if ds_sens is not None and var in ds_sens:
-                preview_name_sens = f"{short}_ll_sens_preview.png"
-                contour_name_sens = f"{short}_ll_sens_contour.png"
-                preview_s = plot_quicklook(ds_sens, sens_path, lon_s, lat_s, var_name=var, out_filename=preview_name_sens)
-                if preview_s:
-                    print(f"Saved preview plot to {preview_s}")
-                contour_s = contour_overlay(
-                    ds_sens,
-                    sens_path,
-                    lon_s,
-                    lat_s,
-                    var_name=var,
-                    out_filename=contour_name_sens,
-                    vmin_override=vmin_override,
-                    vmax_override=vmax_override,
-                )
-                if contour_s:
-                    png_path, bounds, vrange = contour_s
-                    print(
-                        f"Saved contour overlay to {png_path} with bounds {bounds} (lon_min, lon_max, lat_min, lat_max)"
-                        f" and v-range {vrange}"
-                    )
-                    meta_path = write_colorbar_metadata(short, "sens", vrange[0], vrange[1], level_dir=DEFAULT_LEVEL_DIR)
-                    if meta_path:
-                        print(f"Saved colorbar metadata to {meta_path}")
-                    stored = stash_contour(png_path, short, "sens", level_dir=DEFAULT_LEVEL_DIR)
-                    if stored:
-                        print(f"Moved contour to {stored}")
-                    manifest.append(
-                        {
-                            "dataset": "sens",
-                            "variable": var,
-                            "preview": preview_s,
-                            "contour": png_path,
-                            "bounds": bounds,
-                            "vmin": vrange[0],
-                            "vmax": vrange[1],
-                        }
-                    )
-
-    if "base" in subsets and "sens" in subsets:
-        ds_base, lon_b, lat_b, _ = subsets["base"]
-        ds_sens, lon_s, lat_s, _ = subsets["sens"]
-        if lon_b == lon_s and lat_b == lat_s:
-            base_vars = set(spatial_vars(ds_base, lon_b, lat_b))
-            sens_vars = set(spatial_vars(ds_sens, lon_s, lat_s))
-            common = sorted(base_vars & sens_vars)
-            diff_path = "latlon_regrid_diff.nc4"
-            for var in common:
+        if vmin_override is None or vmax_override is None:
+            data_range = padded_range(np.asarray(ds_base[var].values), pad_fraction=0.1)
+            if data_range:
+                vmin_override, vmax_override = data_range
+
+        common = {"variable": var, "short": short, "level_dir": level_dir, "vmin": vmin_override, "vmax": vmax_override}
+        jobs.append(dict(common, dataset="base", ds=ds_base[[var]], path=base_path, lon=lon_b, lat=lat_b,
+                         inputs={"base": input_hashes.get("base")}))
+        if has_sens[var]:
+            jobs.append(dict(common, dataset="sens", ds=ds_sens[[var]], path=sens_path, lon=lon_s, lat=lat_s,
+                             inputs={"sens": input_hashes.get("sens")}))
+
+    if ds_sens is not None and lon_b == lon_s and lat_b == lat_s:
+        diff_path = "latlon_regrid_diff.nc4"
+        sens_vars = set(spatial_vars(ds_sens, lon_s, lat_s))
+        for var in sorted(set(all_base_vars) & sens_vars):
+            try:
+                ds_diff = (ds_sens[var] - ds_base[var]).to_dataset(name=var)
+                diff_vmin, diff_vmax = _symmetric_range([_finite_minmax(np.asarray(ds_diff[var].values))])
+                jobs.append({
+                    "variable": var,
+                    "short": short_var_name(var),
+                    "level_dir": level_dir,
+                    "vmin": diff_vmin,
+                    "vmax": diff_vmax,
+                    "dataset": "diff",
+                    "ds": ds_diff,
+                    "path": diff_path,
+                    "lon": lon_b,
+                    "lat": lat_b,
+                    "inputs": {"base": input_hashes.get("base"), "sens": input_hashes.get("sens")},
+                })
+            except Exception as exc:
+                print(f"Could not compute diff for {var}: {exc}")
+    return jobs
+
+
+def run_render_jobs(jobs: List[Dict], build_manifest: Optional[Dict] = None, max_workers: Optional[int] = None) -> List[Dict]:
+    """Render jobs across a process pool, then write each metric's colorbar.json once.
+
+    Jobs whose build key matches the build manifest and whose outputs still exist are skipped
+    and reuse the recorded result. Returns manifest entries in job order.
+    """
+
+    artifacts = build_manifest["artifacts"] if build_manifest is not None else {}
+    results: List[Optional[Dict]] = [None] * len(jobs)
+    pending = []
+    for index, job in enumerate(jobs):
+        key = render_job_key(job)
+        record = artifacts.get(_artifact_id(job))
+        if _is_up_to_date(record, key):
+            print(f"Up to date: {_artifact_id(job)}")
+            results[index] = record["entry"]
+        else:
+            pending.append((index, job, key))
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(render_dataset_variable, job) for _, job, _ in pending]
+            for (index, job, key), future in zip(pending, futures):
                 try:
-                    da_diff = ds_sens[var] - ds_base[var]
-                    ds_diff = da_diff.to_dataset(name=var)
-                    diff_range = _finite_minmax(np.asarray(da_diff.values))
-                    if diff_range:
-                        raw_vmin, raw_vmax = diff_range
-                        maxabs = max(abs(raw_vmin), abs(raw_vmax))
-                        if not np.isfinite(maxabs) or maxabs == 0:
-                            diff_vmin = diff_vmax = None
-                        else:
-                            diff_vmin, diff_vmax = -maxabs, maxabs
-                    else:
-                        diff_vmin = diff_vmax = None
-                    preview = plot_quicklook(ds_diff, diff_path, lon_b, lat_b, var_name=var)
-                    if preview:
-                        print(f"Saved diff preview for {var} to {preview}")
-                    short = short_var_name(var)
-                    contour_name = f"{short}_ll_diff_contour.png"
-                    preview_name = f"{short}_ll_diff_preview.png"
-                    if preview:
-                        base_dir = os.path.dirname(os.path.abspath(diff_path))
-                        new_preview = os.path.join(base_dir, preview_name)
-                        try:
-                            os.replace(preview, new_preview)
-                            preview = new_preview
-                        except Exception:
-                            pass
-                    contour = contour_overlay(
-                        ds_diff,
-                        diff_path,
-                        lon_b,
-                        lat_b,
-                        var_name=var,
-                        force_symmetric=False,
-                        out_filename=contour_name,
-                        vmin_override=diff_vmin,
-                        vmax_override=diff_vmax,
-                    )
-                    if contour:
-                        png_path, bounds, vrange = contour
-                        print(
-                            f"Saved diff contour for {var} to {png_path} with bounds {bounds} (lon_min, lon_max, lat_min, lat_max)"
-                            f" and v-range {vrange}"
-                        )
-                        meta_path = write_colorbar_metadata(short, "diff", vrange[0], vrange[1], level_dir=DEFAULT_LEVEL_DIR)
-                        if meta_path:
-                            print(f"Saved colorbar metadata to {meta_path}")
-                        stored = stash_contour(png_path, short, "diff", level_dir=DEFAULT_LEVEL_DIR)
-                        if stored:
-                            print(f"Moved contour to {stored}")
-                        manifest.append(
-                            {
-                                "dataset": "diff",
-                                "variable": var,
-                                "preview": preview,
-                                "contour": png_path,
-                                "bounds": bounds,
-                                "vmin": vrange[0],
-                                "vmax": vrange[1],
-                                "note": "sens - base",
-                            }
-                        )
+                    entry = future.result()
                 except Exception as exc:
-                    print(f"Could not compute diff for {var}: {exc}")
+                    print(f"Could not render {job['dataset']} {job['variable']}: {exc}")
+                    continue
+                if not entry:
+                    continue
+                print(f"Rendered {_artifact_id(job)} in {entry['seconds']:.2f}s")
+                results[index] = entry
+                artifacts[_artifact_id(job)] = {"key": key, "entry": entry, "built_at": time.time()}
+
+    manifest: List[Dict] = []
+    colorbar_ranges: Dict[Tuple[str, str], Dict[str, Tuple[float, float]]] = {}
+    for job, entry in zip(jobs, results):
+        if not entry:
+            continue
+        manifest.append(entry)
+        colorbar_ranges.setdefault((job["short"], job["level_dir"]), {})[job["dataset"]] = (entry["vmin"], entry["vmax"])
+
+    for (short, level_dir), ranges in colorbar_ranges.items():
+        meta_path = merge_colorbar_metadata(short, ranges, level_dir=level_dir)
+        if meta_path:
+            print(f"Saved colorbar metadata to {meta_path}")
+    return manifest
+
+
+def compact_subset(ds: xr.Dataset) -> xr.Dataset:
+    """Cast floating-point data variables to float32 and record their min/max as actual_range."""
+
+    compact = ds.copy()
+    for name, da in ds.data_vars.items():
+        if not np.issubdtype(da.dtype, np.floating):
+            continue
+        da32 = da.astype(np.float32)
+        value_range = _finite_minmax(np.asarray(da32.values))
+        da32.attrs = dict(da.attrs)
+        if value_range:
+            da32.attrs["actual_range"] = [value_range[0], value_range[1]]
+        compact[name] = da32
+    return compact
+
+
+def _subset_encoding(ds: xr.Dataset) -> Dict[str, Dict]:
+    """Chunk spatial variables into SUBSET_CHUNK_SIZE tiles, one slice per other dimension."""
+
+    lon = _get_coord(ds, LON_NAMES)
+    lat = _get_coord(ds, LAT_NAMES)
+    spatial_dims = {d for c in (lon, lat) if c is not None for d in c.dims}
+    encoding = {}
+    for name, da in ds.data_vars.items():
+        chunks = tuple(min(SUBSET_CHUNK_SIZE, size) if dim in spatial_dims else 1 for dim, size in zip(da.dims, da.shape))
+        if SUBSET_FORMAT == "zarr":
+            encoding[name] = {"chunks": chunks}
+        else:
+            encoding[name] = {"zlib": True, "complevel": 4, "shuffle": True, "chunksizes": chunks}
+    return encoding
+
+
+def write_subset(ds: xr.Dataset, out_path: str) -> None:
+    """Write a subset as chunked, compressed Zarr with consolidated metadata (NetCDF4 if zarr is missing).
+
+    The store is written under a temporary name and swapped in afterwards.
+    """
+
+    tmp_path = _tmp_path(out_path)
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    try:
+        if SUBSET_FORMAT == "zarr":
+            ds.to_zarr(tmp_path, mode="w", consolidated=True, encoding=_subset_encoding(ds))
+            shutil.rmtree(out_path, ignore_errors=True)
+        else:
+            ds.to_netcdf(tmp_path, encoding=_subset_encoding(ds))
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def open_subset(out_path: str) -> xr.Dataset:
+    if SUBSET_FORMAT == "zarr":
+        return xr.open_zarr(out_path, consolidated=True)
+    return xr.open_dataset(out_path)
+
+
+def load_europe_subset(path: str, build_manifest: Dict) -> Tuple[xr.Dataset, str, str]:
+    """Return the in-memory Europe subset of path, its output path and source hash.
+
+    The subset file is only rewritten when the source content or the extent changed.
+    """
+
+    source_hash = file_sha256(path, build_manifest)
+    out_path = path.replace(".nc4", f"_europe.{SUBSET_FORMAT}")
+    key = _params_key({"source": source_hash, "extent": EUROPE_EXTENT, "format": SUBSET_FORMAT, "chunks": SUBSET_CHUNK_SIZE})
+    record = build_manifest["subsets"].get(os.path.abspath(out_path))
+    if record and record.get("key") == key and os.path.exists(out_path):
+        with open_subset(out_path) as ds_saved:
+            ds_eu = ds_saved.load()
+        print(f"Europe subset {out_path} is up to date")
+        return ds_eu, out_path, source_hash
+
+    started = time.perf_counter()
+    with xr.open_dataset(path) as ds_full:
+        ds_eu = compact_subset(subset_to_extent(ds_full, EUROPE_EXTENT).load())
+    write_subset(ds_eu, out_path)
+    seconds = round(time.perf_counter() - started, 3)
+    build_manifest["subsets"][os.path.abspath(out_path)] = {"key": key, "seconds": seconds, "built_at": time.time()}
+    print(f"Saved Europe subset to {out_path} with dims {dict(ds_eu.sizes)} in {seconds:.2f}s")
+    return ds_eu, out_path, source_hash
+
+
+def print_dataset_summary(path: str) -> None:
+    info = dataset_summary(path)
+    print(f"\n=== {path} ===")
+    print(f"Dims: {info['dims']}")
+    print(f"CRS: {info['crs']}")
+    lon_info = info.get("lon")
+    lat_info = info.get("lat")
+    if lon_info:
+        print(f"Lon coord: {lon_info}")
+    else:
+        print("Lon coord: not found")
+    if lat_info:
+        print(f"Lat coord: {lat_info}")
+    else:
+        print("Lat coord: not found")
+    bbox = info.get("bbox")
+    if bbox:
+        print(f"Bounding box (lon_min, lon_max, lat_min, lat_max): {bbox}")
+    bbox_wm = info.get("bbox_web_mercator")
+    if bbox_wm:
+        print(f"Web Mercator bounds (x_min, x_max, y_min, y_max) meters: {bbox_wm}")
+
+
+def load_subset_entry(path: str, build_manifest: Dict) -> Optional[Tuple[Tuple, str]]:
+    """Summarise path and load its Europe subset; returns ((ds, lon, lat, subset path), source hash) or None."""
+
+    print_dataset_summary(path)
+    try:
+        ds_eu, out_path, source_hash = load_europe_subset(path, build_manifest)
+    except Exception as exc:
+        print(f"Could not subset/save Europe extent for {path}: {exc}")
+        return None
+    lon = _get_coord(ds_eu, LON_NAMES)
+    lat = _get_coord(ds_eu, LAT_NAMES)
+    if lon is None or lat is None:
+        return None
+    return (ds_eu, lon.name, lat.name, out_path), source_hash
+
+
+def main():
+    """Render every reduction level found next to the base run in one pass.
+
+    The base subset is loaded once and shared by all levels. Levels are planned and rendered
+    one at a time, so only one sensitivity subset and its differences are held in memory.
+    """
+
+    build_manifest = load_build_manifest()
+    levels = sens_runs.discover()
+    print(f"Found sensitivity runs for reduction levels: {', '.join(levels) or 'none'}")
+
+    base = load_subset_entry(BASE_FILE, build_manifest)
+    manifest: List[Dict] = []
+    if base is not None:
+        base_subset, base_hash = base
+        base_ranges: Dict[str, Optional[Tuple[float, float]]] = {}
+        for level_dir, sens_path in (levels or {DEFAULT_LEVEL_DIR: None}).items():
+            subsets = {"base": base_subset}
+            input_hashes = {"base": base_hash}
+            sens = load_subset_entry(sens_path, build_manifest) if sens_path else None
+            if sens is not None:
+                subsets["sens"], input_hashes["sens"] = sens
+            jobs = plan_render_jobs(subsets, level_dir=level_dir, input_hashes=input_hashes, base_ranges=base_ranges)
+            del subsets, sens
+            manifest.extend(run_render_jobs(jobs, build_manifest=build_manifest))
+            del jobs
+    save_build_manifest(build_manifest)
 
     if manifest:
         manifest_path = os.path.join(os.path.dirname(__file__), "overlay_manifest.json")
@@ -0,0 +1,59 @@
+"""Where the sensitivity run of each NOx reduction level lives, shared by heatmap_gen.py and the app.
+
+latlon_regrid_sens_<level>.nc4 holds one reduction level, and latlon_regrid_sens.nc4 holds the
+DEFAULT_LEVEL run. If both latlon_regrid_sens.nc4 and latlon_regrid_sens_<DEFAULT_LEVEL>.nc4 exist,
+the file naming the level wins and a warning is printed once.
+"""
+
+from typing import Dict, Optional
+import os
+import re
+import threading
+
+DEFAULT_LEVEL = "10"
+DEFAULT_FILE = "latlon_regrid_sens.nc4"
+SENS_FILE_PATTERN = re.compile(r"^latlon_regrid_sens(?:_(?P<level>\d+(?:\.\d+)?))?\.nc4$")
+
+_warned = set()
+_warned_lock = threading.Lock()
+
+
+def level_file(level: str) -> str:
+    return f"latlon_regrid_sens_{level}.nc4"
+
+
+def _warn_if_shadowed(data_dir: str, level: str) -> None:
+    if level != DEFAULT_LEVEL or not os.path.isfile(os.path.join(data_dir, DEFAULT_FILE)):
+        return
+    key = os.path.abspath(data_dir)
+    with _warned_lock:
+        if key in _warned:
+            return
+        _warned.add(key)
+    print(f"[WARNING] Both {DEFAULT_FILE} and {level_file(level)} exist in {data_dir}; using {level_file(level)}")
+
+
+def path_for(data_dir: str, level: str) -> Optional[str]:
+    """Return the sensitivity run file of a reduction level in data_dir, or None."""
+
+    path = os.path.join(data_dir, level_file(level))
+    if os.path.isfile(path):
+        _warn_if_shadowed(data_dir, level)
+        return path
+    if level == DEFAULT_LEVEL:
+        path = os.path.join(data_dir, DEFAULT_FILE)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def discover(data_dir: str = ".") -> Dict[str, str]:
+    """Return {level: path} for every sensitivity run in data_dir, ordered by level."""
+
+    levels = set()
+    for fname in os.listdir(data_dir):
+        match = SENS_FILE_PATTERN.match(fname)
+        if match:
+            levels.add(match.group("level") or DEFAULT_LEVEL)
+    runs = {level: path_for(data_dir, level) for level in sorted(levels, key=float)}
+    return {level: path for level, path in runs.items() if path}
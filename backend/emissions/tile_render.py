@@ -0,0 +1,131 @@
+"""On-demand XYZ (Web Mercator) tiles of the emissions fields.
+
+Tiles look like the contour maps heatmap_gen.py draws: the field is bilinearly interpolated
+between grid cell centres and every pixel takes the colour of its contour band, which is what
+matplotlib's contourf fills. Colouring is a table lookup per pixel, so a 256x256 tile costs a few
+milliseconds and any level count or colour range can be drawn without regenerating the maps.
+"""
+
+from typing import Optional, Tuple
+import io
+import math
+
+import numpy as np
+from matplotlib.colors import LinearSegmentedColormap, Normalize, TwoSlopeNorm
+from PIL import Image
+
+TILE_SIZE = 256
+CONTOUR_LEVELS = 40
+MIN_LEVELS = 2
+MAX_LEVELS = 256
+MAX_ZOOM = 18
+
+CONTOUR_CMAP = LinearSegmentedColormap.from_list(
+    "blue_transparent_red",
+    [
+        (0.0, (0.0, 0.0, 1.0, 0.9)),
+        (0.45, (0.0, 0.0, 1.0, 0.4)),
+        (0.5, (0.0, 0.0, 1.0, 0.0)),
+        (0.5, (1.0, 0.0, 0.0, 0.0)),
+        (0.55, (1.0, 0.0, 0.0, 0.4)),
+        (1.0, (1.0, 0.0, 0.0, 0.9)),
+    ],
+)
+
+
+def contour_norm(vmin: float, vmax: float):
+    """Norm of the contour maps: centred on 0 when the range spans it, linear otherwise."""
+
+    if vmin < 0.0 < vmax:
+        return TwoSlopeNorm(vmin=vmin, vcenter=0.0, vmax=vmax)
+    return Normalize(vmin=vmin, vmax=vmax)
+
+
+def band_colours(vmin: float, vmax: float, levels: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the level values and the uint8 RGBA colour of each band between them.
+
+    Like contourf, a band is coloured by the normalised value of its midpoint.
+    """
+
+    level_values = np.linspace(vmin, vmax, levels)
+    midpoints = (level_values[:-1] + level_values[1:]) / 2
+    rgba = CONTOUR_CMAP(contour_norm(vmin, vmax)(midpoints))
+    return level_values, (np.asarray(rgba) * 255 + 0.5).astype(np.uint8)
+
+
+def tile_is_valid(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_pixel_centres(z: int, x: int, y: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the latitude of each pixel row (north first) and longitude of each column of a tile."""
+
+    n = 2 ** z
+    offsets = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+    lons = (x + offsets) / n * 360.0 - 180.0
+    lats = np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * (y + offsets) / n))))
+    return lats, lons
+
+
+def _fractional_index(axis: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Fractional position of values along a monotonic axis; NaN outside the first/last point."""
+
+    positions = np.arange(axis.size, dtype=float)
+    if axis.size > 1 and axis[0] > axis[-1]:
+        return np.interp(values, axis[::-1], positions[::-1], left=np.nan, right=np.nan)
+    return np.interp(values, axis, positions, left=np.nan, right=np.nan)
+
+
+def sample_tile(values: np.ndarray, lat: np.ndarray, lon: np.ndarray, z: int, x: int, y: int) -> Optional[np.ndarray]:
+    """Bilinearly sample a (lat, lon) field at the pixel centres of a tile.
+
+    Returns a (TILE_SIZE, TILE_SIZE) float array with NaN outside the grid, or None if the tile
+    does not touch the grid at all.
+    """
+
+    tile_lats, tile_lons = tile_pixel_centres(z, x, y)
+    fi = _fractional_index(lat, tile_lats)
+    fj = _fractional_index(lon, tile_lons)
+    rows = np.isfinite(fi)
+    cols = np.isfinite(fj)
+    if not rows.any() or not cols.any():
+        return None
+
+    out = np.full((TILE_SIZE, TILE_SIZE), np.nan, dtype=np.float32)
+    fi, fj = fi[rows], fj[cols]
+    i0 = np.floor(fi).astype(np.intp)
+    j0 = np.floor(fj).astype(np.intp)
+    i1 = np.minimum(i0 + 1, lat.size - 1)
+    j1 = np.minimum(j0 + 1, lon.size - 1)
+    wi = (fi - i0)[:, None]
+    wj = (fj - j0)[None, :]
+
+    # Only the cells under the tile are read from the (memory-mapped) field.
+    row_lo, row_hi = int(i0.min()), int(i1.max()) + 1
+    col_lo, col_hi = int(j0.min()), int(j1.max()) + 1
+    window = np.asarray(values[row_lo:row_hi, col_lo:col_hi], dtype=np.float32)
+    i0, i1, j0, j1 = i0 - row_lo, i1 - row_lo, j0 - col_lo, j1 - col_lo
+    top = window[np.ix_(i0, j0)] * (1 - wj) + window[np.ix_(i0, j1)] * wj
+    bottom = window[np.ix_(i1, j0)] * (1 - wj) + window[np.ix_(i1, j1)] * wj
+    out[np.ix_(rows, cols)] = top * (1 - wi) + bottom * wi
+    return out
+
+
+def colour_tile(data: np.ndarray, vmin: float, vmax: float, levels: int) -> np.ndarray:
+    """Colour sampled values by contour band; values outside [vmin, vmax] take the end bands."""
+
+    level_values, colours = band_colours(vmin, vmax, levels)
+    finite = np.isfinite(data)
+    bands = np.clip(np.searchsorted(level_values, np.where(finite, data, vmin), side="right") - 1, 0, levels - 2)
+    rgba = colours[bands]
+    rgba[~finite] = 0
+    return rgba
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(rgba).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+EMPTY_TILE_PNG = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
@@ -1,6 +1,21 @@
 import os
+import json
+import time
+import hashlib
+import base64
+import threading
+from urllib.parse import urlencode
 from flask_cors import CORS
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, jsonify, request, send_file, send_from_directory
+import numpy as np
+from collections import OrderedDict
+from io import BytesIO
+from PIL import Image
+from matplotlib.colors import LinearSegmentedColormap
+from matplotlib.path import Path
+import image_variants
+import pyramid
+import value_grids
 
 app = Flask(__name__)
 CORS(app)
@@ -8,6 +23,18 @@ CORS(app)
 APP_ROOT = os.path.dirname(os.path.abspath(__file__))
 DATA_BASE_DIR = os.path.join(APP_ROOT, 'data')
 
+CATALOG_RECHECK_SECONDS = 5.0
+PNG_DIGEST_CACHE_SIZE = 4096
+IMAGE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REGION_MASK_CACHE_SIZE = 64
+STATS_PERCENTILES = [5, 25, 50, 75, 95]
+DIFFERENCE_CACHE_SIZE = 32
+
+# Blue where the comparison is lower, transparent for no change, red where it is higher.
+DIFFERENCE_CMAP = LinearSegmentedColormap.from_list(
+    'BlueTransparentRed', [(0, 0, 1, 1), (0.5, 0.5, 0.5, 0), (1, 0, 0, 1)], 256)
+DIFFERENCE_LUT = (DIFFERENCE_CMAP(np.linspace(0, 1, 256)) * 255 + 0.5).astype(np.uint8)
+
 def _read_global_coordinates():
     """Reads global coordinates from data/coordinates.csv if present.
     Returns a dict like {'lat-min': ..., 'lat-max': ..., 'lon-min': ..., 'lon-max': ...}
@@ -34,6 +61,134 @@ def _read_global_coordinates():
     return None
 
 
+def _mtime_or_none(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _list_subdirs(path):
+    try:
+        return [d for d in sorted(os.listdir(path)) if os.path.isdir(os.path.join(path, d))]
+    except OSError as e:
+        print(f"[WARNING] Failed to list {path}: {e}")
+        return []
+
+
+def _build_catalog():
+    """Walk the data folder once into City -> Time -> Flight Zone -> FPH -> {metrics, pngs}.
+
+    Also records the mtime of every directory walked and of coordinates.csv; adding, removing or
+    renaming an entry changes its parent's mtime, which is how changes are detected.
+    """
+    tree = {}
+    signature = {DATA_BASE_DIR: _mtime_or_none(DATA_BASE_DIR)}
+    coordinates_path = os.path.join(DATA_BASE_DIR, 'coordinates.csv')
+    signature[coordinates_path] = _mtime_or_none(coordinates_path)
+    if os.path.isdir(DATA_BASE_DIR):
+        for city in _list_subdirs(DATA_BASE_DIR):
+            if city in (value_grids.CACHE_DIR_NAME, pyramid.PYRAMID_DIR_NAME):
+                continue
+            city_path = os.path.join(DATA_BASE_DIR, city)
+            signature[city_path] = _mtime_or_none(city_path)
+            tree[city] = {}
+            for time_name in _list_subdirs(city_path):
+                time_path = os.path.join(city_path, time_name)
+                signature[time_path] = _mtime_or_none(time_path)
+                tree[city][time_name] = {}
+                for zone in _list_subdirs(time_path):
+                    zone_path = os.path.join(time_path, zone)
+                    signature[zone_path] = _mtime_or_none(zone_path)
+                    tree[city][time_name][zone] = {}
+                    for fph in _list_subdirs(zone_path):
+                        fph_path = os.path.join(zone_path, fph)
+                        signature[fph_path] = _mtime_or_none(fph_path)
+                        pngs = {}
+                        webps = set()
+                        try:
+                            for fname in sorted(os.listdir(fph_path)):
+                                base, ext = os.path.splitext(fname)
+                                if ext.lower() == '.png':
+                                    pngs[base] = os.path.join(fph_path, fname)
+                                elif ext.lower() == image_variants.WEBP_SUFFIX:
+                                    webps.add(base)
+                        except OSError as e:
+                            print(f"[WARNING] Failed to list metrics in {fph_path}: {e}")
+                        tree[city][time_name][zone][fph] = {
+                            'metrics': list(pngs),
+                            'pngs': pngs,
+                            'lookup': {name.lower(): name for name in reversed(list(pngs))},
+                            'webps': {name: image_variants.get_webp_path(path) for name, path in pngs.items() if name in webps},
+                        }
+    else:
+        print(f"[WARNING] DATA_BASE_DIR does not exist: {DATA_BASE_DIR}")
+
+    bounds = _read_global_coordinates()
+    combinations = {city: {t: {z: {f: {'metrics': entry['metrics']} for f, entry in fphs.items()}
+                               for z, fphs in zones.items()}
+                           for t, zones in times.items()}
+                    for city, times in tree.items()}
+    # The combinations response is serialised once per catalog; its hash is the catalog's ETag.
+    combinations_json = json.dumps({'combinations': combinations, 'bounds': bounds}, sort_keys=True).encode('utf-8')
+    return {
+        'tree': tree,
+        'bounds': bounds,
+        'combinations_json': combinations_json,
+        'etag': hashlib.sha256(combinations_json).hexdigest()[:32],
+    }, signature
+
+
+_CATALOG = None
+_CATALOG_SIGNATURE = None
+_CATALOG_CHECKED_AT = 0.0
+_CATALOG_FORCED_AT = float('-inf')
+_CATALOG_LOCK = threading.Lock()
+
+
+def _get_catalog(force_check=False):
+    """Return the data catalog, rebuilding it when a directory or coordinates.csv has changed.
+
+    Changes are looked for at most every CATALOG_RECHECK_SECONDS, so most requests are plain dict
+    lookups. force_check looks right away, but itself at most once per CATALOG_RECHECK_SECONDS,
+    so unknown selections cannot force a stat walk on every request.
+    """
+    global _CATALOG, _CATALOG_SIGNATURE, _CATALOG_CHECKED_AT, _CATALOG_FORCED_AT
+    now = time.monotonic()
+    force_check = force_check and now - _CATALOG_FORCED_AT >= CATALOG_RECHECK_SECONDS
+    if _CATALOG is not None and not force_check and now - _CATALOG_CHECKED_AT < CATALOG_RECHECK_SECONDS:
+        return _CATALOG
+    with _CATALOG_LOCK:
+        if force_check:
+            _CATALOG_FORCED_AT = now
+        if _CATALOG is None or any(_mtime_or_none(path) != mtime for path, mtime in _CATALOG_SIGNATURE.items()):
+            _CATALOG, _CATALOG_SIGNATURE = _build_catalog()
+        _CATALOG_CHECKED_AT = time.monotonic()
+        return _CATALOG
+
+
+def _catalog_node(*names):
+    """Follow names down the catalog tree; returns the node or None if any level is missing."""
+    node = _get_catalog()['tree']
+    for name in names:
+        if not name or not isinstance(node, dict) or name not in node:
+            return None
+        node = node[name]
+    return node
+
+
+def _catalog_response(payload):
+    """JSON response tagged with the catalog ETag; answers a matching If-None-Match with 304."""
+    etag = _get_catalog()['etag']
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
 @app.route('/scale-argb.png', methods=['GET'])
 def serve_color_scale_image():
     """Serve the color scale image from the data directory."""
@@ -47,85 +202,309 @@ def serve_color_scale_image():
 @app.route('/api/noise_cities', methods=['GET'])
 def noise_cities():
     """Return list of available cities (top-level directories under data)."""
-    if not os.path.isdir(DATA_BASE_DIR):
-        return jsonify([])
-    cities = []
-    for entry in sorted(os.listdir(DATA_BASE_DIR)):
-        if entry.lower() == 'coordinates.csv':
-            continue
-        path = os.path.join(DATA_BASE_DIR, entry)
-        if os.path.isdir(path):
-            cities.append(entry)
-    return jsonify(cities)
+    return _catalog_response(list(_get_catalog()['tree']))
 
 
 @app.route('/api/noise_times', methods=['GET'])
 def noise_times():
     """Return list of time folders (e.g., Daytime, Nighttime) for a given city."""
-    city = request.args.get('city')
-    if not city:
-        return jsonify([])
-    city_path = os.path.join(DATA_BASE_DIR, city)
-    if not os.path.isdir(city_path):
-        return jsonify([])
-    times = [d for d in sorted(os.listdir(city_path)) if os.path.isdir(os.path.join(city_path, d))]
-    return jsonify(times)
+    times = _catalog_node(request.args.get('city'))
+    return _catalog_response(list(times) if times else [])
 
 
 @app.route('/api/noise_flight_zones', methods=['GET'])
 def noise_flight_zones():
     """Return list of flight zones for given city and time."""
-    city = request.args.get('city')
-    time = request.args.get('time')
-    if not city or not time:
-        return jsonify([])
-    time_path = os.path.join(DATA_BASE_DIR, city, time)
-    if not os.path.isdir(time_path):
-        return jsonify([])
-    zones = [d for d in sorted(os.listdir(time_path)) if os.path.isdir(os.path.join(time_path, d))]
-    return jsonify(zones)
+    zones = _catalog_node(request.args.get('city'), request.args.get('time'))
+    return _catalog_response(list(zones) if zones else [])
 
 
 @app.route('/api/noise_flights_per_hour', methods=['GET'])
 def noise_flights_per_hour():
     """Return list of flights-per-hour directories for given city, time and flight zone."""
-    city = request.args.get('city')
-    time = request.args.get('time')
-    zone = request.args.get('flight_zone')
-    if not city or not time or not zone:
-        return jsonify([])
-    zone_path = os.path.join(DATA_BASE_DIR, city, time, zone)
-    if not os.path.isdir(zone_path):
-        return jsonify([])
-    fph = [d for d in sorted(os.listdir(zone_path)) if os.path.isdir(os.path.join(zone_path, d))]
-    return jsonify(fph)
+    fph = _catalog_node(request.args.get('city'), request.args.get('time'), request.args.get('flight_zone'))
+    return _catalog_response(list(fph) if fph else [])
 
 
 @app.route('/api/noise_metrics', methods=['GET'])
 def noise_metrics():
     """Return list of metrics (PNG basenames) for given city, time, zone, flights-per-hour."""
-    city = request.args.get('city')
-    time = request.args.get('time')
-    zone = request.args.get('flight_zone')
-    fph = request.args.get('flights_per_hour')
-    if not city or not time or not zone or not fph:
-        return jsonify([])
-    metrics_path = os.path.join(DATA_BASE_DIR, city, time, zone, fph)
-    if not os.path.isdir(metrics_path):
-        return jsonify([])
-    metrics = []
+    entry = _catalog_node(request.args.get('city'), request.args.get('time'),
+                          request.args.get('flight_zone'), request.args.get('flights_per_hour'))
+    return _catalog_response(entry['metrics'] if entry else [])
+
+
+_PNG_DIGESTS = OrderedDict()
+_PNG_DIGESTS_LOCK = threading.Lock()
+
+
+def _png_digest(png_path):
+    """Return a content hash of the PNG, recomputed only when its size or mtime changes.
+
+    The PNG_DIGEST_CACHE_SIZE most recently used hashes are kept.
+    """
+    st = os.stat(png_path)
+    signature = (st.st_mtime_ns, st.st_size)
+    with _PNG_DIGESTS_LOCK:
+        cached = _PNG_DIGESTS.get(png_path)
+        if cached and cached[0] == signature:
+            _PNG_DIGESTS.move_to_end(png_path)
+            return cached[1]
+    h = hashlib.sha256()
+    with open(png_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    digest = h.hexdigest()[:20]
+    with _PNG_DIGESTS_LOCK:
+        _PNG_DIGESTS[png_path] = (signature, digest)
+        _PNG_DIGESTS.move_to_end(png_path)
+        while len(_PNG_DIGESTS) > PNG_DIGEST_CACHE_SIZE:
+            _PNG_DIGESTS.popitem(last=False)
+    return digest
+
+
+def _selected_image(args):
+    """Resolve city/time/flight_zone/flights_per_hour/metric (metric case-insensitive) to (fph entry, metric name)."""
+    names = (args.get('city'), args.get('time'), args.get('flight_zone'), args.get('flights_per_hour'))
+    metric = args.get('metric')
+    if not metric:
+        return None, None
+    key = os.path.splitext(metric)[0].lower()
+    entry = _catalog_node(*names)
+    if not entry or key not in entry['lookup']:
+        # The image may have been added since the last check.
+        _get_catalog(force_check=True)
+        entry = _catalog_node(*names)
+    if not entry:
+        return None, None
+    return entry, entry['lookup'].get(key)
+
+
+def _mercator_y(lat):
+    lat = np.clip(np.asarray(lat, dtype=float), -85.05112878, 85.05112878)
+    return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def _image_bounds():
+    """Global bounds as (lat_min, lat_max, lon_min, lon_max), or None if coordinates.csv is missing or incomplete."""
+    bounds = _get_catalog()['bounds'] or {}
     try:
-        for fname in sorted(os.listdir(metrics_path)):
-            if fname.lower().endswith('.png'):
-                metrics.append(os.path.splitext(fname)[0])
-    except Exception as e:
-        print(f"[WARNING] Failed to list metrics in {metrics_path}: {e}")
-    return jsonify(metrics)
+        return tuple(float(bounds[k]) for k in ('lat-min', 'lat-max', 'lon-min', 'lon-max'))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _pixel_centres(bounds, shape):
+    """Latitude of each image row (north first) and longitude of each column.
+
+    Leaflet stretches image overlays linearly in Web Mercator, so rows are evenly spaced in mercator y.
+    """
+    lat_min, lat_max, lon_min, lon_max = bounds
+    height, width = shape
+    lons = lon_min + (np.arange(width) + 0.5) / width * (lon_max - lon_min)
+    y_top, y_bottom = _mercator_y(lat_max), _mercator_y(lat_min)
+    ys = y_top - (np.arange(height) + 0.5) / height * (y_top - y_bottom)
+    lats = np.degrees(2 * np.arctan(np.exp(ys)) - np.pi / 2)
+    return lats, lons
+
+
+def _pixel_index(bounds, shape, lat, lon):
+    """(row, col) of the pixel containing lat/lon, or None outside the image."""
+    lat_min, lat_max, lon_min, lon_max = bounds
+    height, width = shape
+    if not (lat_min <= lat <= lat_max and lon_min <= lon <= lon_max):
+        return None
+    y_top, y_bottom = _mercator_y(lat_max), _mercator_y(lat_min)
+    row = int((y_top - _mercator_y(lat)) / (y_top - y_bottom) * height)
+    col = int((lon - lon_min) / (lon_max - lon_min) * width)
+    return min(row, height - 1), min(col, width - 1)
+
+
+def _selected_grid(args):
+    """Return (ValueGrid, metric name) for the selected image, or raise LookupError."""
+    entry, name = _selected_image(args)
+    if not name:
+        raise LookupError('Image not found')
+    try:
+        return value_grids.load(DATA_BASE_DIR, entry['pngs'][name], name), name
+    except (OSError, ValueError) as e:
+        print(f"[WARNING] Failed to decode values of {entry['pngs'][name]}: {e}")
+        raise LookupError('Values could not be decoded')
+
+
+def _parse_polygon(text):
+    values = [float(v) for v in (text or '').replace(';', ',').split(',') if v.strip()]
+    if len(values) < 6 or len(values) % 2:
+        raise ValueError('polygon needs at least three lon,lat pairs')
+    return tuple(values)
+
+
+_REGION_MASKS = {}
+_REGION_MASKS_LOCK = threading.Lock()
+
+
+def _polygon_mask(bounds, shape, polygon):
+    """Boolean mask of image pixels whose centres lie inside polygon, cached per bounds, image size and polygon."""
+    key = (bounds, shape, polygon)
+    mask = _REGION_MASKS.get(key)
+    if mask is not None:
+        return mask
+    vertices = np.asarray(polygon, dtype=float).reshape(-1, 2)
+    lats, lons = _pixel_centres(bounds, shape)
+    rows = np.nonzero((lats >= vertices[:, 1].min()) & (lats <= vertices[:, 1].max()))[0]
+    cols = np.nonzero((lons >= vertices[:, 0].min()) & (lons <= vertices[:, 0].max()))[0]
+    mask = np.zeros(shape, dtype=bool)
+    if rows.size and cols.size:
+        lon2d, lat2d = np.meshgrid(lons[cols], lats[rows])
+        inside = Path(vertices).contains_points(np.column_stack([lon2d.ravel(), lat2d.ravel()]))
+        mask[np.ix_(rows, cols)] = inside.reshape(lat2d.shape)
+    with _REGION_MASKS_LOCK:
+        if len(_REGION_MASKS) >= REGION_MASK_CACHE_SIZE:
+            _REGION_MASKS.pop(next(iter(_REGION_MASKS)))
+        _REGION_MASKS[key] = mask
+    return mask
+
+
+def _value_stats(values, threshold=None):
+    """Summary of the finite values in a 1-D array; share_above is the fraction >= threshold."""
+    values = values[np.isfinite(values)]
+    stats = {'count': int(values.size), 'mean': None, 'min': None, 'max': None,
+             'percentiles': {str(p): None for p in STATS_PERCENTILES}}
+    if values.size:
+        stats.update({
+            'mean': float(values.mean()),
+            'min': float(values.min()),
+            'max': float(values.max()),
+            'percentiles': {str(p): float(v) for p, v in zip(STATS_PERCENTILES, np.percentile(values, STATS_PERCENTILES))},
+        })
+    if threshold is not None:
+        stats['share_above'] = float((values >= threshold).mean()) if values.size else None
+    return stats
+
+
+_difference_stats = OrderedDict()
+_difference_overlays = OrderedDict()
+_difference_lock = threading.Lock()
+
+
+def _cache_get(cache, key):
+    with _difference_lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+
+def _cache_put(cache, key, value):
+    with _difference_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > DIFFERENCE_CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+def _difference_selection(args):
+    """Resolve the base selection and the comparison (compare_time / compare_flight_zone /
+    compare_flights_per_hour, each defaulting to the base value) to their PNG paths.
+
+    Returns ((base_path, compare_path), metric name, compare args); raises LookupError if either is missing.
+    """
+    base_args = {k: args.get(k) for k in ('city', 'time', 'flight_zone', 'flights_per_hour', 'metric')}
+    compare_args = dict(base_args)
+    for k in ('time', 'flight_zone', 'flights_per_hour'):
+        compare_args[k] = args.get(f"compare_{k}") or base_args[k]
+    base_entry, name = _selected_image(base_args)
+    compare_entry, compare_name = _selected_image(compare_args)
+    if not name or not compare_name:
+        raise LookupError('Image not found for one of the selections')
+    return (base_entry['pngs'][name], compare_entry['pngs'][compare_name]), name, compare_args
+
+
+def _difference_key(paths):
+    return tuple((path, _png_digest(path)) for path in paths)
+
+
+def _difference_values(paths, metric):
+    """Returns (base values, compare values, units) of a selection pair; raises ValueError if the images differ in size."""
+    base = value_grids.load(DATA_BASE_DIR, paths[0], metric)
+    compare = value_grids.load(DATA_BASE_DIR, paths[1], metric)
+    if base.values.shape != compare.values.shape:
+        raise ValueError(f"Images differ in size: {base.values.shape} vs {compare.values.shape}")
+    return np.asarray(base.values), np.asarray(compare.values), base.units
+
+
+def compute_noise_difference(paths, metric):
+    """
+    Summarises compare minus base for a metric from the decoded value grids.
+    Memoised per pair of PNG contents; only the statistics are kept, the grids stay memory-mapped.
+    """
+    key = _difference_key(paths)
+    stats = _cache_get(_difference_stats, key)
+    if stats is not None:
+        return stats
+    base_values, compare_values, units = _difference_values(paths, metric)
+    diff = compare_values - base_values
+    both = np.isfinite(diff)
+    stats = _value_stats(diff[both])
+    base_mean = float(base_values[both].mean()) if both.any() else None
+    compare_mean = float(compare_values[both].mean()) if both.any() else None
+    stats.update({
+        'units': units,
+        'base_mean': base_mean,
+        'compare_mean': compare_mean,
+        'percentage_change': (compare_mean - base_mean) / base_mean * 100 if base_mean else None,
+        'share_increased': float((diff[both] > 0).mean()) if both.any() else None,
+        'share_decreased': float((diff[both] < 0).mean()) if both.any() else None,
+        'max_abs_difference': float(np.abs(diff[both]).max()) if both.any() else None,
+    })
+    _cache_put(_difference_stats, key, stats)
+    return stats
+
+
+def render_noise_difference(paths, metric):
+    """Colours compare minus base on a symmetric scale (blue lower, red higher) as PNG bytes, memoised per pair."""
+    key = _difference_key(paths)
+    png_bytes = _cache_get(_difference_overlays, key)
+    if png_bytes is not None:
+        return png_bytes
+    stats = compute_noise_difference(paths, metric)
+    base_values, compare_values, _ = _difference_values(paths, metric)
+    diff = compare_values - base_values
+    max_abs = stats['max_abs_difference'] or 1.0
+    finite = np.isfinite(diff)
+    index = np.clip((np.where(finite, diff, 0.0) / max_abs + 1) / 2 * 255 + 0.5, 0, 255).astype(np.uint8)
+    rgba = DIFFERENCE_LUT[index]
+    rgba[~finite] = 0
+    buffer = BytesIO()
+    Image.fromarray(rgba).save(buffer, format='PNG')
+    png_bytes = buffer.getvalue()
+    _cache_put(_difference_overlays, key, png_bytes)
+    return png_bytes
+
+
+def _difference_version(paths):
+    return hashlib.sha256(repr(_difference_key(paths)).encode('utf-8')).hexdigest()[:20]
+
+
+def _requested_level_width(png_path, args):
+    """Pyramid level width for the width/dpr query parameters, or None for the full image."""
+    try:
+        viewport_width = float(args.get('width', ''))
+        pixel_ratio = float(args.get('dpr', '1') or 1)
+    except ValueError:
+        return None
+    return pyramid.choose_width(pyramid.source_width(png_path), viewport_width, pixel_ratio)
 
 
 @app.route('/api/noise_image_info', methods=['GET'])
 def noise_image_info():
-    """Return base64 image data and global boundaries for given city, time, zone, fph, and metric."""
+    """Return the image URL and global boundaries for given city, time, zone, fph, and metric.
+
+    The image URL carries a content hash, so the file behind it can be cached forever.
+    Pass width (viewport width in CSS pixels) and optionally dpr (device pixel ratio) to get the
+    URL of the smallest pyramid level that still fills it.
+    Pass b64=1 to also get the full PNG inline as base64.
+    """
     city = request.args.get('city')
     time = request.args.get('time')
     zone = request.args.get('flight_zone')
@@ -134,68 +513,188 @@ def noise_image_info():
     if not city or not time or not zone or not fph or not metric:
         return jsonify({})
 
-    img_dir = os.path.join(DATA_BASE_DIR, city, time, zone, fph)
-    if not os.path.isdir(img_dir):
-        return jsonify({'image_data': None, 'bounds': _read_global_coordinates()})
+    bounds = _get_catalog()['bounds']
+    entry, name = _selected_image(request.args)
+    if not name:
+        return jsonify({'image_data': None, 'image_url': None, 'bounds': bounds})
 
+    png_path = entry['pngs'][name]
     image_b64 = None
+    image_url = None
     try:
-        target_base = os.path.splitext(metric)[0].lower()
-        for fname in os.listdir(img_dir):
-            if os.path.splitext(fname)[0].lower() == target_base and fname.lower().endswith('.png'):
-                image_file_path = os.path.join(img_dir, fname)
-                import base64
-                with open(image_file_path, 'rb') as imgf:
-                    image_b64 = base64.b64encode(imgf.read()).decode('utf-8')
-                break
+        params = {'city': city, 'time': time, 'flight_zone': zone, 'flights_per_hour': fph,
+                  'metric': name, 'v': _png_digest(png_path)}
+        level_width = _requested_level_width(png_path, request.args)
+        if level_width:
+            params['w'] = level_width
+        image_url = f"/api/noise_assessment/api/noise_image_file?{urlencode(params)}"
+        if request.args.get('b64', '').lower() in ('1', 'true', 'yes'):
+            with open(png_path, 'rb') as imgf:
+                image_b64 = base64.b64encode(imgf.read()).decode('utf-8')
     except Exception as e:
         print(f"[WARNING] Failed to read image for {city}/{time}/{zone}/{fph}/{metric}: {e}")
 
-    boundaries = _read_global_coordinates()
-    return jsonify({'image_data': image_b64, 'bounds': boundaries})
+    return jsonify({'image_data': image_b64, 'image_url': image_url, 'bounds': bounds})
+
+
+@app.route('/api/noise_image_file', methods=['GET'])
+def noise_image_file():
+    """Stream a metric image, as WebP when the client accepts it and a fresh copy exists, else PNG.
+    With w=<width> the downscaled pyramid level of that width is served instead.
+
+    The PNG content hash is the ETag (suffixed per variant) and If-None-Match is answered with 304.
+    When the v= parameter matches the current hash the response is cached as immutable;
+    otherwise clients must revalidate.
+    """
+    entry, name = _selected_image(request.args)
+    if not name:
+        return jsonify({'error': 'Image not found'}), 404
+    png_path = entry['pngs'][name]
+    try:
+        digest = _png_digest(png_path)
+    except OSError:
+        return jsonify({'error': 'Image not found'}), 404
+
+    path, mimetype, etag = png_path, 'image/png', digest
+    level_width = request.args.get('w', type=int)
+    level_path = None
+    if level_width in pyramid.LEVEL_WIDTHS and level_width < pyramid.source_width(png_path):
+        level_path = pyramid.ensure_level(DATA_BASE_DIR, os.path.join(DATA_BASE_DIR, pyramid.PYRAMID_DIR_NAME),
+                                          png_path, level_width)
+    webp_path = entry['webps'].get(name)
+    if level_path:
+        path, etag = level_path, f"{digest}-w{level_width}"
+    elif webp_path and 'image/webp' in request.headers.get('Accept', '') and image_variants.is_fresh(png_path, webp_path):
+        path, mimetype, etag = webp_path, 'image/webp', f"{digest}-webp"
+
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = send_file(path, mimetype=mimetype, etag=False, conditional=False)
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept'
+    response.headers['Cache-Control'] = IMAGE_CACHE_CONTROL if request.args.get('v') == digest else 'no-cache'
+    return response
+
+
+@app.route('/api/noise_point', methods=['GET'])
+def noise_point():
+    """Return the decoded value of a metric at lat/lon for given city, time, zone, fph, and metric."""
+    try:
+        lat = float(request.args.get('lat', ''))
+        lon = float(request.args.get('lon', ''))
+    except ValueError:
+        return jsonify({'error': 'lat and lon must be numbers'}), 400
+    try:
+        grid, name = _selected_grid(request.args)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    bounds = _image_bounds()
+    if bounds is None:
+        return jsonify({'error': 'coordinates.csv is missing'}), 404
+    index = _pixel_index(bounds, grid.values.shape, lat, lon)
+    if index is None:
+        return jsonify({'error': 'Point outside the image'}), 404
+    value = float(grid.values[index])
+    return jsonify({'metric': name, 'value': value if np.isfinite(value) else None, 'units': grid.units})
+
+
+@app.route('/api/noise_region_stats', methods=['GET'])
+def noise_region_stats():
+    """Return statistics of a metric inside polygon=lon,lat;lon,lat;... for given city, time, zone, fph, and metric.
+
+    Pass threshold to also get share_above, the fraction of decoded pixels at or above it
+    (e.g. the highly-annoyed share of a district).
+    """
+    try:
+        polygon = _parse_polygon(request.args.get('polygon'))
+        threshold = request.args.get('threshold')
+        threshold = float(threshold) if threshold not in (None, '') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        grid, name = _selected_grid(request.args)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    bounds = _image_bounds()
+    if bounds is None:
+        return jsonify({'error': 'coordinates.csv is missing'}), 404
+    mask = _polygon_mask(bounds, grid.values.shape, polygon)
+    stats = _value_stats(np.asarray(grid.values)[mask], threshold)
+    stats.update({'metric': name, 'units': grid.units, 'pixels': int(mask.sum())})
+    return jsonify(stats)
+
+
+@app.route('/api/noise_difference', methods=['GET'])
+def noise_difference():
+    """Return change statistics of a metric between two selections, plus the difference overlay URL.
+
+    Query: city, time, flight_zone, flights_per_hour, metric for the base selection, and any of
+    compare_time, compare_flight_zone, compare_flights_per_hour for the comparison.
+    Differences are comparison minus base.
+    """
+    try:
+        paths, name, compare_args = _difference_selection(request.args)
+        stats = compute_noise_difference(paths, name)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    except OSError as e:
+        print(f"[WARNING] Failed to difference {paths}: {e}")
+        return jsonify({'error': 'Values could not be decoded'}), 500
+    params = {k: request.args.get(k) for k in ('city', 'time', 'flight_zone', 'flights_per_hour')}
+    params.update({f"compare_{k}": compare_args[k] for k in ('time', 'flight_zone', 'flights_per_hour')})
+    params.update({'metric': name, 'v': _difference_version(paths)})
+    result = dict(stats)
+    result.update({
+        'metric': name,
+        'bounds': _get_catalog()['bounds'],
+        'overlay_url': f"/api/noise_assessment/api/noise_difference_overlay?{urlencode(params)}",
+    })
+    return jsonify(result)
+
+
+@app.route('/api/noise_difference_overlay', methods=['GET'])
+def noise_difference_overlay():
+    """Serve the difference overlay of two selections (same query as noise_difference).
+
+    Cached as immutable when v= matches the current version of both images.
+    """
+    try:
+        paths, name, _ = _difference_selection(request.args)
+        version = _difference_version(paths)
+        if version in request.if_none_match:
+            response = app.response_class(status=304)
+        else:
+            response = app.response_class(render_noise_difference(paths, name), mimetype='image/png')
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    except OSError as e:
+        print(f"[WARNING] Failed to difference {request.args.to_dict()}: {e}")
+        return jsonify({'error': 'Values could not be decoded'}), 500
+    response.set_etag(version)
+    response.headers['Cache-Control'] = IMAGE_CACHE_CONTROL if request.args.get('v') == version else 'no-cache'
+    return response
 
 
 @app.route('/api/noise_available_combinations', methods=['GET'])
 def noise_available_combinations():
-    """Scan data folder for City -> Time -> Flight Zones -> FPH -> Metrics."""
-    print(f"[INFO] noise_available_combinations called.")
-    results = {}
-    if not os.path.isdir(DATA_BASE_DIR):
-        print(f"[WARNING] DATA_BASE_DIR does not exist: {DATA_BASE_DIR}")
-        return jsonify({'combinations': results, 'bounds': None})
-
-    for city in sorted(os.listdir(DATA_BASE_DIR)):
-        if city.lower() == 'coordinates.csv':
-            continue
-        city_path = os.path.join(DATA_BASE_DIR, city)
-        if not os.path.isdir(city_path):
-            continue
-        results[city] = {}
-        for time in sorted(os.listdir(city_path)):
-            time_path = os.path.join(city_path, time)
-            if not os.path.isdir(time_path):
-                continue
-            results[city][time] = {}
-            for zone in sorted(os.listdir(time_path)):
-                zone_path = os.path.join(time_path, zone)
-                if not os.path.isdir(zone_path):
-                    continue
-                results[city][time][zone] = {}
-                for fph in sorted(os.listdir(zone_path)):
-                    fph_path = os.path.join(zone_path, fph)
-                    if not os.path.isdir(fph_path):
-                        continue
-                    metrics = []
-                    try:
-                        for fname in sorted(os.listdir(fph_path)):
-                            if fname.lower().endswith('.png'):
-                                metrics.append(os.path.splitext(fname)[0])
-                    except Exception as e:
-                        print(f"[WARNING] Failed to list metrics in {fph_path}: {e}")
-                    results[city][time][zone][fph] = {'metrics': metrics}
+    """Return the City -> Time -> Flight Zones -> FPH -> Metrics tree and global bounds.
 
-    bounds = _read_global_coordinates()
-    return jsonify({'combinations': results, 'bounds': bounds})
+    The body is serialised once per catalog rebuild and carries the catalog ETag.
+    """
+    catalog = _get_catalog()
+    if catalog['etag'] in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(catalog['combinations_json'], mimetype='application/json')
+    response.set_etag(catalog['etag'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 if __name__ == "__main__":
+    _get_catalog()
     app.run(debug=True, host='0.0.0.0', port=4003)
@@ -0,0 +1,66 @@
+"""
+Lossless WebP copies of the noise metric PNGs.
+
+Each {City}/{Time}/{Zone}/{FPH}/<metric>.png can get a <metric>.webp next to it. The app serves
+the WebP to browsers that accept it and falls back to the PNG when the copy is missing or older
+than the PNG. Copies are only written by this script, since the data folder may be mounted
+read-only in the service:
+
+python image_variants.py [data_dir]
+"""
+import os
+import sys
+import threading
+from PIL import Image
+import pyramid
+import value_grids
+
+WEBP_SUFFIX = '.webp'
+
+def get_webp_path(png_path):
+    return os.path.splitext(png_path)[0] + WEBP_SUFFIX
+
+def is_fresh(png_path, variant_path):
+    try:
+        return os.stat(variant_path).st_mtime_ns >= os.stat(png_path).st_mtime_ns
+    except OSError:
+        return False
+
+def write_webp(png_path, force=False):
+    """Writes the lossless WebP copy of png_path unless an up-to-date one exists. Returns its path."""
+    webp_path = get_webp_path(png_path)
+    if not force and is_fresh(png_path, webp_path):
+        return webp_path
+    tmp_path = f"{webp_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with Image.open(png_path) as image:
+        image.save(tmp_path, format='WEBP', lossless=True, quality=80, method=4)
+    os.replace(tmp_path, webp_path)
+    return webp_path
+
+def write_all(data_dir):
+    """
+    Writes WebP copies for every metric PNG in the City/Time/Zone/FPH folders of data_dir. Root files
+    such as scale-argb.png and the cache folders (pyramid levels, value grids) are not walked into.
+    """
+    root_depth = os.path.abspath(data_dir).rstrip(os.sep).count(os.sep)
+    for root, dirs, files in os.walk(data_dir):
+        depth = os.path.abspath(root).count(os.sep) - root_depth
+        if depth == 0:
+            dirs[:] = [d for d in dirs if d not in (pyramid.PYRAMID_DIR_NAME, value_grids.CACHE_DIR_NAME)]
+        elif depth >= 4:
+            dirs[:] = []
+        dirs.sort()
+        if depth != 4:
+            continue
+        for file_name in sorted(files):
+            if not file_name.lower().endswith('.png'):
+                continue
+            png_path = os.path.join(root, file_name)
+            try:
+                webp_path = write_webp(png_path)
+                print(f"{png_path}: {os.path.getsize(png_path)} -> {os.path.getsize(webp_path)} bytes")
+            except Exception as e:
+                print(f"[WARNING] Failed to write WebP copy of {png_path}: {e}")
+
+if __name__ == '__main__':
+    write_all(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
@@ -0,0 +1,213 @@
+"""
+Numeric value grids decoded from the noise metric PNGs.
+
+The overlays are drawn with the discrete colour steps of data/scale-argb.png, left (minimum) to
+right (maximum). Each step's colour is mapped back to the value at the middle of its step within
+the metric's range (METRIC_RANGES), so decoded values are exact to half a colour step. Pixels are
+matched to the nearest scale colour in RGB with a KD-tree over the palette, queried once per
+distinct colour of the image. Transparent pixels and colours further than MAX_COLOUR_DISTANCE
+from every step (basemap, labels) become NaN.
+
+Each {City}/{Time}/{Zone}/{FPH}/<metric>.png gets data/value_grids/{City}/{Time}/{Zone}/{FPH}/
+<metric>.npy (float32, image rows north to south) and a <metric>.json recording the source
+PNG's size and mtime, the scale's mtime and the value range. The app maps them with
+np.load(mmap_mode='r'). Missing or stale grids are decoded on first use and written if the data
+folder is writable, or ahead of time with:
+
+python value_grids.py [data_dir]
+"""
+import os
+import sys
+import json
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from scipy.spatial import cKDTree
+
+CACHE_DIR_NAME = "value_grids"
+SCALE_FILE_NAME = "scale-argb.png"
+FORMAT_VERSION = 1
+MAX_COLOUR_DISTANCE = 30.0
+# Grids that could not be written (read-only data folder) are held in memory, most recently used first.
+DECODED_GRID_CACHE_SIZE = 32
+
+# (min, max, units) of each metric's colour scale; these match the legends on the noise page.
+METRIC_RANGES = {
+    'Ambient': (0.0, 100.0, 'dB'),
+    'L(AE)eq': (0.0, 100.0, 'dB'),
+    'AnnoyanceShift(ambi)': (0.0, 10.0, ''),
+    'HighAnnoyPerc(ambi)': (0.0, 100.0, '%'),
+}
+DEFAULT_RANGE = (0.0, 100.0, '')
+
+_scales = {}
+_grids = {}
+_decoded_grids = OrderedDict()
+_path_locks = {}
+_lock = threading.Lock()
+
+def metric_range(metric):
+    return METRIC_RANGES.get(metric, DEFAULT_RANGE)
+
+class ColourScale:
+    """The colour steps of scale-argb.png: opaque step colours and the fraction of the scale at each step's middle."""
+
+    def __init__(self, scale_path):
+        with Image.open(scale_path) as image:
+            rgba = np.asarray(image.convert('RGBA'))
+        row = rgba[rgba.shape[0] // 2].astype(np.int16)
+        width = row.shape[0]
+        change = np.nonzero(np.any(row[1:] != row[:-1], axis=1))[0] + 1
+        starts = np.concatenate([[0], change])
+        ends = np.concatenate([change, [width]])
+        colours = []
+        fractions = []
+        for start, end in zip(starts, ends):
+            if row[start, 3] == 0:
+                continue
+            colours.append(row[start, :3])
+            fractions.append((start + end) / 2 / width)
+        if not colours:
+            raise ValueError(f"{scale_path} has no opaque colours")
+        self.mtime_ns = os.stat(scale_path).st_mtime_ns
+        self.colours = np.asarray(colours, dtype=float)
+        self.fractions = np.asarray(fractions, dtype=float)
+        self.tree = cKDTree(self.colours)
+
+def load_scale(data_dir):
+    scale_path = os.path.join(data_dir, SCALE_FILE_NAME)
+    mtime_ns = os.stat(scale_path).st_mtime_ns
+    cached = _scales.get(scale_path)
+    if cached is None or cached.mtime_ns != mtime_ns:
+        cached = ColourScale(scale_path)
+        _scales[scale_path] = cached
+    return cached
+
+def decode_png(png_path, scale, vmin, vmax):
+    """Returns the (height, width) float32 values of a metric PNG, NaN where no scale colour matches."""
+    with Image.open(png_path) as image:
+        rgba = np.asarray(image.convert('RGBA'))
+    packed = (rgba[..., 0].astype(np.uint32) << 16) | (rgba[..., 1].astype(np.uint32) << 8) | rgba[..., 2]
+    packed[rgba[..., 3] == 0] = 0xFFFFFFFF
+    unique, inverse = np.unique(packed.ravel(), return_inverse=True)
+    rgb = np.stack([(unique >> 16) & 0xFF, (unique >> 8) & 0xFF, unique & 0xFF], axis=1).astype(float)
+    distance, index = scale.tree.query(rgb)
+    values = (vmin + scale.fractions[index] * (vmax - vmin)).astype(np.float32)
+    values[(distance > MAX_COLOUR_DISTANCE) | (unique == 0xFFFFFFFF)] = np.nan
+    return values[inverse].reshape(packed.shape)
+
+def get_grid_paths(data_dir, png_path):
+    relative = os.path.relpath(os.path.splitext(os.path.abspath(png_path))[0], os.path.abspath(data_dir))
+    base = os.path.join(os.path.abspath(data_dir), CACHE_DIR_NAME, relative)
+    return base + '.npy', base + '.json'
+
+def _signature(png_path, scale, metric):
+    st = os.stat(png_path)
+    vmin, vmax, units = metric_range(metric)
+    return {'version': FORMAT_VERSION, 'source_size': st.st_size, 'source_mtime': st.st_mtime_ns,
+            'scale_mtime': scale.mtime_ns, 'vmin': vmin, 'vmax': vmax, 'units': units}
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+class ValueGrid:
+    """Decoded values of one metric PNG plus the range and units they were decoded with."""
+
+    def __init__(self, values, meta):
+        self.values = values
+        self.meta = meta
+        self.units = meta['units']
+
+def ingest(data_dir, png_path, metric, force=False):
+    """
+    Decodes png_path and writes its grid unless an up-to-date one exists.
+    Returns the ValueGrid; it is kept in memory only when the grid could not be written.
+    """
+    scale = load_scale(data_dir)
+    signature = _signature(png_path, scale, metric)
+    npy_path, meta_path = get_grid_paths(data_dir, png_path)
+    if not force and _read_meta(meta_path) == signature and os.path.exists(npy_path):
+        return ValueGrid(np.load(npy_path, mmap_mode='r'), signature)
+
+    values = decode_png(png_path, scale, signature['vmin'], signature['vmax'])
+    try:
+        os.makedirs(os.path.dirname(npy_path), exist_ok=True)
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(npy_path + suffix, 'wb') as f:
+            np.save(f, values)
+        os.replace(npy_path + suffix, npy_path)
+        with open(meta_path + suffix, 'w') as f:
+            json.dump(signature, f, indent=2)
+        os.replace(meta_path + suffix, meta_path)
+        return ValueGrid(np.load(npy_path, mmap_mode='r'), signature)
+    except OSError as e:
+        print(f"[WARNING] Could not store value grid for {png_path}: {e}")
+        return ValueGrid(values, signature)
+
+def _cached_grid(png_path, signature):
+    with _lock:
+        cached = _grids.get(png_path)
+        if cached is None:
+            cached = _decoded_grids.get(png_path)
+            if cached is not None:
+                _decoded_grids.move_to_end(png_path)
+        return cached if cached is not None and cached.meta == signature else None
+
+def load(data_dir, png_path, metric):
+    """
+    Returns the ValueGrid of png_path, decoding it first if it is missing or stale. Memory-mapped
+    grids are kept per path until the PNG or scale changes; grids held in memory only the
+    DECODED_GRID_CACHE_SIZE most recently used. Decoding one PNG only blocks callers of that PNG.
+    """
+    png_path = os.path.abspath(png_path)
+    scale = load_scale(data_dir)
+    signature = _signature(png_path, scale, metric)
+    cached = _cached_grid(png_path, signature)
+    if cached is not None:
+        return cached
+    with _lock:
+        path_lock = _path_locks.setdefault(png_path, threading.Lock())
+    with path_lock:
+        cached = _cached_grid(png_path, signature)
+        if cached is not None:
+            return cached
+        grid = ingest(data_dir, png_path, metric)
+        with _lock:
+            if isinstance(grid.values, np.memmap):
+                _decoded_grids.pop(png_path, None)
+                _grids[png_path] = grid
+            else:
+                _grids.pop(png_path, None)
+                _decoded_grids[png_path] = grid
+                while len(_decoded_grids) > DECODED_GRID_CACHE_SIZE:
+                    _decoded_grids.popitem(last=False)
+        return grid
+
+def ingest_all(data_dir):
+    """Writes value grids for every metric PNG in the City/Time/Zone/FPH folders of data_dir."""
+    root_depth = os.path.abspath(data_dir).rstrip(os.sep).count(os.sep)
+    for root, dirs, files in os.walk(data_dir):
+        if os.path.abspath(root) == os.path.abspath(data_dir):
+            dirs[:] = [d for d in dirs if d != CACHE_DIR_NAME]
+        dirs.sort()
+        if os.path.abspath(root).count(os.sep) - root_depth != 4:
+            continue
+        for file_name in sorted(files):
+            base, ext = os.path.splitext(file_name)
+            if ext.lower() != '.png':
+                continue
+            png_path = os.path.join(root, file_name)
+            try:
+                grid = ingest(data_dir, png_path, base)
+                finite = np.isfinite(grid.values)
+                print(f"Value grid for {png_path}: {grid.values.shape}, {finite.mean():.1%} decoded")
+            except Exception as e:
+                print(f"[WARNING] Failed to decode {png_path}: {e}")
+
+if __name__ == '__main__':
+    ingest_all(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
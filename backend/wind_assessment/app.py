@@ -1,17 +1,25 @@
 import re 
 import os
+import json
+import time
 import base64
+import hashlib
+import threading
+from collections import OrderedDict
 import numpy as np
 import matplotlib 
 matplotlib.use('Agg') 
 import cartopy.crs as ccrs
 from flask_cors import CORS
 from pyproj import Transformer, CRS
-from flask import Flask, request, jsonify
+from urllib.parse import urlencode
+from flask import Flask, request, jsonify, send_file
+import pyramid
 
 APP_ROOT = os.path.dirname(os.path.abspath(__file__))
 DATA_BASE_DIR = os.path.join(APP_ROOT, 'data')
 PLOT_OUTPUT_DIR = os.path.abspath(os.path.join("data", "output_pngs_overlay"))
+PYRAMID_DIR = pyramid.get_pyramid_dir(PLOT_OUTPUT_DIR)
 
 CRS_RD_NEW = CRS("EPSG:28992")
 CRS_WGS84 = CRS("EPSG:4326")
@@ -37,175 +45,331 @@ PARAMETER_MAPPING = {
     "Turbulence Level": "TKE"
 }
 
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+PNG_DIGEST_CACHE_SIZE = 4096
+
+
+def compute_city_bounds(city_meta):
+    """
+    [[lat_sw, lon_sw], [lat_ne, lon_ne]] of the RD-New square of radius_m around a city's center,
+    which is the extent heatmap_gen.py renders. Raises ValueError on incomplete configuration.
+    """
+    if "center_latlon" not in city_meta or "radius_m" not in city_meta:
+        raise ValueError("center_latlon and radius_m are required")
+    center_lat, center_lon = city_meta["center_latlon"]
+    radius_m = city_meta["radius_m"]
+    center_x_rd, center_y_rd = transformer_wgs_to_rd.transform(center_lat, center_lon)
+    lon_sw, lat_sw = transformer_rd_to_wgs.transform(center_x_rd - radius_m, center_y_rd - radius_m)
+    lon_ne, lat_ne = transformer_rd_to_wgs.transform(center_x_rd + radius_m, center_y_rd + radius_m)
+    if not all(np.isfinite(val) for val in [lon_sw, lat_sw, lon_ne, lat_ne]):
+        raise ValueError("Coordinate transformation resulted in non-finite values.")
+    return [[lat_sw, lon_sw], [lat_ne, lon_ne]]
+
+
+# The bounds only depend on CITY_INFO, so they are transformed once; failures are kept as messages.
+CITY_BOUNDS = {}
+for _city_name, _city_meta in CITY_INFO.items():
+    try:
+        CITY_BOUNDS[_city_name] = compute_city_bounds(_city_meta)
+    except Exception as e:
+        CITY_BOUNDS[_city_name] = f"Bounds calculation failed for city '{_city_name}': {e}"
+        print(f"[WARNING] {CITY_BOUNDS[_city_name]}")
+
+_png_digests = OrderedDict()
+_png_digests_lock = threading.Lock()
+
 if not os.path.isdir(DATA_BASE_DIR):
      print(f"[WARNING] DATA_BASE_DIR not found: {DATA_BASE_DIR}")
 if not os.path.isdir(app.static_folder):
      print(f"[WARNING] PLOT_OUTPUT_DIR (static folder) not found: {app.static_folder}")
 
 
-@app.route("/api/available_combinations", methods=["GET"])
-def available_combinations():
+OVERLAY_FILENAME_PATTERN = re.compile(r"overlay_([^_]+)_z(\d+)_(\d+)\.png")
+ZLOC_FOLDER_PATTERN = re.compile(r"z(\d+)m?")
+CATALOG_RECHECK_SECONDS = 5.0
+
+_catalog = None
+_catalog_signature = None
+_catalog_checked_at = 0.0
+_catalog_forced_at = float("-inf")
+_catalog_lock = threading.Lock()
+
+
+def _mtime_or_none(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _subdirs(path):
+    try:
+        return sorted(entry.name for entry in os.scandir(path) if entry.is_dir())
+    except OSError as e:
+        print(f"  Warning: could not list {path}: {e}")
+        return []
+
+
+def build_catalog():
     """
-    Scans the PLOT_OUTPUT_DIR for available pre-generated PNGs
-    and returns the available LODs, Cities, parameters, z-locations,
-    and the list of available winds (indices) for each combo.
-    Includes city center metadata for map initialization.
-    
-    New folder structure:
+    Walks PLOT_OUTPUT_DIR once into the available_combinations response plus an index of
+    (lod, city, param, zloc, wind) -> PNG path. Also records the mtime of every directory walked;
+    adding or removing a PNG changes its zXXm folder's mtime, which is how changes are detected.
+
+    Folder structure:
     output_pngs_overlay/LoD X.X/City Name/Parameter Display Name/zXXm/overlay_PARAM_zXX_N.png
     """
+    started = time.perf_counter()
     results = {}
-    print(f"API: /available_combinations - Scanning PLOT_OUTPUT_DIR: {PLOT_OUTPUT_DIR}")
+    files = {}
+    signature = {PLOT_OUTPUT_DIR: _mtime_or_none(PLOT_OUTPUT_DIR)}
 
-    if not os.path.isdir(PLOT_OUTPUT_DIR):
-        print(f"  Error: Plot output directory not found.")
-        return jsonify({"error": f"Plot output directory not found: {PLOT_OUTPUT_DIR}"}), 404
-
-    filename_pattern = re.compile(r"overlay_([^_]+)_z(\d+)_(\d+)\.png")
-    print(os.listdir(PLOT_OUTPUT_DIR))
-    
-    for lod_name in sorted(os.listdir(PLOT_OUTPUT_DIR)):
+    for lod_name in _subdirs(PLOT_OUTPUT_DIR):
         lod_path = os.path.join(PLOT_OUTPUT_DIR, lod_name)
-        if not os.path.isdir(lod_path): 
-            continue
-
+        signature[lod_path] = _mtime_or_none(lod_path)
         results[lod_name] = {}
-        print(f"  Scanning LOD: {lod_name} at {lod_path}")
-        
-        for city_name in sorted(os.listdir(lod_path)):
-            print(f"    Scanning City: {city_name}")
+
+        for city_name in _subdirs(lod_path):
             city_path = os.path.join(lod_path, city_name)
-            if not os.path.isdir(city_path): 
-                continue
-            print(f"      City Path: {city_path}")
-            
-            city_meta = CITY_INFO.get(city_name, {})
+            signature[city_path] = _mtime_or_none(city_path)
             combos_winds = {}
 
-            for param_display_name in sorted(os.listdir(city_path)):
+            for param_display_name in _subdirs(city_path):
                 param_display_path = os.path.join(city_path, param_display_name)
-                if not os.path.isdir(param_display_path): 
-                    continue
-                
+                signature[param_display_path] = _mtime_or_none(param_display_path)
                 param_code = PARAMETER_MAPPING.get(param_display_name)
                 if not param_code:
-                    print(f"      Warning: Unknown parameter display name '{param_display_name}', skipping")
+                    print(f"  Warning: Unknown parameter display name '{param_display_name}' in {city_path}, skipping")
                     continue
-                
-                print(f"        Scanning Parameter: {param_display_name} (code: {param_code})")
 
-                for zloc_folder_name in sorted(os.listdir(param_display_path)):
-                    zloc_path = os.path.join(param_display_path, zloc_folder_name)
-                    if not os.path.isdir(zloc_path): 
-                        continue
-
-                    zloc_match = re.match(r"z(\d+)m?", zloc_folder_name)
-                    if not zloc_match: 
+                for zloc_folder_name in _subdirs(param_display_path):
+                    zloc_match = ZLOC_FOLDER_PATTERN.match(zloc_folder_name)
+                    if not zloc_match:
                         continue
                     zloc_num_str = zloc_match.group(1)
-                    print(f"          Scanning Z-level: {zloc_folder_name} (z{zloc_num_str})")
+                    zloc_path = os.path.join(param_display_path, zloc_folder_name)
+                    signature[zloc_path] = _mtime_or_none(zloc_path)
 
-                    for fname in os.listdir(zloc_path):
-                        match = filename_pattern.match(fname)
-                        if match:
-                            file_param_code = match.group(1)
-                            file_zloc = match.group(2) 
+                    with os.scandir(zloc_path) as entries:
+                        for entry in entries:
+                            match = OVERLAY_FILENAME_PATTERN.fullmatch(entry.name)
+                            if not match or match.group(1) != param_code or match.group(2) != zloc_num_str:
+                                continue
                             wind_index = int(match.group(3))
-                            
-                            if file_param_code == param_code and file_zloc == zloc_num_str:
-                                combo_key = (param_display_name, zloc_num_str)
-                                if combo_key not in combos_winds:
-                                    combos_winds[combo_key] = []
-                                combos_winds[combo_key].append(wind_index)
-                                print(f"            Found: {fname} -> param={param_display_name}, z={zloc_num_str}, wind={wind_index}")
-
-            if combos_winds:
-                city_combinations_list = []
-                for (param_display, zloc), winds in sorted(combos_winds.items(), key=lambda item: (item[0][0], int(item[0][1]))):
-                    winds.sort()
-                    city_combinations_list.append({
-                        "param": param_display,
-                        "zloc": zloc,
-                        "winds": winds
-                    })
-
-                if city_combinations_list:
-                    results[lod_name][city_name] = {
-                        "combinations": city_combinations_list,
-                        "metadata": city_meta
-                    }
+                            combos_winds.setdefault((param_display_name, zloc_num_str), []).append(wind_index)
+                            files[(lod_name, city_name, param_display_name, zloc_num_str, wind_index)] = entry.path
+
+            city_combinations_list = []
+            for (param_display, zloc), winds in sorted(combos_winds.items(), key=lambda item: (item[0][0], int(item[0][1]))):
+                city_combinations_list.append({
+                    "param": param_display,
+                    "zloc": zloc,
+                    "winds": sorted(winds)
+                })
+            if city_combinations_list:
+                results[lod_name][city_name] = {
+                    "combinations": city_combinations_list,
+                    "metadata": CITY_INFO.get(city_name, {})
+                }
 
     final_results = { lod: cities for lod, cities in results.items() if cities }
-    print(f"API: /available_combinations - Found {len(final_results)} LODs with data.")
-    return jsonify(final_results)
+    body = json.dumps(final_results, sort_keys=True).encode('utf-8')
+    print(f"Catalog: {len(files)} overlays in {len(final_results)} LODs, built in {time.perf_counter() - started:.2f} s")
+    return {
+        "combinations_json": body,
+        "etag": hashlib.sha256(body).hexdigest()[:32],
+        "files": files,
+    }, signature
 
-@app.route("/api/image_info", methods=["GET"])
-def image_info():
+
+def get_catalog(force_check=False):
     """
-    Provides necessary info (image as base64, APPROXIMATE Lat/Lon bounds from CITY_INFO, data range)
-    to display a specific pre-rendered plot image on the map.
-    
-    New folder structure:
-    output_pngs_overlay/LoD X.X/City Name/Parameter Display Name/zXXm/overlay_PARAM_zXX_N.png
+    Returns the overlay catalog, rebuilding it when a directory under PLOT_OUTPUT_DIR has changed.
+    Changes are looked for at most every CATALOG_RECHECK_SECONDS. force_check looks right away,
+    but itself at most once per CATALOG_RECHECK_SECONDS, so unknown keys cannot force a stat walk
+    on every request. Returns None if PLOT_OUTPUT_DIR does not exist.
     """
-    lod = request.args.get("lod")
-    city = request.args.get("city")
-    param_display = request.args.get("param")
-    zloc = request.args.get("zloc") 
-    wind = request.args.get("wind") 
-    print(f"API: /image_info - Request: lod={lod}, city={city}, param={param_display}, zloc={zloc}, wind={wind}")
+    global _catalog, _catalog_signature, _catalog_checked_at, _catalog_forced_at
+    now = time.monotonic()
+    force_check = force_check and now - _catalog_forced_at >= CATALOG_RECHECK_SECONDS
+    if _catalog is not None and not force_check and now - _catalog_checked_at < CATALOG_RECHECK_SECONDS:
+        return _catalog
+    with _catalog_lock:
+        if force_check:
+            _catalog_forced_at = now
+        if not os.path.isdir(PLOT_OUTPUT_DIR):
+            _catalog, _catalog_signature = None, None
+            return None
+        if _catalog is None or any(_mtime_or_none(path) != mtime for path, mtime in _catalog_signature.items()):
+            _catalog, _catalog_signature = build_catalog()
+        _catalog_checked_at = time.monotonic()
+        return _catalog
+
+
+@app.route("/api/available_combinations", methods=["GET"])
+def available_combinations():
+    """
+    Returns the available LODs, Cities, parameters, z-locations, and the list of available
+    winds (indices) for each combo, with city center metadata for map initialization.
+    Served from the in-memory catalog with its content hash as ETag; If-None-Match gets a 304.
+    """
+    catalog = get_catalog()
+    if catalog is None:
+        return jsonify({"error": f"Plot output directory not found: {PLOT_OUTPUT_DIR}"}), 404
+    if catalog["etag"] in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(catalog["combinations_json"], mimetype="application/json")
+    response.set_etag(catalog["etag"])
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
+def png_digest(png_path):
+    """
+    Content hash of a PNG, recomputed only when its size or mtime changes. The
+    PNG_DIGEST_CACHE_SIZE most recently used hashes are kept.
+    """
+    st = os.stat(png_path)
+    signature = (st.st_mtime_ns, st.st_size)
+    with _png_digests_lock:
+        cached = _png_digests.get(png_path)
+        if cached and cached[0] == signature:
+            _png_digests.move_to_end(png_path)
+            return cached[1]
+    h = hashlib.sha256()
+    with open(png_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()[:20]
+    with _png_digests_lock:
+        _png_digests[png_path] = (signature, digest)
+        _png_digests.move_to_end(png_path)
+        while len(_png_digests) > PNG_DIGEST_CACHE_SIZE:
+            _png_digests.popitem(last=False)
+    return digest
+
+
+def selected_overlay(args):
+    """
+    Looks up the overlay PNG of the lod, city, param, zloc and wind query parameters in the catalog.
+    Returns (path, None) or (None, (error message, status)).
+    """
+    lod = args.get("lod")
+    city = args.get("city")
+    param_display = args.get("param")
+    zloc = args.get("zloc")
+    wind = args.get("wind")
     if not all([lod, city, param_display, zloc, wind]):
-        return jsonify({"error": "Missing one or more required query parameters (lod, city, param, zloc, wind)"}), 400
+        return None, ("Missing one or more required query parameters (lod, city, param, zloc, wind)", 400)
     try:
         wind_int = int(wind)
     except ValueError:
-        return jsonify({"error": f"Invalid wind format: '{wind}'. Must be an integer."}), 400
-
-    param_code = PARAMETER_MAPPING.get(param_display)
-    if not param_code:
-        return jsonify({"error": f"Unknown parameter display name: '{param_display}'"}), 400
-
-    plot_filename = f"overlay_{param_code}_z{zloc}_{wind}.png"
-    print(f"  Looking for plot file: {plot_filename}")
-    plot_rel_path = os.path.join(lod, city, param_display, f"z{zloc}m", plot_filename)
-    plot_abs_path = os.path.join(app.static_folder, plot_rel_path)
-    
-    if not os.path.isfile(plot_abs_path):
-        return jsonify({"error": f"Plot image '{plot_filename}' not found at path: {plot_abs_path}"}), 404
-
-    with open(plot_abs_path, 'rb') as img_file:
-        img_bytes = img_file.read()
-        img_base64 = base64.b64encode(img_bytes).decode('utf-8')
-
-    bounds_latlon = None
-    city_meta = CITY_INFO.get(city)
-    if not city_meta or "center_latlon" not in city_meta or "radius_m" not in city_meta:
+        return None, (f"Invalid wind format: '{wind}'. Must be an integer.", 400)
+    if param_display not in PARAMETER_MAPPING:
+        return None, (f"Unknown parameter display name: '{param_display}'", 400)
+
+    key = (lod, city, param_display, zloc, wind_int)
+    catalog = get_catalog()
+    if catalog is not None and key not in catalog["files"]:
+        # The overlay may have been written since the last check.
+        catalog = get_catalog(force_check=True)
+    if catalog is None or key not in catalog["files"]:
+        plot_filename = f"overlay_{PARAMETER_MAPPING[param_display]}_z{zloc}_{wind}.png"
+        return None, (f"Plot image '{plot_filename}' not found for {lod}/{city}/{param_display}/z{zloc}m", 404)
+    return catalog["files"][key], None
+
+
+def requested_level_width(png_path, args):
+    """Pyramid level width for the width (CSS pixels) and dpr query parameters, or None for the original."""
+    try:
+        viewport_width = float(args.get("width", ""))
+        pixel_ratio = float(args.get("dpr", "1") or 1)
+    except ValueError:
+        return None
+    return pyramid.choose_width(pyramid.source_width(png_path), viewport_width, pixel_ratio)
+
+
+@app.route("/api/image_info", methods=["GET"])
+def image_info():
+    """
+    Provides the info needed to display a specific pre-rendered plot image on the map: a
+    content-hashed image_url for /api/image_file, the APPROXIMATE Lat/Lon bounds from CITY_INFO
+    (precomputed per city) and the data range.
+    Optional width (viewport width in CSS pixels) and dpr (device pixel ratio) point image_url at
+    the smallest pyramid level that still fills the viewport instead of the 300 dpi original;
+    image_width is the width of that level, which /api/image_file writes on first request.
+    The original image is only inlined as base64 in image_data when b64=1 is passed.
+
+    Folder structure:
+    output_pngs_overlay/LoD X.X/City Name/Parameter Display Name/zXXm/overlay_PARAM_zXX_N.png
+    """
+    plot_abs_path, error = selected_overlay(request.args)
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    city = request.args.get("city")
+    bounds_latlon = CITY_BOUNDS.get(city)
+    if bounds_latlon is None:
         return jsonify({"error": f"Incomplete configuration for city '{city}'."}), 404
+    if isinstance(bounds_latlon, str):
+        return jsonify({"error": bounds_latlon}), 500
 
-    center_lat, center_lon = city_meta["center_latlon"]
-    radius_m = city_meta["radius_m"]
     try:
-        center_x_rd, center_y_rd = transformer_wgs_to_rd.transform(center_lat, center_lon)
-        min_x_rd, max_x_rd = center_x_rd - radius_m, center_x_rd + radius_m
-        min_y_rd, max_y_rd = center_y_rd - radius_m, center_y_rd + radius_m
-        lon_sw, lat_sw = transformer_rd_to_wgs.transform(min_x_rd, min_y_rd)
-        lon_ne, lat_ne = transformer_rd_to_wgs.transform(max_x_rd, max_y_rd)
-        if not all(np.isfinite(val) for val in [lon_sw, lat_sw, lon_ne, lat_ne]):
-             raise ValueError("Coordinate transformation resulted in non-finite values.")
-        bounds_latlon = [[lat_sw, lon_sw], [lat_ne, lon_ne]]
-    except Exception as e:
-        return jsonify({"error": f"Coordinate transformation/bounds calculation failed: {e}"}), 500
+        level_width = requested_level_width(plot_abs_path, request.args)
+        params = {key: request.args.get(key) for key in ("lod", "city", "param", "zloc", "wind")}
+        params["v"] = png_digest(plot_abs_path)
+        if level_width:
+            params["w"] = level_width
+        image_width = level_width or pyramid.source_width(plot_abs_path)
+        img_base64 = None
+        if request.args.get("b64", "").lower() in ("1", "true", "yes"):
+            with open(plot_abs_path, 'rb') as img_file:
+                img_base64 = base64.b64encode(img_file.read()).decode('utf-8')
+    except OSError as e:
+        return jsonify({"error": f"Could not read plot image {plot_abs_path}: {e}"}), 404
 
     min_val, max_val = 0.0, 1.0
     return jsonify({
+        "image_url": f"/api/wind_assessment/api/image_file?{urlencode(params)}",
         "image_data": img_base64,
+        "image_width": image_width,
         "bounds": bounds_latlon,
         "minVal": min_val,
         "maxVal": max_val
     })
 
+
+@app.route("/api/image_file", methods=["GET"])
+def image_file():
+    """
+    Streams an overlay PNG selected like /api/image_info; with w=<width> its pyramid level instead.
+    The PNG content hash is the ETag (suffixed with the level width) and If-None-Match gets a 304.
+    When v= matches the current hash the response is cached as immutable, otherwise clients revalidate.
+    """
+    plot_abs_path, error = selected_overlay(request.args)
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+    try:
+        digest = png_digest(plot_abs_path)
+        path, etag = plot_abs_path, digest
+        level_width = request.args.get("w", type=int)
+        if level_width in pyramid.LEVEL_WIDTHS and level_width < pyramid.source_width(plot_abs_path):
+            level_path = pyramid.ensure_level(PLOT_OUTPUT_DIR, PYRAMID_DIR, plot_abs_path, level_width)
+            if level_path:
+                path, etag = level_path, f"{digest}-w{level_width}"
+    except OSError:
+        return jsonify({"error": "Plot image not found"}), 404
+
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = send_file(path, mimetype="image/png", etag=False, conditional=False)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = IMAGE_CACHE_CONTROL if request.args.get("v") == digest else "no-cache"
+    return response
+
 if __name__ == "__main__":
+    get_catalog()
     print("\nStarting Flask server...")
     app.run(debug=True, host='0.0.0.0', port=4002)
     
\ No newline at end of file
@@ -0,0 +1,117 @@
+"""
+Downscaled levels of the wind overlay PNGs.
+
+heatmap_gen.py saves every overlay at 300 dpi (about 3000 px wide), far more than a phone or a
+low zoom level can show. For each output_pngs_overlay/<LoD>/<City>/<Param>/zXXm/<overlay>.png
+this keeps one copy per LEVEL_WIDTHS entry narrower than the original, at
+pyramid/<LoD>/<City>/<Param>/zXXm/<overlay>.w<width>.png next to output_pngs_overlay. Copies are
+Lanczos-resampled and quantised to 8-bit palette PNGs. /api/image_info picks the narrowest level
+that covers the client's viewport in device pixels; levels are written on first use, or for all
+overlays with:
+
+python pyramid.py [output_pngs_overlay_dir]
+
+Everything above get_pyramid_dir is the same in backend/noise_assessment/pyramid.py (each service
+is built on its own); change both together.
+"""
+import os
+import sys
+import threading
+from PIL import Image
+
+PYRAMID_DIR_NAME = "pyramid"
+LEVEL_WIDTHS = [256, 512, 1024, 2048]
+
+_widths = {}
+_level_locks = {}
+_lock = threading.Lock()
+
+def source_width(png_path):
+    """Pixel width of png_path, read from its header and cached until the file changes."""
+    mtime_ns = os.stat(png_path).st_mtime_ns
+    cached = _widths.get(png_path)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+    with Image.open(png_path) as image:
+        width = image.width
+    _widths[png_path] = (mtime_ns, width)
+    return width
+
+def choose_width(full_width, viewport_width, pixel_ratio=1.0):
+    """Narrowest level at least viewport_width * pixel_ratio wide, or None to use the full image."""
+    target = viewport_width * max(pixel_ratio, 1.0)
+    for width in LEVEL_WIDTHS:
+        if width >= full_width:
+            return None
+        if width >= target:
+            return width
+    return None
+
+def get_level_path(source_root, cache_root, png_path, width):
+    relative = os.path.relpath(os.path.splitext(os.path.abspath(png_path))[0], os.path.abspath(source_root))
+    return os.path.join(os.path.abspath(cache_root), f"{relative}.w{width}.png")
+
+def is_fresh(png_path, level_path):
+    try:
+        return os.stat(level_path).st_mtime_ns >= os.stat(png_path).st_mtime_ns
+    except OSError:
+        return False
+
+def build_level(png_path, level_path, width):
+    """Writes one downscaled copy of png_path, keeping its aspect ratio."""
+    with Image.open(png_path) as image:
+        image = image.convert('RGBA')
+        height = max(1, round(image.height * width / image.width))
+        level = image.resize((width, height), Image.Resampling.LANCZOS)
+    # The overlays use a few dozen scale colours; a palette PNG keeps the levels small after resampling.
+    level = level.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+    os.makedirs(os.path.dirname(level_path), exist_ok=True)
+    tmp_path = f"{level_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    level.save(tmp_path, format='PNG', optimize=True)
+    os.replace(tmp_path, level_path)
+
+def ensure_level(source_root, cache_root, png_path, width):
+    """
+    Returns the path of an up-to-date level of png_path, writing it if needed; None if it cannot be
+    written. Concurrent callers for the same level wait for a single write; other levels are not blocked.
+    """
+    level_path = get_level_path(source_root, cache_root, png_path, width)
+    if is_fresh(png_path, level_path):
+        return level_path
+    with _lock:
+        level_lock = _level_locks.setdefault(level_path, threading.Lock())
+    with level_lock:
+        if is_fresh(png_path, level_path):
+            return level_path
+        try:
+            build_level(png_path, level_path, width)
+        except OSError as e:
+            print(f"[WARNING] Could not write {width} px level of {png_path}: {e}")
+            return None
+    return level_path
+
+def build_levels(source_root, cache_root, png_path):
+    """Writes every level narrower than png_path, logging instead of raising on failure."""
+    try:
+        full_width = source_width(png_path)
+        widths = [w for w in LEVEL_WIDTHS if w < full_width]
+        for width in widths:
+            ensure_level(source_root, cache_root, png_path, width)
+        print(f"Pyramid for {png_path} ({full_width} px): {widths}")
+    except Exception as e:
+        print(f"[WARNING] Failed to build pyramid for {png_path}: {e}")
+
+def get_pyramid_dir(plot_output_dir):
+    return os.path.join(os.path.dirname(os.path.abspath(plot_output_dir)), PYRAMID_DIR_NAME)
+
+def build_all(plot_output_dir):
+    """Writes every level of every overlay PNG under plot_output_dir."""
+    cache_root = get_pyramid_dir(plot_output_dir)
+    for root, dirs, files in os.walk(plot_output_dir):
+        dirs.sort()
+        for file_name in sorted(files):
+            if file_name.lower().endswith('.png'):
+                build_levels(plot_output_dir, cache_root, os.path.join(root, file_name))
+
+if __name__ == '__main__':
+    build_all(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "output_pngs_overlay"))